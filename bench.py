@@ -0,0 +1,253 @@
+import sys
+import time
+import json
+import random
+import getopt
+import platform
+import numpy
+from libcurvey import *
+from util import *
+
+USAGE = """Usage:
+    python bench.py run [options]
+    python bench.py compare [-t threshold] old.json new.json
+
+run options:
+    -o FILE, --output=FILE      Write JSON results to FILE (default: stdout).
+    -f TEXT, --filter=TEXT      Only run benchmarks whose name contains TEXT.
+    -r N, --repeat=N            Timing repeats per benchmark (default: 3).
+    --degrees=1,2,...           Degrees to run (default: 1-7).
+    --points=10,100,...         Control point counts (default: 10-100000).
+    --dts=0.5,0.1               Parameter steps (default: 0.5,0.1).
+    --quick                     Small grid for a quick check.
+
+compare exits with status 1 if any benchmark is slower than in old.json by
+more than threshold (default: 0.1, i.e. 10%)."""
+
+DEGREES = [1, 2, 3, 4, 5, 6, 7]
+POINTS = [10, 100, 1000, 10000, 100000]
+DTS = [0.5, 0.1]
+
+QUICK_DEGREES = [1, 3, 7]
+QUICK_POINTS = [10, 100, 1000]
+QUICK_DTS = [0.5]
+
+# Keep each repeat running at least this long, calling the benchmark in a loop
+# if needed, so fast operations are not lost in timer noise.
+MIN_TIME = 0.05
+
+def make_spline(degree, n, dt):
+    """
+    Returns a clamped spline of the given degree with n random control points
+    and uniformly spaced interior knots. Seeded, so runs are reproducible.
+    """
+    rand = random.Random(n * 10 + degree)
+    points = [ControlPoint(Point(rand.uniform(-10, 10), rand.uniform(-10, 10)))
+            for i in range(n)]
+    span_count = n - degree
+    knotvec = ([0] * degree + range(1, span_count) + [span_count] * degree)
+    return BSpline(points=points, knotvec=knotvec, degree=degree, dt=dt)
+
+def measure(func, setup=None, repeat=3):
+    """
+    Times func(), running setup() untimed before every call. Returns a dict of
+    the best and median seconds per call over repeat runs, and the number of
+    calls per run.
+    """
+    times = []
+    number = 0
+    for r in range(repeat):
+        elapsed = 0.0
+        calls = 0
+        while elapsed < MIN_TIME or calls < 1:
+            if setup:
+                setup()
+            start = time.time()
+            func()
+            elapsed += time.time() - start
+            calls += 1
+        times.append(elapsed / calls)
+        number = max(number, calls)
+    times.sort()
+    return {'seconds': times[0], 'median': times[len(times) // 2],
+            'repeat': repeat, 'number': number}
+
+def bench_render(degree, n, dt):
+    bs = make_spline(degree, n, dt)
+    return (lambda: bs.render(dt),
+            lambda: bs._invalidate_spans(0, None))
+
+def bench_render_array(degree, n, dt):
+    bs = make_spline(degree, n, dt)
+    return (lambda: bs.render(dt, as_array=True),
+            BSpline.basis_cache.clear)
+
+def bench_render_array_cached(degree, n, dt):
+    bs = make_spline(degree, n, dt)
+    bs.render(dt, as_array=True)
+    return lambda: bs.render(dt, as_array=True), None
+
+def bench_de_boor(degree, n, dt):
+    bs = make_spline(degree, n, dt)
+    return (lambda: bs._de_boor(dt),
+            lambda: bs._invalidate_spans(0, None))
+
+def bench_insert_knot(degree, n, dt):
+    bs = make_spline(degree, n, dt)
+    knot = (n - degree) / 2.0 + 0.5
+    return lambda: bs._insert_knot(knot), bs._tell_polars
+
+def bench_knot_difference(degree):
+    a = KnotVector(range(degree))
+    b = KnotVector(range(1, degree+1))
+    return lambda: KnotVector.difference(a, b), None
+
+def bench_parse_data(n):
+    rand = random.Random(n)
+    lines = ["degree=3", "dt=0.1"]
+    lines.extend("(%f, %f)" % (rand.uniform(-10, 10), rand.uniform(-10, 10))
+            for i in range(n))
+    lines.append("[%s]" % ','.join(str(k) for k in range(n + 2)))
+    return lambda: parse_data(lines), None
+
+def bench_world2canvas(n):
+    rand = random.Random(n)
+    points = [(rand.uniform(-10, 10), rand.uniform(-10, 10)) for i in range(n)]
+    return lambda: world2canvas(points, 640, 320, 32), None
+
+def bench_world2canvas_array(n):
+    rand = numpy.random.RandomState(n)
+    points = rand.uniform(-10, 10, (n, 2))
+    out = numpy.empty_like(points)
+    return lambda: world2canvas_array(points, 640, 320, 32, out=out), None
+
+# name: (factory, parameters, largest control point count). The pure Python
+# paths are capped so that the full grid finishes in reasonable time.
+BENCHMARKS = [
+    ('render', bench_render, ('degree', 'n', 'dt'), 10000),
+    ('render_array', bench_render_array, ('degree', 'n', 'dt'), None),
+    ('render_array_cached', bench_render_array_cached, ('degree', 'n', 'dt'),
+        None),
+    ('de_boor', bench_de_boor, ('degree', 'n', 'dt'), 10000),
+    ('insert_knot', bench_insert_knot, ('degree', 'n', 'dt'), 1000),
+    ('knot_difference', bench_knot_difference, ('degree',), None),
+    ('parse_data', bench_parse_data, ('n',), None),
+    ('world2canvas', bench_world2canvas, ('n',), None),
+    ('world2canvas_array', bench_world2canvas_array, ('n',), None),
+]
+
+def cases(degrees, points, dts):
+    """
+    Yields (key, factory, arguments) for every benchmark and grid point.
+    """
+    for name, factory, params, max_points in BENCHMARKS:
+        seen = set()
+        for degree in degrees:
+            for n in points:
+                if n <= degree or (max_points and n > max_points):
+                    continue
+                for dt in dts:
+                    values = {'degree': degree, 'n': n, 'dt': dt}
+                    args = tuple(values[p] for p in params)
+                    if args in seen:
+                        continue
+                    seen.add(args)
+                    key = "%s[%s]" % (name, ','.join("%s=%s" % (p, values[p])
+                        for p in params))
+                    yield key, factory, args
+
+def run(degrees=DEGREES, points=POINTS, dts=DTS, repeat=3, name_filter=None,
+        log=None):
+    """
+    Runs the benchmark grid. Returns a dict ready to be dumped as JSON.
+    """
+    results = {}
+    for key, factory, args in cases(degrees, points, dts):
+        if name_filter and name_filter not in key:
+            continue
+        func, setup = factory(*args)
+        results[key] = measure(func, setup, repeat)
+        if log:
+            print >> log, "%-50s %12.6fs" % (key, results[key]['seconds'])
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def compare(old, new, threshold=0.1):
+    """
+    Compares two run() results. Returns a list of (key, old seconds, new
+    seconds, ratio, regressed) for the benchmarks in both, sorted by key.
+    """
+    rows = []
+    for key in sorted(set(old['results']) & set(new['results'])):
+        before = old['results'][key]['seconds']
+        after = new['results'][key]['seconds']
+        ratio = after / before if before else float('inf')
+        rows.append((key, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+def _split(value, kind):
+    return [kind(v) for v in value.split(',') if v]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('run', 'compare'):
+        print >> sys.stderr, USAGE
+        return 2
+
+    if argv[1] == 'compare':
+        opts, args = getopt.getopt(argv[2:], 't:', ['threshold='])
+        threshold = 0.1
+        for opt, value in opts:
+            threshold = float(value)
+        if len(args) != 2:
+            print >> sys.stderr, USAGE
+            return 2
+        old = json.load(open(args[0]))
+        new = json.load(open(args[1]))
+        regressions = 0
+        for key, before, after, ratio, regressed in compare(old, new,
+                threshold):
+            print "%-50s %12.6fs %12.6fs %7.2fx%s" % (key, before, after,
+                    ratio, "  REGRESSION" if regressed else "")
+            regressions += regressed
+        return 1 if regressions else 0
+
+    opts, args = getopt.getopt(argv[2:], 'o:f:r:', ['output=', 'filter=',
+        'repeat=', 'degrees=', 'points=', 'dts=', 'quick'])
+    output = None
+    kwargs = {}
+    for opt, value in opts:
+        if opt in ('-o', '--output'):
+            output = value
+        elif opt in ('-f', '--filter'):
+            kwargs['name_filter'] = value
+        elif opt in ('-r', '--repeat'):
+            kwargs['repeat'] = int(value)
+        elif opt == '--degrees':
+            kwargs['degrees'] = _split(value, int)
+        elif opt == '--points':
+            kwargs['points'] = _split(value, int)
+        elif opt == '--dts':
+            kwargs['dts'] = _split(value, float)
+        elif opt == '--quick':
+            kwargs.setdefault('degrees', QUICK_DEGREES)
+            kwargs.setdefault('points', QUICK_POINTS)
+            kwargs.setdefault('dts', QUICK_DTS)
+
+    results = run(log=sys.stderr, **kwargs)
+    if output:
+        f = open(output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
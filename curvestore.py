@@ -0,0 +1,153 @@
+import os
+import sys
+import mmap
+import struct
+import numpy
+from libcurvey import *
+from util import *
+
+# Binary curve store layout (little-endian):
+#
+#   header      magic, curve count (uint64), index offset (uint64)
+#   payloads    per curve: n_points*2 float64 control point coordinates, then
+#               n_knots float64 knots. Every payload starts 8-byte aligned.
+#   index       per curve: payload offset (uint64), degree, n_points, n_knots
+#               (uint32 each) and dt (float64)
+#
+# The index goes after the payloads so that curves can be written as they are
+# streamed in, without knowing how many there will be.
+
+MAGIC = 'CURVEY\x00\x01'
+HEADER = struct.Struct('<8sQQ')
+INDEX_DTYPE = numpy.dtype([('offset', '<u8'), ('degree', '<u4'),
+    ('n_points', '<u4'), ('n_knots', '<u4'), ('dt', '<f8')])
+
+class CurveStoreException(Exception):
+    pass
+
+def write_store(filename, curves):
+    """
+    Writes curves (BSplines or CompactBSplines) to a binary curve store.
+    Returns the number of curves written.
+    """
+    index = []
+    f = open(filename, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for curve in curves:
+            if isinstance(curve, BSpline):
+                curve = CompactBSpline.from_bspline(curve)
+            offset = f.tell()
+            f.write(curve.points.astype('<f8').tobytes())
+            f.write(curve.knots.astype('<f8').tobytes())
+            index.append((offset, curve.degree, len(curve.points),
+                len(curve.knots), curve.dt))
+
+        index_offset = f.tell()
+        f.write(numpy.array(index, dtype=INDEX_DTYPE).tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(index), index_offset))
+    finally:
+        f.close()
+    return len(index)
+
+def convert(data_filename, store_filename):
+    """
+    Converts a (possibly multi-curve) text data file to a binary curve store.
+    Returns the number of curves converted.
+    """
+    return write_store(store_filename, read_curves(filename=data_filename))
+
+class CurveStore(object):
+    """
+    Read-only, memory-mapped binary curve store.
+
+    points(i) and knots(i) are numpy views straight into the mapped file, so
+    loading a curve copies nothing. store[i] builds a BSpline only when it is
+    accessed. Views must not be used after close().
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        try:
+            # mmap refuses empty files with a bare ValueError.
+            if os.fstat(self._file.fileno()).st_size < HEADER.size:
+                raise CurveStoreException("%s is not a curve store" %
+                        filename)
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+        magic, count, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise CurveStoreException("%s is not a curve store" % filename)
+        if index_offset + count * INDEX_DTYPE.itemsize > len(self._map):
+            self.close()
+            raise CurveStoreException("%s is truncated" % filename)
+
+        self.index = numpy.frombuffer(self._map, dtype=INDEX_DTYPE,
+                count=count, offset=index_offset)
+
+    def __len__(self):
+        return len(self.index)
+
+    def points(self, i):
+        """
+        Returns the control points of curve i as an (n, 2) float64 view.
+        """
+        entry = self.index[i]
+        return numpy.frombuffer(self._map, dtype='<f8',
+                count=2*int(entry['n_points']),
+                offset=int(entry['offset'])).reshape((-1, 2))
+
+    def knots(self, i):
+        """
+        Returns the knot vector of curve i as a float64 view.
+        """
+        entry = self.index[i]
+        return numpy.frombuffer(self._map, dtype='<f8',
+                count=int(entry['n_knots']),
+                offset=int(entry['offset']) + 16*int(entry['n_points']))
+
+    def compact(self, i):
+        """
+        Returns curve i as a CompactBSpline backed by the mapped file.
+        """
+        entry = self.index[i]
+        return CompactBSpline(self.points(i), self.knots(i),
+                int(entry['degree']), float(entry['dt']))
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("curve index out of range")
+        return self.compact(i).to_bspline()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.index = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main(argv):
+    if len(argv) != 3:
+        print >> sys.stderr, "Usage: python curvestore.py infile.data outfile"
+        return 2
+    count = convert(argv[1], argv[2])
+    print "Converted %d curves" % count
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
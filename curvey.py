@@ -1,14 +1,24 @@
 import sys
-import getopt
-import uitk
-import uicmd
+
+# Front ends are imported only when chosen, so that modes without a display
+# do not pay for loading Tkinter.
 
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == '--ui':
+        import uitk
         uitk.main(sys.argv)
+    elif len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        import uibatch
+        sys.exit(uibatch.main(sys.argv[1:]))
+    elif len(sys.argv) > 1 and sys.argv[1] in ('serve', '--serve'):
+        import uiserve
+        sys.exit(uiserve.main(sys.argv[1:]))
     elif len(sys.argv) > 1:
+        import uicmd
         uicmd.main(sys.argv)
     else:
         print "Curvey usage"
         print "1) python curvey.py infile.data"
         print "2) python curvey.py --ui"
+        print "3) python curvey.py --batch indir|manifest outfile"
+        print "4) python curvey.py serve socket"
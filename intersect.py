@@ -0,0 +1,336 @@
+import math
+from libcurvey import *
+
+# A Bezier piece is flat when all its control points are within FLATNESS
+# times its chord length of the chord.
+FLATNESS = 0.01
+
+# Newton steps tried on a pair of flat pieces before subdividing further.
+NEWTON_STEPS = 12
+
+# Deepest subdivision of a Bezier segment. Bounds the work on tangential and
+# overlapping curves.
+MAX_DEPTH = 40
+
+# Points sampled along a pair of flat pieces to decide whether they overlap.
+OVERLAP_SAMPLES = 8
+
+def intersect_curves(a, b, tolerance=1e-9):
+    """
+    Returns the intersections of the BSplines a and b as a sorted list of
+    (ta, tb, (x, y)): the parameter of the intersection on each curve and the
+    point, which is within tolerance of both curves.
+
+    The curves are split into Bezier segments. Pairs of pieces whose control
+    point boxes, which contain them by the convex hull property, do not
+    overlap are pruned. The rest are subdivided until they are flat, and
+    then Newton's method finds the intersection. Where the curves overlap,
+    the two ends of each overlapping stretch are reported.
+
+    Throws InvalidBSplineException if either spline is not valid.
+    """
+    return _intersect(_pieces(a), _pieces(b), tolerance)
+
+def intersect_line(bspline, p0, p1, tolerance=1e-9):
+    """
+    Returns the intersections of the BSpline with the line segment from p0
+    to p1 as a sorted list of (t, u, (x, y)), where u runs from 0 at p0 to 1
+    at p1. See intersect_curves().
+    """
+    line = [(0.0, 1.0, [(float(p0[0]), float(p0[1])),
+        (float(p1[0]), float(p1[1]))])]
+    return _intersect(_pieces(bspline), line, tolerance)
+
+def _pieces(bspline):
+    """
+    Returns the Bezier segments of bspline as (t0, t1, points) with points a
+    list of float (x, y) tuples.
+    """
+    return [(t0, t1, [(float(x), float(y)) for x, y in points])
+            for t0, t1, points in bspline.bezier_segments()]
+
+def _intersect(pieces_a, pieces_b, tolerance):
+    found = []
+    overlaps = []
+    stack = [(a, b, 0) for a in pieces_a for b in pieces_b]
+    while stack:
+        a, b, depth = stack.pop()
+        box_a = _box(a[2])
+        box_b = _box(b[2])
+        if not (box_a[0] <= box_b[2] + tolerance and
+                box_b[0] <= box_a[2] + tolerance and
+                box_a[1] <= box_b[3] + tolerance and
+                box_b[1] <= box_a[3] + tolerance):
+            continue
+        if (_separated(a[2], b[2], tolerance) or
+                _separated(b[2], a[2], tolerance)):
+            continue
+
+        small = (_box_size(box_a) <= tolerance and
+                _box_size(box_b) <= tolerance)
+        if small or depth >= MAX_DEPTH:
+            if small:
+                found.append(_midpoint_intersection(a, b))
+            continue
+
+        if _is_flat(a[2]) and _is_flat(b[2]):
+            overlap = _overlap(a, b, tolerance)
+            if overlap is not None:
+                overlaps.append(overlap)
+                continue
+            # Nearly parallel flat pieces may still cross twice, so only a
+            # hit between pieces at an angle settles the pair. Otherwise the
+            # halves find it again.
+            hit = _newton(a, b, tolerance)
+            if hit is not None and not _chords_parallel(a[2], b[2]):
+                found.append(hit)
+                continue
+
+        # Split the larger piece, or both if they are about the same size.
+        size_a, size_b = _box_size(box_a), _box_size(box_b)
+        halves_a = _split(a) if size_a >= size_b / 2 else [a]
+        halves_b = _split(b) if size_b >= size_a / 2 else [b]
+        for ha in halves_a:
+            for hb in halves_b:
+                stack.append((ha, hb, depth + 1))
+
+    return _merge(found, _merge_overlaps(overlaps, tolerance), tolerance)
+
+def _box(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _box_size(box):
+    return max(box[2] - box[0], box[3] - box[1])
+
+def _split(piece):
+    """
+    Splits a Bezier piece in half with de Casteljau's algorithm, which is
+    the same as inserting the middle knot degree times.
+    """
+    t0, t1, points = piece
+    left = [points[0]]
+    right = [points[-1]]
+    level = points
+    while len(level) > 1:
+        level = [((p[0] + q[0]) / 2.0, (p[1] + q[1]) / 2.0)
+                for p, q in zip(level, level[1:])]
+        left.append(level[0])
+        right.append(level[-1])
+    right.reverse()
+    middle = (t0 + t1) / 2.0
+    return [(t0, middle, left), (middle, t1, right)]
+
+def _is_flat(points):
+    """
+    Returns true if every control point is within FLATNESS times the chord
+    length of the chord.
+    """
+    (x0, y0), (x1, y1) = points[0], points[-1]
+    dx, dy = x1 - x0, y1 - y0
+    length = math.sqrt(dx*dx + dy*dy)
+    if length == 0:
+        return False
+    for x, y in points[1:-1]:
+        if abs((x - x0)*dy - (y - y0)*dx) > FLATNESS * length * length:
+            return False
+    return True
+
+def _chords_parallel(a, b):
+    ax, ay = a[-1][0] - a[0][0], a[-1][1] - a[0][1]
+    bx, by = b[-1][0] - b[0][0], b[-1][1] - b[0][1]
+    cross = ax*by - ay*bx
+    return abs(cross) <= FLATNESS * math.sqrt((ax*ax + ay*ay) * (bx*bx + by*by))
+
+def _separated(a, b, tolerance):
+    """
+    Returns true if the control points of b all lie on one side of the strip
+    parallel to the chord of a that holds the control points of a, more than
+    tolerance away from it. The pieces then cannot meet, by the convex hull
+    property.
+    """
+    (x0, y0), (x1, y1) = a[0], a[-1]
+    dx, dy = x1 - x0, y1 - y0
+    length = math.sqrt(dx*dx + dy*dy)
+    if length == 0:
+        return False
+    da = [((x - x0)*dy - (y - y0)*dx) / length for x, y in a]
+    db = [((x - x0)*dy - (y - y0)*dx) / length for x, y in b]
+    return min(db) > max(da) + tolerance or max(db) < min(da) - tolerance
+
+def _overlap(a, b, tolerance):
+    """
+    Returns the ends of the overlap of two pieces, as a sorted pair of
+    (ta, tb, point), if every sampled point of one of them is within
+    tolerance of the other. Returns None otherwise.
+    """
+    for inner, outer, swap in ((b, a, False), (a, b, True)):
+        samples = [_evaluate(inner[2], j / float(OVERLAP_SAMPLES))[0]
+                for j in range(OVERLAP_SAMPLES + 1)]
+        if not all(_project(outer[2], p)[2] <= tolerance for p in samples):
+            continue
+        ends = []
+        for s, p in ((0.0, samples[0]), (1.0, samples[-1])):
+            u, q, d = _project(outer[2], p)
+            t_inner = inner[0] + s*(inner[1] - inner[0])
+            t_outer = outer[0] + u*(outer[1] - outer[0])
+            point = ((p[0] + q[0]) / 2.0, (p[1] + q[1]) / 2.0)
+            if swap:
+                ends.append((t_inner, t_outer, point))
+            else:
+                ends.append((t_outer, t_inner, point))
+        ends.sort()
+        return tuple(ends)
+    return None
+
+def _project(points, q):
+    """
+    Returns (s, point, distance) for the point of the Bezier curve with the
+    given control points closest to q: the best of a few samples, refined by
+    Gauss-Newton steps.
+    """
+    qx, qy = q
+    best = None
+    for j in range(OVERLAP_SAMPLES + 1):
+        s = j / float(OVERLAP_SAMPLES)
+        px, py = _evaluate(points, s)[0]
+        d = (px - qx) ** 2 + (py - qy) ** 2
+        if best is None or d < best[0]:
+            best = (d, s)
+
+    s = best[1]
+    for step in range(NEWTON_STEPS):
+        (px, py), (dx, dy) = _evaluate(points, s)
+        speed = dx*dx + dy*dy
+        if speed == 0:
+            break
+        s_new = min(max(s - ((px - qx)*dx + (py - qy)*dy) / speed, 0.0), 1.0)
+        if abs(s_new - s) < 1e-15:
+            s = s_new
+            break
+        s = s_new
+    px, py = _evaluate(points, s)[0]
+    return s, (px, py), math.sqrt((px - qx) ** 2 + (py - qy) ** 2)
+
+def _evaluate(points, s):
+    """
+    Returns the point and first derivative of the Bezier curve with the
+    given control points at s, by de Casteljau's algorithm.
+    """
+    level = points
+    while len(level) > 2:
+        level = [(p[0] + s*(q[0] - p[0]), p[1] + s*(q[1] - p[1]))
+                for p, q in zip(level, level[1:])]
+    if len(level) == 1:
+        return level[0], (0.0, 0.0)
+    (px, py), (qx, qy) = level
+    d = len(points) - 1
+    return (px + s*(qx - px), py + s*(qy - py)), (d*(qx - px), d*(qy - py))
+
+def _newton(a, b, tolerance):
+    """
+    Newton's method on A(s) - B(u) = 0 for two flat pieces, starting from
+    the intersection of their chords. Returns (ta, tb, point), or None if it
+    does not converge inside both pieces.
+    """
+    pa, pb = a[2], b[2]
+    s, u = _chord_intersection(pa, pb)
+    for step in range(NEWTON_STEPS):
+        (ax, ay), (dax, day) = _evaluate(pa, s)
+        (bx, by), (dbx, dby) = _evaluate(pb, u)
+        fx, fy = ax - bx, ay - by
+        if math.sqrt(fx*fx + fy*fy) <= tolerance:
+            if -1e-9 <= s <= 1 + 1e-9 and -1e-9 <= u <= 1 + 1e-9:
+                s = min(max(s, 0.0), 1.0)
+                u = min(max(u, 0.0), 1.0)
+                return (a[0] + s*(a[1] - a[0]), b[0] + u*(b[1] - b[0]),
+                        ((ax + bx) / 2.0, (ay + by) / 2.0))
+            return None
+
+        # Solve [dA, -dB] (ds, du) = -F.
+        det = -dax*dby + day*dbx
+        if det == 0:
+            return None
+        ds = (-fx*(-dby) + fy*(-dbx)) / det
+        du = (-dax*fy + day*fx) / det
+        s += ds
+        u += du
+        if not (-0.5 <= s <= 1.5 and -0.5 <= u <= 1.5):
+            return None
+    return None
+
+def _chord_intersection(a, b):
+    """
+    Returns the (s, u) parameters at which the chords of a and b cross,
+    clamped to [0, 1], or (0.5, 0.5) if the chords are parallel.
+    """
+    (ax0, ay0), (ax1, ay1) = a[0], a[-1]
+    (bx0, by0), (bx1, by1) = b[0], b[-1]
+    rx, ry = ax1 - ax0, ay1 - ay0
+    qx, qy = bx1 - bx0, by1 - by0
+    det = rx*qy - ry*qx
+    if det == 0:
+        return 0.5, 0.5
+    wx, wy = bx0 - ax0, by0 - ay0
+    s = (wx*qy - wy*qx) / det
+    u = (wx*ry - wy*rx) / det
+    return min(max(s, 0.0), 1.0), min(max(u, 0.0), 1.0)
+
+def _midpoint_intersection(a, b):
+    """
+    Returns the intersection of two pieces smaller than the tolerance: the
+    middle of each in parameter and the point halfway between them.
+    """
+    ax, ay = _evaluate(a[2], 0.5)[0]
+    bx, by = _evaluate(b[2], 0.5)[0]
+    return ((a[0] + a[1]) / 2.0, (b[0] + b[1]) / 2.0,
+            ((ax + bx) / 2.0, (ay + by) / 2.0))
+
+def _merge_overlaps(overlaps, tolerance):
+    """
+    Joins the overlaps of neighbouring pairs of pieces into stretches, each
+    a (start, end) pair of (ta, tb, point). The end of one overlap and the
+    start of the next are joined if within 10 * tolerance of each other.
+    """
+    overlaps.sort()
+    merged = []
+    for start, end in overlaps:
+        if merged:
+            last_start, last_end = merged[-1]
+            if (start[0] <= last_end[0] or
+                    _distance(start[2], last_end[2]) <= 10 * tolerance):
+                if end[0] > last_end[0]:
+                    merged[-1] = (last_start, end)
+                continue
+        merged.append((start, end))
+    return merged
+
+def _merge(found, stretches, tolerance):
+    """
+    Sorts intersections and drops the ones found twice, from neighbouring
+    pieces: those within 10 * tolerance of the previous one kept. Crossings
+    inside an overlapping stretch give way to the ends of the stretch.
+    """
+    def inside(hit, start, end):
+        return (start[0] <= hit[0] <= end[0] and
+                min(start[1], end[1]) <= hit[1] <= max(start[1], end[1]))
+
+    found = [hit for hit in found if not any(inside(hit, start, end) for
+        start, end in stretches)]
+    for start, end in stretches:
+        found.extend((start, end))
+    found.sort()
+    merged = []
+    for hit in found:
+        duplicate = False
+        for other in merged[-4:]:
+            if _distance(hit[2], other[2]) <= 10 * tolerance:
+                duplicate = True
+                break
+        if not duplicate:
+            merged.append(hit)
+    return merged
+
+def _distance(p, q):
+    return math.sqrt((p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2)
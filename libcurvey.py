@@ -3,11 +3,51 @@
 import sys
 import math
 import time
+import bisect
+import threading
+import collections
+import numpy
 from util import *
 
 DEBUG = False
 
+# Number of parameter values evaluated at once by the vectorized de Boor
+# recurrence. Bounds the size of the temporary arrays.
+EVALUATE_CHUNK = 65536
+
+# Most basis matrix weights (samples x (degree+1)) BSpline.basis_cache holds
+# in all. A matrix larger than this on its own is built but not cached.
+BASIS_CACHE_NONZEROS = 1 << 21
+
+# Deepest bisection of a knot span by adaptive tessellation. A span is never
+# cut into more than 2**TESSELLATE_MAX_DEPTH pieces.
+TESSELLATE_MAX_DEPTH = 16
+
+# Resolution polar coordinates are quantized to for the polar index. Matches
+# the default epsilon of util.epsilon_equals.
+POLAR_EPSILON = 0.0001
+
+# The arc-length table starts from ARC_LENGTH_PIECES pieces per knot span
+# and integrates the speed over each with ARC_LENGTH_NODES point
+# Gauss-Legendre quadrature. A piece is halved until the halves add up to
+# the whole within ARC_LENGTH_TOLERANCE of the curve's length, prorated by
+# the piece's share of the parameter range, or ARC_LENGTH_MAX_DEPTH halvings.
+# t_at_length() takes at most ARC_LENGTH_NEWTON_STEPS Newton steps within a
+# piece.
+ARC_LENGTH_PIECES = 4
+ARC_LENGTH_NODES = 5
+ARC_LENGTH_TOLERANCE = 1e-10
+ARC_LENGTH_MAX_DEPTH = 40
+ARC_LENGTH_NEWTON_STEPS = 8
+
+# Number of tolerances (zoom levels) whose per-span tessellations
+# tessellate_view() keeps.
+LOD_CACHE_LEVELS = 8
+
 class BSpline(object):
+    # Basis matrices of the dt grid, shared by every spline. See BasisCache.
+    basis_cache = None
+
     def __init__(self, points=None, knotvec=None, degree=None, dt=None):
         # A list of Points. Listed in order of user insertion.
         # So the curve is rendered based on the order of points.
@@ -19,14 +59,41 @@ class BSpline(object):
         if type(knotvec) == type([]):
             self._internal_knotvec = KnotVector(knotvec)
             self.user_knotvec = KnotVector(knotvec)
-        elif type(knotvec) == ControlPoint:
+        elif type(knotvec) == KnotVector:
             self._internal_knotvec = knotvec.copy()
             self.user_knotvec = knotvec.copy()
         else:
             self._internal_knotvec = KnotVector()
             self.user_knotvec = KnotVector()
 
-    def render(self, dt=None):
+        # Drawing points cached per knot span, so that editing one control
+        # point only re-evaluates the spans it affects. _span_samples holds
+        # the (span, parameters) groups of the dt grid for _span_cache_key.
+        self._span_cache = {}
+        self._span_cache_key = None
+        self._span_samples = []
+
+        # Internal points by _polar_key of their polar coordinates, and the
+        # _internal_points list the index was built for.
+        self._polar_index = {}
+        self._polar_index_points = None
+
+        # Bezier decomposition and its power basis coefficients, built by
+        # _build_segments() and dropped with the span cache.
+        self._segments = None
+
+        # (parameters, cumulative lengths) built by _arc_length_table() and
+        # dropped with the span cache.
+        self._arc_length = None
+
+        # Adaptive tessellation points of each knot span by tolerance, for
+        # the LOD_CACHE_LEVELS tolerances used last, and the (spans, ends,
+        # lows, highs) tessellate_view() culls with, built by
+        # _build_view_spans(). Both are dropped with the span cache.
+        self._lod_cache = collections.OrderedDict()
+        self._view_spans = None
+
+    def render(self, dt=None, as_array=False, tolerance=None, box=None):
         """
         Runs the de Boor algorithm.
 
@@ -35,7 +102,16 @@ class BSpline(object):
             The list of control points in polar coordinates.
             The list of points to be connected to represent the curve.
 
-        Throws InvalidBSplineException is the spline is not in a valid state for
+        If as_array is True, the points to be connected are evaluated in one
+        vectorized pass and returned as an (N, 2) numpy array instead of a list
+        of tuples.
+
+        If tolerance is given, dt is ignored and the points to be connected
+        are an adaptive tessellation of the curve instead: see tessellate().
+        If box is given too, only the part of the curve inside box is
+        tessellated: see tessellate_view().
+
+        Returns empty lists if the spline is not in a valid state for
         rendering. Possible invalid states:
             
             Number of control points not matching the number of knots in the
@@ -45,22 +121,422 @@ class BSpline(object):
         if not self.is_valid():
             return [], [], []
 
-        self._de_boor()
-
         dt = dt if dt else self.dt
         control_points = []
         control_point_polars = []
-        points = []
+
+        if tolerance and box is not None:
+            self._tell_polars()
+            points = self.tessellate_view(tolerance, box)
+            if not as_array:
+                points = [tuple(p) for p in points.tolist()]
+        elif tolerance:
+            self._tell_polars()
+            points = self.tessellate(tolerance)
+            if as_array:
+                points = numpy.array(points, dtype=numpy.float64)
+        elif as_array:
+            self._tell_polars()
+            if self._is_empty():
+                points = numpy.zeros((0, 2))
+            else:
+                basis = BSpline.basis_cache.get(self.user_knotvec.vec,
+                        self.degree, dt)
+                points = basis.dot(self._points_array())
+        else:
+            self._de_boor(dt)
+            points = []
+            for p in self._internal_points:
+                x, y = p.x(), p.y()
+                points.append((x,y))
 
         for p in self.user_points:
             x, y = p.x(), p.y()
             control_point_polars.append(p.polar().knots())
             control_points.append((x,y))
 
-        for p in self._internal_points:
-            x, y = p.x(), p.y()
-            points.append((x,y))
+        return control_points, control_point_polars, points
+
+    def evaluate(self, ts):
+        """
+        Evaluates the spline at every parameter value in ts (a sequence or
+        numpy array). Returns an (N, 2) numpy array of points.
+
+        Parameter values outside of the spline's range are evaluated on the
+        first or last knot span. A spline whose parameter range is empty has
+        no points, and gives a (0, 2) array.
+
+        Throws InvalidBSplineException if the spline is not valid.
+        """
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid for evaluation.")
+        if self._is_empty():
+            return numpy.zeros((0, 2))
+
+        knots = numpy.array(self.user_knotvec.vec, dtype=numpy.float64)
+        return _de_boor_array(self._points_array(), knots, self.degree, ts)
+
+    def tessellate(self, tolerance):
+        """
+        Returns a polyline approximating the curve as a list of (x, y) points.
+
+        Each knot span is bisected in parameter space until every piece is
+        within tolerance (in world units) of its chord, so flat parts of the
+        curve get few points and tight bends get many.
+        """
+        if not self.is_valid():
+            return []
+
+        knots = [float(k) for k in self.user_knotvec]
+        xs = [float(cp.x()) for cp in self.user_points]
+        ys = [float(cp.y()) for cp in self.user_points]
+        first, last = _knot_span_range(knots, self.degree)
+        if first is None:
+            return []
+
+        points = [self._de_boor_point(knots[first], knots, xs, ys, first,
+            last)]
+        for k in range(first, last+1):
+            points.extend(self._tessellate_span(k, tolerance, knots, xs, ys,
+                first, last))
+        return points
+
+    def tessellate_view(self, tolerance, box=None):
+        """
+        Returns an (N, 2) numpy array polyline approximating the curve within
+        tolerance (in world units), like tessellate(), for drawing the part of
+        the curve inside box (xmin, ymin, xmax, ymax). With no box, the whole
+        curve is tessellated.
+
+        Knot spans whose control points' bounding box misses box are not
+        tessellated but drawn as their chord, which by the convex hull
+        property lies outside box too. Spans only partly inside box are
+        clipped the same way, piece by piece, so that at deep zoom only the
+        visible part of a span is tessellated. The points of each span
+        inside box are cached for the LOD_CACHE_LEVELS tolerances used last,
+        so that panning at one zoom level only tessellates spans coming into
+        view.
+        """
+        if not self.is_valid():
+            return numpy.zeros((0, 2))
+        if self._view_spans is None:
+            self._view_spans = self._build_view_spans()
+        spans, ends, lows, highs = self._view_spans
+        if not len(spans):
+            return numpy.zeros((0, 2))
+
+        if box is None:
+            visible = numpy.arange(len(spans))
+        else:
+            visible = numpy.flatnonzero((lows[:, 0] <= box[2]) &
+                    (highs[:, 0] >= box[0]) & (lows[:, 1] <= box[3]) &
+                    (highs[:, 1] >= box[1]))
+
+        # Most recently used tolerance last.
+        cache = self._lod_cache.pop(tolerance, None)
+        if cache is None:
+            cache = {}
+        self._lod_cache[tolerance] = cache
+        while len(self._lod_cache) > LOD_CACHE_LEVELS:
+            self._lod_cache.popitem(last=False)
+
+        knots = xs = ys = None
+        first, last = spans[0], spans[-1]
+        # ends[j] and ends[j+1] are the ends of spans[j]. Culled spans only
+        # add their end point; previous is the last end point added.
+        pieces = [ends[:1]]
+        previous = 0
+        for j in visible.tolist():
+            k = int(spans[j])
+            points = cache.get(k)
+            if points is None:
+                if knots is None:
+                    knots = [float(knot) for knot in self.user_knotvec]
+                    xs = [float(cp.x()) for cp in self.user_points]
+                    ys = [float(cp.y()) for cp in self.user_points]
+                if box is None or _box_contains(box, lows[j], highs[j]):
+                    points = cache[k] = numpy.array(self._tessellate_span(k,
+                        tolerance, knots, xs, ys, first, last),
+                        dtype=numpy.float64).reshape((-1, 2))
+                else:
+                    # Partly visible. Depends on box, so not cached.
+                    points = numpy.array(self._tessellate_span_in_box(k,
+                        tolerance, box, knots, xs, ys, first, last),
+                        dtype=numpy.float64).reshape((-1, 2))
+            pieces.append(ends[previous+1:j+1])
+            pieces.append(points)
+            previous = j + 1
+        pieces.append(ends[previous+1:])
+        return numpy.concatenate(pieces)
+
+    def refine(self, knots):
+        """
+        Returns a new, equivalent BSpline with every knot in knots inserted
+        into the knot vector, and so with len(knots) more control points.
+
+        All knots are inserted in one pass with Boehm's algorithm (batch knot
+        refinement), which costs O((n + k) * degree) for k knots instead of
+        one _insert_knot per knot.
+
+        Throws InvalidBSplineException if the spline is not valid, and
+        IllegalKnotVectorException if a knot is outside the parameter range.
+        """
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid for refinement.")
+
+        p = self.degree
+        inserted = sorted(float(k) for k in knots)
+        xs = [float(cp.x()) for cp in self.user_points]
+        ys = [float(cp.y()) for cp in self.user_points]
+        if not inserted:
+            return BSpline(points=[ControlPoint(Point(x, y)) for x, y in
+                zip(xs, ys)], knotvec=list(self.user_knotvec.vec), degree=p,
+                dt=self.dt)
+
+        # Boehm's algorithm is written for the usual knot vector of n+p+1
+        # knots. Ours leaves out the first and last knots, which do not affect
+        # the curve, so pad with copies of the end knots.
+        u = [float(k) for k in self.user_knotvec]
+        u = [u[0]] + u + [u[-1]]
+        n = len(xs) - 1
+        r = len(inserted) - 1
+        m = n + p + 1
+        if inserted[0] < u[p] or inserted[-1] > u[n+1]:
+            raise IllegalKnotVectorException(
+                    "Knots outside of the parameter range [%s, %s]."
+                    % (u[p], u[n+1]))
+
+        a = min(bisect.bisect_right(u, inserted[0]) - 1, n)
+        b = min(bisect.bisect_right(u, inserted[-1]) - 1, n) + 1
+
+        qx = [0.0] * (n + r + 2)
+        qy = [0.0] * (n + r + 2)
+        ubar = [0.0] * (m + r + 2)
+        for j in range(0, a-p+1):
+            qx[j], qy[j] = xs[j], ys[j]
+        for j in range(b-1, n+1):
+            qx[j+r+1], qy[j+r+1] = xs[j], ys[j]
+        for j in range(0, a+1):
+            ubar[j] = u[j]
+        for j in range(b+p, m+1):
+            ubar[j+r+1] = u[j]
+
+        i = b + p - 1
+        k = b + p + r
+        for j in range(r, -1, -1):
+            x = inserted[j]
+            while x <= u[i] and i > a:
+                qx[k-p-1], qy[k-p-1] = xs[i-p-1], ys[i-p-1]
+                ubar[k] = u[i]
+                k -= 1
+                i -= 1
+            qx[k-p-1], qy[k-p-1] = qx[k-p], qy[k-p]
+            for l in range(1, p+1):
+                ind = k - p + l
+                alpha = ubar[k+l] - x
+                if alpha == 0:
+                    qx[ind-1], qy[ind-1] = qx[ind], qy[ind]
+                else:
+                    alpha = alpha / (ubar[k+l] - u[i-p+l])
+                    qx[ind-1] = alpha * qx[ind-1] + (1.0 - alpha) * qx[ind]
+                    qy[ind-1] = alpha * qy[ind-1] + (1.0 - alpha) * qy[ind]
+            ubar[k] = x
+            k -= 1
+
+        points = [ControlPoint(Point(x, y)) for x, y in zip(qx, qy)]
+        return BSpline(points=points, knotvec=ubar[1:-1], degree=p, dt=self.dt)
+
+    def bezier_segments(self):
+        """
+        Returns the spline as a list of Bezier segments (t0, t1, points), one
+        per non-empty knot span, where points are the degree+1 Bezier control
+        points of the span as (x, y) tuples.
+
+        Throws InvalidBSplineException if the spline is not valid.
+        """
+        return [(t0, t1, points) for t0, t1, points, coefficients in
+                self._build_segments()[1]]
+
+    def point_at(self, t):
+        """
+        Evaluates the spline at t with Horner's rule on the cached polynomial
+        form of the span containing t. Returns (x, y).
+
+        O(degree) per point once the segments are built. Parameters outside
+        of the spline's range are evaluated on the first or last segment.
+        """
+        starts, segments, arrays = self._build_segments()
+        i = bisect.bisect_right(starts, t) - 1
+        i = min(max(i, 0), len(segments)-1)
+        t0, t1, points, (cx, cy) = segments[i]
+        s = (t - t0) / (t1 - t0)
+        x, y = cx[0], cy[0]
+        for j in range(1, len(cx)):
+            x = x*s + cx[j]
+            y = y*s + cy[j]
+        return x, y
+
+    def points_at(self, ts):
+        """
+        Vectorized point_at(). Returns an (N, 2) numpy array.
+        """
+        ts = numpy.atleast_1d(numpy.asarray(ts, dtype=numpy.float64)).ravel()
+        starts, segments, (t0, t1, coefficients) = self._build_segments()
+        i = numpy.searchsorted(t0, ts, side='right') - 1
+        numpy.clip(i, 0, len(segments)-1, out=i)
+
+        coefficients = coefficients[i]
+        s = ((ts - t0[i]) / (t1[i] - t0[i]))[:, None]
+        out = coefficients[:, :, 0].copy()
+        for j in range(1, coefficients.shape[2]):
+            out = out*s + coefficients[:, :, j]
+        return out
+
+    def derivative(self, k=1):
+        """
+        Returns the k-th derivative of the spline as a BSpline of degree
+        degree-k, with differenced control points.
+
+        The degree-th derivative is piecewise constant, but it is not a
+        BSpline: a spline has n+degree-1 knots, which for degree 0 leaves out
+        the two that bound its parameter range. derivatives(ts, order)
+        evaluates it, and the higher orders, which are 0.
+
+        Throws InvalidBSplineException if the spline is not valid, and
+        ValueError unless 1 <= k < degree.
+        """
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid.")
+        if not 1 <= k < self.degree:
+            raise ValueError("Derivative order must be from 1 to %d."
+                    % (self.degree-1))
+
+        points = self._points_array()
+        knots = numpy.array(self.user_knotvec.vec, dtype=numpy.float64)
+        for j in range(k):
+            points, knots = _differentiate(points, knots, self.degree-j)
+        return BSpline(points=[ControlPoint(Point(x, y)) for x, y in
+            points.tolist()], knotvec=knots.tolist(), degree=self.degree-k,
+            dt=self.dt)
+
+    def derivatives(self, ts, order=1):
+        """
+        Evaluates the spline and its derivatives up to order at every
+        parameter value in ts, in one pass. Returns an (order+1, N, 2) array
+        whose j-th entry holds the j-th derivatives.
+
+        Throws InvalidBSplineException if the spline is not valid.
+        """
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid for evaluation.")
+        knots = numpy.array(self.user_knotvec.vec, dtype=numpy.float64)
+        return _derivatives_array(self._points_array(), knots, self.degree, ts,
+                order)
+
+    def tangent(self, ts):
+        """
+        Returns the unit tangents at every parameter value in ts as an (N, 2)
+        array. Where the first derivative vanishes the tangent is (0, 0).
+        """
+        return self.frames(ts)[1]
 
+    def curvature(self, ts):
+        """
+        Returns the signed curvature at every parameter value in ts as an
+        array, positive where the curve turns counter-clockwise. Where the
+        first derivative vanishes the curvature is 0.
+        """
+        return self.frames(ts)[2]
+
+    def frames(self, ts):
+        """
+        Returns (points, tangents, curvatures) at every parameter value in ts
+        from a single derivatives() pass. See tangent() and curvature().
+        """
+        ders = self.derivatives(ts, 2)
+        d1, d2 = ders[1], ders[2]
+        speed = numpy.sqrt((d1 * d1).sum(axis=1))
+        moving = speed > 0
+
+        tangents = numpy.zeros_like(d1)
+        tangents[moving] = d1[moving] / speed[moving][:, None]
+        curvatures = numpy.zeros(len(speed), dtype=numpy.float64)
+        cross = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+        curvatures[moving] = cross[moving] / speed[moving] ** 3
+        return ders[0], tangents, curvatures
+
+    def arc_length(self):
+        """
+        Returns the length of the curve.
+
+        Throws InvalidBSplineException if the spline is not valid.
+        """
+        return float(self._arc_length_table()[1][-1])
+
+    def t_at_length(self, s):
+        """
+        Returns the parameter at which the curve is s long, measured from the
+        start of the parameter range. s may be a number or a sequence, giving
+        a float or an array. Lengths outside of [0, arc_length()] are clamped.
+
+        The arc-length table is binary searched for the piece containing s,
+        then Newton's method refines the linear guess within that piece.
+
+        Throws InvalidBSplineException if the spline is not valid.
+        """
+        params, lengths = self._arc_length_table()
+        s = numpy.asarray(s, dtype=numpy.float64)
+        scalar = s.ndim == 0
+        s = numpy.clip(numpy.atleast_1d(s).ravel(), 0.0, lengths[-1])
+
+        i = numpy.searchsorted(lengths, s, side='right') - 1
+        numpy.clip(i, 0, len(params)-2, out=i)
+        a, b = params[i], params[i+1]
+        start = lengths[i]
+        piece = lengths[i+1] - start
+        fraction = numpy.zeros_like(s)
+        nonzero = piece > 0
+        fraction[nonzero] = (s - start)[nonzero] / piece[nonzero]
+        t = a + (b - a) * fraction
+
+        tolerance = 1e-12 * max(lengths[-1], 1.0)
+        for step in range(ARC_LENGTH_NEWTON_STEPS):
+            error = start + self._integrate_speed(a, t) - s
+            if numpy.all(numpy.abs(error) <= tolerance):
+                break
+            speed = self._speed(t)
+            moving = speed > 0
+            t[moving] -= error[moving] / speed[moving]
+            t = numpy.clip(t, a, b)
+
+        return float(t[0]) if scalar else t
+
+    def render_uniform_length(self, n, as_array=False):
+        """
+        Like render(), but the points to be connected are n points spaced
+        evenly along the curve by arc length, instead of evenly in parameter
+        space. Includes both ends of the curve when n > 1.
+
+        Returns empty lists if the spline is not valid, and no points to be
+        connected if its parameter range is empty.
+        """
+        if not self.is_valid():
+            return [], [], []
+
+        control_points = []
+        control_point_polars = []
+        self._tell_polars()
+        for p in self.user_points:
+            control_point_polars.append(p.polar().knots())
+            control_points.append((p.x(), p.y()))
+
+        if self._is_empty():
+            points = numpy.zeros((0, 2))
+        else:
+            s = numpy.linspace(0.0, self.arc_length(), n)
+            points = self.evaluate(self.t_at_length(s))
+        if not as_array:
+            points = [tuple(p) for p in points.tolist()]
         return control_points, control_point_polars, points
 
     def insert_control_point(self, cp):
@@ -72,24 +548,31 @@ class BSpline(object):
         render()-able.
         """
         self.user_points.append(cp)
+        self._invalidate_control_point(len(self.user_points)-1)
     
     def remove_control_point(self, cp):
         """
         Removes ControlPoint cp from the spline. This might put the spline into
         an invalid state.
         """
-        self.user_points.remove(cp)
+        i = self._index(cp)
+        del self.user_points[i]
+        # Every control point after i shifts down, so every span from i on
+        # changes.
+        self._invalidate_spans(i-1, None)
 
     def replace_control_point(self, cp, cpnew):
         """
         Replaces ControlPoint cp with cpnew.
         """
-        i = self.user_points.index(cp)
+        i = self._index(cp)
         del self.user_points[i]
         self.user_points.insert(i, cpnew)
+        self._invalidate_control_point(i)
 
     def replace_control_points(self, control_points):
         self.user_points = control_points
+        self._invalidate_spans(0, None)
 
     def replace_knot_vector(self, knotvec):
         """
@@ -99,6 +582,10 @@ class BSpline(object):
         if type(knotvec) != KnotVector:
             knotvec = KnotVector(knotvec)
 
+        # The basis cache is keyed by knot vector, so the old vector's
+        # matrix, which other splines may share, is left to the LRU.
+        if knotvec.vec != self.user_knotvec.vec:
+            self._invalidate_spans(0, None)
         self.user_knotvec = knotvec
 
     def is_valid(self):
@@ -115,24 +602,17 @@ class BSpline(object):
         Runs the de Boor algorithm on the spline to calculate the points to be
         rendered on the screen.
 
-        Implementation details: we insert degree knots every dt in paramater
-        space.
+        Implementation details: for every t (stepping by dt in parameter space)
+        we find the knot span containing t and run the triangular de Boor
+        recurrence on the degree+1 control points that affect that span. This
+        is the same point we would get by inserting t degree times, but
+        without rebuilding the polar forms of the whole spline.
         """
-        
-        # TODO: for now, we implement this the ghetto way. Each time this method
-        # is called, we clear everything we've ever had. We then start from
-        # scratch and compute every point.
-        # This is, of course, a hack and should be optimized.
-        
+
         if not self.is_valid():
             return
 
-        self._internal_points = self.user_points[:]  # TODO copy ControlPoints?
-        self._internal_knotvec = self.user_knotvec.copy()
-
-        # Tell the ControlPoints their polar coords.
-        for i, cp in enumerate(self._internal_points):
-            cp.polar(KnotVector(self._internal_knotvec[i:i+self.degree]))
+        self._tell_polars()
 
         dt = dt if dt else self.dt
         t = self.user_knotvec.at(self.degree-1)
@@ -144,20 +624,401 @@ class BSpline(object):
             print "t start " + str(t)
             print "t end " + str(t_end)
 
+        knots = [float(k) for k in self.user_knotvec]
+        first, last = _knot_span_range(knots, self.degree)
+
         drawing_points = []
-        while epsilon_less_equal_than(t, t_end):
-            needed_knots = self.degree - self._count_knots(t) 
-            for i in range(needed_knots):
-                self._insert_knot(t)
-                if DEBUG:
-                    printar("internal knots now", self._internal_knotvec)
-            drawing_points.append(self._polar_to_control_point(KnotVector([t]*self.degree)))
-            self._internal_points = self.user_points[:]
-            self._internal_knotvec = self.user_knotvec.copy()
-            t += dt
-        printar("Drawing Points", drawing_points)
+        if first is None:
+            # Every knot in the parameter range is the same. There is no
+            # curve to draw.
+            self._internal_points = drawing_points
+            return
+
+        key = (tuple(knots), self.degree, dt)
+        if key != self._span_cache_key:
+            self._span_cache = {}
+            self._span_cache_key = key
+            self._span_samples = []
+            while epsilon_less_equal_than(t, t_end):
+                k = self._find_span(t, knots, first, last)
+                if not self._span_samples or self._span_samples[-1][0] != k:
+                    self._span_samples.append((k, []))
+                self._span_samples[-1][1].append(t)
+                t += dt
+
+        xs = None
+        for k, ts in self._span_samples:
+            cached = self._span_cache.get(k)
+            if cached is None:
+                if xs is None:
+                    xs = [float(cp.x()) for cp in self.user_points]
+                    ys = [float(cp.y()) for cp in self.user_points]
+                cached = []
+                for t in ts:
+                    x, y = self._de_boor_point(t, knots, xs, ys, first, last)
+                    cached.append(ControlPoint(Point(x, y),
+                        knots=[t]*self.degree))
+                self._span_cache[k] = cached
+            drawing_points.extend(cached)
+
+        if DEBUG:
+            printar("Drawing Points", drawing_points)
         self._internal_points = drawing_points
 
+    def _build_segments(self):
+        """
+        Returns (starts, segments, arrays), the cached Bezier decomposition:
+        the start parameter of each segment, and (t0, t1, points, (cx, cy))
+        per segment, where cx and cy are the power basis coefficients in
+        s = (t-t0)/(t1-t0), highest power first. arrays holds the same t0, t1
+        and coefficients as numpy arrays for points_at().
+
+        The decomposition is made by refining every knot in the parameter
+        range to multiplicity degree, so that the control points of each span
+        are its Bezier control points.
+        """
+        if self._segments is not None and self._segments[0] == self.degree:
+            return self._segments[1:]
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid.")
+
+        d = self.degree
+        kv = self.user_knotvec
+        t_start, t_end = kv.at(d-1), kv.at(-d)
+        breaks = sorted(set(k for k in kv if t_start <= k <= t_end))
+        if len(breaks) < 2:
+            raise InvalidBSplineException("Spline has an empty parameter range.")
+
+        inserted = []
+        for k in breaks:
+            inserted.extend([k] * max(d - kv.multiplicity(k), 0))
+        refined = self.refine(inserted)
+        knots = refined.user_knotvec.vec
+        xs = [cp.x() for cp in refined.user_points]
+        ys = [cp.y() for cp in refined.user_points]
+
+        binomial = [[_binomial(j, i) for i in range(d+1)] for j in range(d+1)]
+        segments = []
+        for t0, t1 in zip(breaks, breaks[1:]):
+            # Control point i has polar coordinates knots[i:i+degree], so the
+            # Bezier points (t0,...,t0) through (t1,...,t1) start at the last
+            # copy of t0 minus degree-1.
+            first = bisect.bisect_right(knots, t0) - d
+            points = zip(xs[first:first+d+1], ys[first:first+d+1])
+
+            cx, cy = [], []
+            for j in range(d, -1, -1):
+                x = y = 0.0
+                for i in range(j+1):
+                    sign = -1 if (j - i) % 2 else 1
+                    x += sign * binomial[j][i] * points[i][0]
+                    y += sign * binomial[j][i] * points[i][1]
+                cx.append(binomial[d][j] * x)
+                cy.append(binomial[d][j] * y)
+            segments.append((t0, t1, points, (cx, cy)))
+
+        arrays = (numpy.array(breaks[:-1], dtype=numpy.float64),
+                numpy.array(breaks[1:], dtype=numpy.float64),
+                numpy.array([seg[3] for seg in segments], dtype=numpy.float64))
+        self._segments = (d, breaks[:-1], segments, arrays)
+        return self._segments[1:]
+
+    def _index(self, cp):
+        """
+        Returns the index of ControlPoint cp in the user's points. Looks for cp
+        itself first, since ControlPoints compare equal by polar coordinates.
+        """
+        for i, p in enumerate(self.user_points):
+            if p is cp:
+                return i
+        return self.user_points.index(cp)
+
+    def _invalidate_control_point(self, i):
+        """
+        Drops the cached drawing points affected by control point i. By local
+        support, these are the spans i-1 through i+degree-1.
+        """
+        self._invalidate_spans(i-1, i+self.degree-1)
+
+    def _invalidate_spans(self, first, last):
+        """
+        Drops the cached drawing points of knot spans first through last. A
+        last of None means through the end of the spline.
+        """
+        self._segments = None
+        self._arc_length = None
+        self._view_spans = None
+        for spans in self._lod_cache.values():
+            for k in spans.keys():
+                if k >= first and (last is None or k <= last):
+                    del spans[k]
+        if last is None:
+            self._span_cache = dict((k, v) for k, v in
+                    self._span_cache.items() if k < first)
+            return
+        for k in range(first, last+1):
+            self._span_cache.pop(k, None)
+
+    def _is_empty(self):
+        """
+        Returns true if the parameter range, knots[degree-1] to
+        knots[-degree], is empty.
+        """
+        knots = self.user_knotvec.vec
+        return knots[self.degree-1] == knots[-self.degree]
+
+    def _points_array(self):
+        """
+        Returns the user's control points as an (n, 2) numpy array.
+        """
+        return numpy.array([(cp.x(), cp.y()) for cp in self.user_points],
+                dtype=numpy.float64).reshape((-1, 2))
+
+    def _build_view_spans(self):
+        """
+        Returns (spans, ends, lows, highs) for tessellate_view(): the indexes
+        of the non-empty knot spans, the n+1 points at their ends, and the
+        (n, 2) low and high corners of the box of the degree+1 control points
+        of each span.
+        """
+        degree = self.degree
+        knots = numpy.array(self.user_knotvec.vec, dtype=numpy.float64)
+        first, last = _knot_span_range(knots.tolist(), degree)
+        if first is None:
+            empty = numpy.zeros((0, 2))
+            return numpy.zeros(0, dtype=int), empty, empty, empty
+
+        spans = numpy.arange(first, last+1)
+        spans = spans[knots[spans] < knots[spans+1]]
+        points = self._points_array()
+        ts = numpy.concatenate([knots[spans[:1]], knots[spans+1]])
+        ends = _de_boor_array(points, knots, degree, ts)
+
+        # Span k is affected by control points k-degree+1 through k+1.
+        lows = points[spans-degree+1].copy()
+        highs = lows.copy()
+        for i in range(2-degree, 2):
+            numpy.minimum(lows, points[spans+i], out=lows)
+            numpy.maximum(highs, points[spans+i], out=highs)
+        return spans, ends, lows, highs
+
+    def _arc_length_table(self):
+        """
+        Builds (or returns the cached) arc-length table: an array of
+        parameters and the length of the curve up to each of them. The pieces
+        between parameters are refined adaptively, so that speeds which are
+        not smooth within a span, as at a cusp, are still integrated
+        accurately.
+        """
+        if self._arc_length is not None:
+            return self._arc_length
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid for evaluation.")
+
+        knots = [float(k) for k in self.user_knotvec]
+        first, last = _knot_span_range(knots, self.degree)
+        if first is None:
+            raise InvalidBSplineException("Spline has an empty parameter range.")
+        fractions = numpy.arange(ARC_LENGTH_PIECES) / float(ARC_LENGTH_PIECES)
+        params = [knots[k] + (knots[k+1] - knots[k]) * fractions
+                for k in range(first, last+1) if knots[k] < knots[k+1]]
+        params.append([knots[last+1]])
+        params = numpy.concatenate(params)
+
+        a, b = params[:-1], params[1:]
+        whole = self._integrate_speed(a, b)
+        tolerance = (ARC_LENGTH_TOLERANCE * whole.sum() /
+                (params[-1] - params[0]))
+        starts, pieces = [], []
+        for depth in range(ARC_LENGTH_MAX_DEPTH):
+            middle = (a + b) / 2.0
+            left = self._integrate_speed(a, middle)
+            right = self._integrate_speed(middle, b)
+            split = numpy.abs(left + right - whole) > tolerance * (b - a)
+            if depth == ARC_LENGTH_MAX_DEPTH - 1:
+                split[:] = False
+            done = ~split
+            starts.extend((a[done], middle[done]))
+            pieces.extend((left[done], right[done]))
+            if not split.any():
+                break
+            a, b = (numpy.concatenate((a[split], middle[split])),
+                    numpy.concatenate((middle[split], b[split])))
+            whole = numpy.concatenate((left[split], right[split]))
+
+        starts = numpy.concatenate(starts)
+        order = numpy.argsort(starts, kind='mergesort')
+        params = numpy.append(starts[order], params[-1])
+        lengths = numpy.zeros(len(params), dtype=numpy.float64)
+        numpy.cumsum(numpy.concatenate(pieces)[order], out=lengths[1:])
+        self._arc_length = (params, lengths)
+        return self._arc_length
+
+    def _speed(self, ts):
+        """
+        Returns the length of the first derivative at every parameter in ts.
+        """
+        d1 = self.derivatives(ts, 1)[1]
+        return numpy.sqrt((d1 * d1).sum(axis=1))
+
+    def _integrate_speed(self, a, b):
+        """
+        Returns the arc length from a to b for every pair in the arrays a and
+        b, by Gauss-Legendre quadrature of the speed. Accurate as long as each
+        interval is within a single knot span.
+        """
+        half = (b - a) / 2.0
+        ts = ((a + b) / 2.0)[:, None] + half[:, None] * _GAUSS_NODES
+        speed = self._speed(ts.ravel()).reshape(ts.shape)
+        return half * speed.dot(_GAUSS_WEIGHTS)
+
+    def _tell_polars(self):
+        """
+        Resets the internal points and knot vector to the user's, and tells
+        the ControlPoints their polar coords.
+        """
+        self._internal_points = self.user_points[:]
+        self._internal_knotvec = self.user_knotvec.copy()
+
+        for i, cp in enumerate(self._internal_points):
+            cp.polar(KnotVector(self._internal_knotvec[i:i+self.degree]))
+
+    def _tessellate_span(self, k, tolerance, knots, xs, ys, first, last,
+            t0=None, t1=None):
+        """
+        Adaptively tessellates the knot span k, or its part from t0 to t1.
+        Returns the points after the start, ending with the point at the end.
+        """
+        def evaluate(t):
+            # Evaluate on span k even at its end, where bisect would move on
+            # to span k+1.
+            return self._de_boor_point(t, knots, xs, ys, k, k)
+
+        if t0 is None:
+            t0, t1 = knots[k], knots[k+1]
+        p0, p1 = evaluate(t0), evaluate(t1)
+        points = []
+
+        # Depth-first over (t0, p0, t1, p1, depth) pieces, right piece pushed
+        # first so points come out in order.
+        stack = [(t0, p0, t1, p1, 0)]
+        while stack:
+            t0, p0, t1, p1, depth = stack.pop()
+            tm = 0.5 * (t0 + t1)
+            pm = evaluate(tm)
+            flat = depth >= TESSELLATE_MAX_DEPTH
+            if not flat and depth > 0:
+                # Check the quarter points too, so an S-bend whose midpoint
+                # happens to lie on the chord is not taken as flat.
+                flat = (_chord_distance(pm, p0, p1) <= tolerance
+                        and _chord_distance(evaluate(0.5 * (t0 + tm)), p0, p1)
+                            <= tolerance
+                        and _chord_distance(evaluate(0.5 * (tm + t1)), p0, p1)
+                            <= tolerance)
+            if flat:
+                points.append(p1)
+            else:
+                stack.append((tm, pm, t1, p1, depth+1))
+                stack.append((t0, p0, tm, pm, depth+1))
+        return points
+
+    def _tessellate_span_in_box(self, k, tolerance, box, knots, xs, ys, first,
+            last):
+        """
+        Like _tessellate_span(), but only tessellates the parts of the knot
+        span k that may be inside box.
+
+        The span is bisected until the Bezier control points of each piece,
+        whose convex hull contains it, have a bounding box that misses box,
+        lies inside it, or is no larger than it. Pieces missing box are drawn
+        as their chord; the others are tessellated.
+        """
+        width, height = box[2] - box[0], box[3] - box[1]
+        points = []
+        stack = [(knots[k], knots[k+1], 0)]
+        while stack:
+            t0, t1, depth = stack.pop()
+            hull = self._bezier_points(t0, t1, knots, xs, ys, k)
+            lows = (min(x for x, y in hull), min(y for x, y in hull))
+            highs = (max(x for x, y in hull), max(y for x, y in hull))
+            if (lows[0] > box[2] or highs[0] < box[0] or lows[1] > box[3] or
+                    highs[1] < box[1]):
+                points.append(hull[-1])
+            elif (depth >= TESSELLATE_MAX_DEPTH or
+                    _box_contains(box, lows, highs) or
+                    (highs[0] - lows[0] <= width and
+                        highs[1] - lows[1] <= height)):
+                points.extend(self._tessellate_span(k, tolerance, knots, xs,
+                    ys, first, last, t0, t1))
+            else:
+                tm = 0.5 * (t0 + t1)
+                stack.append((tm, t1, depth+1))
+                stack.append((t0, tm, depth+1))
+        return points
+
+    def _bezier_points(self, t0, t1, knots, xs, ys, k):
+        """
+        Returns the degree+1 Bezier control points of the part of knot span k
+        from t0 to t1: the polar points (t0, ..., t0, t1, ..., t1).
+        """
+        degree = self.degree
+        return [self._blossom([t0] * (degree-i) + [t1] * i, knots, xs, ys, k)
+                for i in range(degree+1)]
+
+    def _blossom(self, us, knots, xs, ys, k):
+        """
+        Evaluates the polar form of knot span k at the degree parameters us.
+        Returns (x, y). The de Boor recurrence of _de_boor_point(), with us[r-1]
+        inserted by pass r.
+        """
+        degree = self.degree
+        base = k - degree + 1
+        dx = xs[base:k+2]
+        dy = ys[base:k+2]
+
+        for r in range(1, degree+1):
+            t = us[r-1]
+            for j in range(degree, r-1, -1):
+                left = knots[base+j-1]
+                alpha = (t - left) / (knots[k+j-r+1] - left)
+                dx[j] = (1.0 - alpha) * dx[j-1] + alpha * dx[j]
+                dy[j] = (1.0 - alpha) * dy[j-1] + alpha * dy[j]
+        return dx[degree], dy[degree]
+
+    def _find_span(self, t, knots, first, last):
+        """
+        Returns the index k of the knot span [knots[k], knots[k+1]) containing
+        t. Parameters outside of the spline's range are clamped to the first or
+        last span.
+        """
+        k = bisect.bisect_right(knots, t) - 1
+        if k < first:
+            return first
+        if k > last:
+            return last
+        return k
+
+    def _de_boor_point(self, t, knots, xs, ys, first, last):
+        """
+        Evaluates the spline at t with the de Boor recurrence. Returns (x, y).
+
+        The control point i has polar coordinates knots[i:i+degree], so the
+        degree+1 control points k-degree+1..k+1 affect the span k. Each pass of
+        the recurrence is one knot insertion of t restricted to that span.
+        """
+        degree = self.degree
+        k = self._find_span(t, knots, first, last)
+        base = k - degree + 1
+        dx = xs[base:k+2]
+        dy = ys[base:k+2]
+
+        for r in range(1, degree+1):
+            for j in range(degree, r-1, -1):
+                left = knots[base+j-1]
+                alpha = (t - left) / (knots[k+j-r+1] - left)
+                dx[j] = (1.0 - alpha) * dx[j-1] + alpha * dx[j]
+                dy[j] = (1.0 - alpha) * dy[j-1] + alpha * dy[j]
+        return dx[degree], dy[degree]
 
     def _insert_knot(self, knot):
         """
@@ -169,11 +1030,15 @@ class BSpline(object):
         self._internal_knotvec.insert(knot)
         new_polars = self._internal_knotvec.polar_points(self.degree)
         new_control_points = []
+        new_index = {}
+
+        old_keys = set(_polar_key(polar) for polar in old_polars)
+        new_keys = set(_polar_key(polar) for polar in new_polars)
 
         merged_polars = []
         merged_polars.extend(old_polars)
         for polar in new_polars:
-            if polar not in merged_polars:
+            if _polar_key(polar) not in old_keys:
                 merged_polars.append(polar)
         merged_polars.sort()
 
@@ -183,13 +1048,16 @@ class BSpline(object):
             printar('Merge Polars', merged_polars)
 
         for i, polar in enumerate(merged_polars):
-            if polar in old_polars:
+            key = _polar_key(polar)
+            if key in old_keys:
                 # Control point already exists, so we don't need to recalculate
                 # its x, y.
 
                 # Keep point if not to be deleted by the insertion.
-                if polar in new_polars:
-                    new_control_points.append(self._polar_to_control_point(polar))
+                if key in new_keys:
+                    cp = self._polar_to_control_point(polar)
+                    new_control_points.append(cp)
+                    new_index[key] = cp
                 continue
 
             # New control point. Interpolate between the control points next to
@@ -215,8 +1083,11 @@ class BSpline(object):
                 pass
 
             new_control_points.append(middle)
+            new_index[key] = middle
 
         self._internal_points = new_control_points
+        self._polar_index = new_index
+        self._polar_index_points = new_control_points
 
         if DEBUG:
             printar("Points after insertion:", self._internal_points)
@@ -226,6 +1097,17 @@ class BSpline(object):
         Given a KnotVector representing the polar coordinates of a ControlPoint,
         find the corresponding ControlPoint.
         """
+        if self._polar_index_points is not self._internal_points:
+            # The internal points were replaced since the index was built.
+            self._polar_index = dict((_polar_key(cp.polar()), cp)
+                    for cp in reversed(self._internal_points))
+            self._polar_index_points = self._internal_points
+
+        cp = self._polar_index.get(_polar_key(polar))
+        if cp is not None:
+            return cp
+
+        # Knots within epsilon of each other can still quantize apart.
         for cp in self._internal_points:
             if polar == cp.polar():
                 return cp
@@ -235,11 +1117,98 @@ class BSpline(object):
         """
         Returns the number of times knot is found in the internal knot vector.
         """
-        count = 0
-        for k in self._internal_knotvec:
-            if k == knot:
-                count += 1
-        return count
+        return self._internal_knotvec.multiplicity(knot)
+
+class CompactBSpline(object):
+    """
+    Array-backed spline. The control points are one contiguous float64 (n, 2)
+    buffer and the knot vector is one float64 array, instead of a ControlPoint,
+    Point and KnotVector object per control point.
+
+    Round-trips with BSpline through from_bspline() and to_bspline(). Code
+    that wants per-point objects can index or iterate it to get
+    ControlPointViews into the buffer.
+    """
+    __slots__ = ('points', 'knots', 'degree', 'dt')
+
+    def __init__(self, points, knots, degree, dt=None):
+        # ascontiguousarray does not copy arrays that are already float64 and
+        # contiguous, so views into a larger buffer stay views.
+        self.points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+        self.points = self.points.reshape((-1, 2))
+        self.knots = numpy.ascontiguousarray(knots, dtype=numpy.float64)
+        self.degree = degree
+        self.dt = dt if dt else 0.2
+
+    @classmethod
+    def from_bspline(cls, bspline):
+        points = [(cp.x(), cp.y()) for cp in bspline.user_points]
+        return cls(numpy.array(points, dtype=numpy.float64).reshape((-1, 2)),
+                bspline.user_knotvec.vec, bspline.degree, bspline.dt)
+
+    def to_bspline(self):
+        points = [ControlPoint(Point(x, y)) for x, y in self.points.tolist()]
+        return BSpline(points=points, knotvec=self.knots.tolist(),
+                degree=self.degree, dt=self.dt)
+
+    def is_valid(self):
+        """
+        Same rules as BSpline.is_valid().
+        """
+        return (len(self.points) > self.degree
+                and len(self.knots) == len(self.points)+self.degree-1
+                and bool(numpy.all(self.knots[1:] >= self.knots[:-1]))
+                and (len(self.knots) == 0 or self.knots[0] >= 0))
+
+    def evaluate(self, ts):
+        """
+        Evaluates the spline at every parameter value in ts. Returns an (N, 2)
+        numpy array. See BSpline.evaluate().
+        """
+        if not self.is_valid():
+            raise InvalidBSplineException("Spline is not valid for evaluation.")
+        return _de_boor_array(self.points, self.knots, self.degree, ts)
+
+    def render(self, dt=None):
+        """
+        Same as BSpline.render(as_array=True), except the control points are
+        returned as the (n, 2) buffer.
+        """
+        if not self.is_valid():
+            return [], [], []
+        if self.knots[self.degree-1] == self.knots[-self.degree]:
+            return self.points, self.polars(), numpy.zeros((0, 2))
+
+        basis = BSpline.basis_cache.get(self.knots, self.degree,
+                dt if dt else self.dt)
+        return self.points, self.polars(), basis.dot(self.points)
+
+    def polars(self):
+        """
+        Returns the polar coordinates of each control point as tuples.
+        """
+        knots = self.knots.tolist()
+        return [tuple(knots[i:i+self.degree]) for i in range(len(self.points))]
+
+    def nbytes(self):
+        """
+        Returns the number of bytes held by the point and knot buffers.
+        """
+        return self.points.nbytes + self.knots.nbytes
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.points)
+        if not 0 <= i < len(self.points):
+            raise IndexError("control point index out of range")
+        return ControlPointView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self.points)):
+            yield ControlPointView(self, i)
 
 class ControlPoint(object):
     def __init__(self, point=None, x=None, y=None, knots=None):
@@ -309,12 +1278,325 @@ class ControlPoint(object):
         return "(%.2f, %.2f) %s" % (self.p.x, self.p.y, self.polar())
 
 
+class ControlPointView(object):
+    """
+    A ControlPoint-like view of control point i of a CompactBSpline. Reads and
+    writes go straight to the spline's buffers.
+    """
+    __slots__ = ('_spline', '_i')
+
+    def __init__(self, spline, i):
+        self._spline = spline
+        self._i = i
+
+    def polar(self):
+        degree = self._spline.degree
+        return KnotVector(self._spline.knots[self._i:self._i+degree].tolist())
+
+    def x(self, x=None):
+        if x is None:
+            return float(self._spline.points[self._i, 0])
+        self._spline.points[self._i, 0] = x
+
+    def y(self, y=None):
+        if y is None:
+            return float(self._spline.points[self._i, 1])
+        self._spline.points[self._i, 1] = y
+
+    def copy(self):
+        return ControlPoint(Point(self.x(), self.y()), knots=self.polar())
+
+    def __str__(self):
+        return "(%.2f, %.2f) %s" % (self.x(), self.y(), self.polar())
+
+def read_curves(lines=None, filename=None):
+    """
+    Streams the curves of a (possibly multi-curve) data file as BSplines. See
+    util.iter_data for the format.
+
+    Throws DataParseException, with the line number of the curve, for curves
+    that are not valid.
+    """
+    for points, knotvec, degree, dt, lineno in iter_data(lines, filename):
+        bspline = BSpline(degree=degree, dt=dt)
+        for cp in points:
+            bspline.insert_control_point(ControlPoint(Point(cp[0], cp[1])))
+        bspline.replace_knot_vector(knotvec)
+        if not bspline.is_valid():
+            raise DataParseException("invalid curve: %d control points and "
+                    "%d knots for degree %d" % (len(points), len(knotvec),
+                        degree), lineno)
+        yield bspline
+
 class IllegalKnotVectorException(Exception):
     pass
 
+class InvalidBSplineException(Exception):
+    pass
+
+
+_GAUSS_NODES, _GAUSS_WEIGHTS = numpy.polynomial.legendre.leggauss(
+        ARC_LENGTH_NODES)
+
+def _knot_span_range(knots, degree):
+    """
+    Returns (first, last), the indexes of the first and last non-empty knot
+    spans [knots[k], knots[k+1]) inside the parameter range of a spline of the
+    given degree, or (None, None) if every span is empty.
+    """
+    first = degree - 1
+    last = len(knots) - degree - 1
+    while first <= last and knots[first] >= knots[first+1]:
+        first += 1
+    while last >= first and knots[last] >= knots[last+1]:
+        last -= 1
+    if first > last:
+        return None, None
+    return first, last
+
+def _polar_key(polar):
+    """
+    Returns a hashable key for polar coordinates (a KnotVector): its sorted
+    knots quantized to POLAR_EPSILON.
+    """
+    return tuple(int(round(k / POLAR_EPSILON)) for k in sorted(polar))
+
+def _binomial(n, k):
+    """
+    Returns n choose k.
+    """
+    result = 1
+    for i in range(1, k+1):
+        result = result * (n - k + i) // i
+    return result
+
+def _chord_distance(p, a, b):
+    """
+    Returns the distance from point p to the segment from a to b.
+    """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx*dx + dy*dy
+    if length2 == 0:
+        u = 0.0
+    else:
+        u = ((p[0] - a[0])*dx + (p[1] - a[1])*dy) / length2
+        u = min(max(u, 0.0), 1.0)
+    ex = p[0] - (a[0] + u*dx)
+    ey = p[1] - (a[1] + u*dy)
+    return math.sqrt(ex*ex + ey*ey)
+
+def _box_contains(box, low, high):
+    """
+    Returns true if box (xmin, ymin, xmax, ymax) contains the box from the
+    corner low to the corner high.
+    """
+    return (box[0] <= low[0] and box[1] <= low[1] and high[0] <= box[2] and
+            high[1] <= box[3])
+
+def _sample_parameters(knots, degree, dt):
+    """
+    Returns a numpy array of every dt from the start to the end of the
+    parameter range of a spline with the given knots and degree.
+    """
+    t_start = float(knots[degree-1])
+    t_end = float(knots[-degree])
+    count = int(math.floor((t_end - t_start + 0.0001) / dt)) + 1
+    return t_start + dt * numpy.arange(max(count, 0), dtype=numpy.float64)
+
+def _de_boor_array(points, knots, degree, ts):
+    """
+    Vectorized de Boor algorithm. Evaluates the spline with control points
+    points (an (n, 2) array) and knots (a sorted array of n+degree-1 knots) at
+    every parameter value in ts. Returns an (N, 2) array.
+
+    Span lookup is a single searchsorted over the knots, and each pass of the
+    recurrence is broadcast across all samples at once.
+    """
+    return _derivatives_array(points, knots, degree, ts, 0)[0]
+
+def _derivatives_array(points, knots, degree, ts, order):
+    """
+    Evaluates the spline and its first order derivatives at every parameter
+    value in ts. Returns an (order+1, N, 2) array.
+
+    The knot spans are looked up once and shared by every derivative: the
+    j-th derivative is the spline of degree-j over knots[j:-j] (see
+    _differentiate), in which span k of the spline is span k-j.
+    """
+    ts = numpy.atleast_1d(numpy.asarray(ts, dtype=numpy.float64)).ravel()
+    first, last = _knot_span_range(knots, degree)
+    if first is None:
+        raise InvalidBSplineException("Spline has an empty parameter range.")
+
+    levels = [(points, knots)]
+    for j in range(1, min(order, degree)+1):
+        levels.append(_differentiate(levels[-1][0], levels[-1][1], degree-j+1))
+
+    out = numpy.zeros((order+1, len(ts), 2), dtype=numpy.float64)
+    for start in range(0, len(ts), EVALUATE_CHUNK):
+        t = ts[start:start+EVALUATE_CHUNK]
+        spans = numpy.searchsorted(knots, t, side='right') - 1
+        numpy.clip(spans, first, last, out=spans)
+        for j, (level_points, level_knots) in enumerate(levels):
+            out[j, start:start+len(t)] = _de_boor_spans(level_points,
+                    level_knots, degree-j, t, spans-j)
+    return out
+
+def _de_boor_spans(points, knots, degree, ts, spans):
+    """
+    Runs the de Boor recurrence for every parameter value in ts on its knot
+    span in spans. Returns an (N, 2) array.
+    """
+    offsets = numpy.arange(degree+1)
+    base = spans - degree + 1
+    d = points[base[:, None] + offsets]
+    t = ts[:, None]
+
+    for r in range(1, degree+1):
+        js = offsets[r:]
+        left = knots[base[:, None] + js - 1]
+        right = knots[spans[:, None] + js - r + 1]
+        alpha = ((t - left) / (right - left))[:, :, None]
+        d[:, r:] = (1.0 - alpha) * d[:, r-1:-1] + alpha * d[:, r:]
+    return d[:, degree]
+
+def _differentiate(points, knots, degree):
+    """
+    Returns (points, knots) of the derivative of the spline with the given
+    control points (an (n, 2) array), knots and degree. The derivative has
+    degree-1, the differenced control points
+        degree * (P[i+1] - P[i]) / (knots[i+degree] - knots[i])
+    and the knots without the first and last.
+    """
+    n = len(points)
+    spread = knots[degree:degree+n-1] - knots[:n-1]
+    scale = numpy.zeros(n-1, dtype=numpy.float64)
+    nonzero = spread > 0
+    scale[nonzero] = degree / spread[nonzero]
+    return (points[1:] - points[:-1]) * scale[:, None], knots[1:-1]
+
+def _basis_functions(knots, degree, ts):
+    """
+    Evaluates the non-zero basis functions at every parameter value in ts.
+    Returns (spans, weights): the knot span k of each parameter and an
+    (N, degree+1) array of the weights of control points k-degree+1..k+1.
+    """
+    ts = numpy.atleast_1d(numpy.asarray(ts, dtype=numpy.float64)).ravel()
+    first, last = _knot_span_range(knots, degree)
+    if first is None:
+        raise InvalidBSplineException("Spline has an empty parameter range.")
+
+    spans = numpy.searchsorted(knots, ts, side='right') - 1
+    numpy.clip(spans, first, last, out=spans)
+
+    weights = numpy.zeros((len(ts), degree+1), dtype=numpy.float64)
+    weights[:, 0] = 1.0
+    left = numpy.empty((len(ts), degree+1), dtype=numpy.float64)
+    right = numpy.empty((len(ts), degree+1), dtype=numpy.float64)
+    for j in range(1, degree+1):
+        left[:, j] = ts - knots[spans+1-j]
+        right[:, j] = knots[spans+j] - ts
+        saved = numpy.zeros(len(ts), dtype=numpy.float64)
+        for r in range(j):
+            temp = weights[:, r] / (right[:, r+1] + left[:, j-r])
+            weights[:, r] = saved + right[:, r+1] * temp
+            saved = left[:, j-r] * temp
+        weights[:, j] = saved
+    return spans, weights
+
+class BasisMatrix(object):
+    """
+    Sparse (samples x control points) basis matrix with degree+1 non-zeros per
+    row. Row i holds the weights of control points indices[i] for sample i.
+    """
+    def __init__(self, knots, degree, ts):
+        knots = numpy.asarray(knots, dtype=numpy.float64)
+        spans, self.weights = _basis_functions(knots, degree, ts)
+        self.indices = (spans - degree + 1)[:, None] + numpy.arange(degree+1)
+        self.shape = (len(spans), len(knots) - degree + 1)
+
+    def dot(self, points):
+        """
+        Returns B @ points for an (n, 2) array of control points.
+        """
+        return numpy.einsum('ij,ijk->ik', self.weights, points[self.indices])
+
+    def todense(self):
+        dense = numpy.zeros(self.shape, dtype=numpy.float64)
+        rows = numpy.arange(self.shape[0])[:, None]
+        dense[rows, self.indices] = self.weights
+        return dense
+
+class BasisCache(object):
+    """
+    LRU cache of the BasisMatrix of the dt grid, keyed by (knot vector, degree,
+    dt). Holds at most maxsize matrices and maxnonzeros weights in all.
+    Counts hits and misses. Safe to share between threads.
+    """
+    def __init__(self, maxsize=32, maxnonzeros=BASIS_CACHE_NONZEROS):
+        self.maxsize = maxsize
+        self.maxnonzeros = maxnonzeros
+        self.nonzeros = 0
+        self.hits = 0
+        self.misses = 0
+        self._matrices = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, knots, degree, dt):
+        key = self._key(knots, degree, dt)
+        with self._lock:
+            basis = self._matrices.pop(key, None)
+            if basis is not None:
+                self.hits += 1
+                self._matrices[key] = basis
+                return basis
+            self.misses += 1
+
+        # Built without the lock, so other threads are not held up.
+        basis = BasisMatrix(knots, degree, _sample_parameters(knots, degree, dt))
+        size = basis.weights.size
+        if size > self.maxnonzeros:
+            return basis
+        with self._lock:
+            old = self._matrices.pop(key, None)
+            if old is not None:
+                self.nonzeros -= old.weights.size
+            while self._matrices and (len(self._matrices) >= self.maxsize or
+                    self.nonzeros + size > self.maxnonzeros):
+                self.nonzeros -= self._matrices.popitem(
+                        last=False)[1].weights.size
+            self._matrices[key] = basis
+            self.nonzeros += size
+        return basis
+
+    def discard(self, knots, degree, dt):
+        with self._lock:
+            basis = self._matrices.pop(self._key(knots, degree, dt), None)
+            if basis is not None:
+                self.nonzeros -= basis.weights.size
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+            self.nonzeros = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._matrices)
+
+    def _key(self, knots, degree, dt):
+        knots = numpy.asarray(knots, dtype=numpy.float64)
+        return (knots.tobytes(), degree, dt)
+
+BSpline.basis_cache = BasisCache()
+
 class KnotVector(object):
     def __init__(self, vec=None):
         self.vec = vec if vec else []
+        # Whether vec is non-decreasing. Kept up to date by insert() and
+        # sort(), so the lookups below can bisect instead of scanning.
+        self._sorted = all(a <= b for a, b in zip(self.vec, self.vec[1:]))
 
     def __iter__(self):
         return self.vec.__iter__()
@@ -410,7 +1692,7 @@ class KnotVector(object):
     def is_valid(self):
         # Returns true if this is valid knot vector.
         # That is, a non-negative, non-decreasing list of numbers.
-        last = -1
+        last = 0
         for v in self.vec:
             if v < last:
                 return False
@@ -419,9 +1701,14 @@ class KnotVector(object):
 
     def insert(self, knot):
         """
-        Inserts knot into the knot vector at the proper place.
+        Inserts knot into the knot vector at the proper place, before any knots
+        equal to it.
         """
 
+        if self._sorted:
+            self.vec.insert(bisect.bisect_left(self.vec, knot), knot)
+            return
+
         for i, v in enumerate(self.vec):
             if v >= knot:
                 self.vec.insert(i, knot)
@@ -430,31 +1717,51 @@ class KnotVector(object):
         # All knots smaller, new knot goes to end.
         self.vec.append(knot)
 
+    def multiplicity(self, knot):
+        """
+        Returns the number of times knot is in the knot vector.
+        """
+        if not self._sorted:
+            return self.vec.count(knot)
+        return (bisect.bisect_right(self.vec, knot)
+                - bisect.bisect_left(self.vec, knot))
+
+    def find_span(self, t):
+        """
+        Returns the index k of the knot span with vec[k] <= t < vec[k+1]: -1 if
+        t is before the first knot and len-1 if it is at or after the last.
+        The knot vector must be sorted.
+        """
+        return bisect.bisect_right(self.vec, t) - 1
+
     def sort(self):
-        self.vec.sort()
+        if not self._sorted:
+            self.vec.sort()
+            self._sorted = True
 
     def sort_copy(self):
         kv = self.copy()
-        kv.vec.sort()
+        kv.sort()
         return kv
 
     def copy(self):
         kv = KnotVector()
         kv.degree = self.degree
         kv.vec = self.vec[:]
+        kv._sorted = self._sorted
         return kv
 
     def __cmp__(self, other):
         """
         Returns 0 if equal, negative if self < other, and positive if self >
-        other.
+        other. Knot vectors compare as if sorted, but neither is modified.
 
         NOTE: undefined when len(self) != len(other).
         """
-        self.vec.sort()
-        other_knots = other.sort_copy()
+        self_knots = self.vec if self._sorted else sorted(self.vec)
+        other_knots = other.vec if other._sorted else sorted(other.vec)
         
-        for v1, v2 in zip(self.vec, other_knots.vec):
+        for v1, v2 in zip(self_knots, other_knots):
             if not epsilon_equals(v1, v2):
                 return -1 if epsilon_less_than(v1, v2) else 1
         return 0    # equal
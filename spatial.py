@@ -0,0 +1,362 @@
+import math
+import heapq
+import numpy
+from libcurvey import *
+
+# Most items kept in a leaf of a BoundingBoxTree.
+LEAF_SIZE = 4
+
+# Newton steps taken by closest_point() from the best sample of a segment.
+NEWTON_STEPS = 8
+
+class BoundingBoxTree(object):
+    """
+    Bounding volume hierarchy over axis-aligned boxes.
+
+    Built top-down by splitting the items at the median of their box centers
+    along the longer axis, so queries visit O(log n) nodes for well spread
+    out boxes. Items are identified by their index in the boxes array.
+    """
+    def __init__(self, boxes):
+        """
+        boxes is an (n, 4) array-like of (xmin, ymin, xmax, ymax).
+        """
+        boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape((-1, 4))
+        self.boxes = [tuple(box) for box in boxes.tolist()]
+        # Per node: its box, and either its (left, right) children or None
+        # and the (start, end) range of its items in self.order.
+        self.nodes = []
+        self.order = []
+        if len(boxes):
+            self._build(boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def query(self, box):
+        """
+        Returns the items whose boxes overlap box, in no particular order.
+        """
+        found = []
+        if not self.nodes:
+            return found
+        stack = [0]
+        while stack:
+            node_box, children, items = self.nodes[stack.pop()]
+            if not _boxes_overlap(node_box, box):
+                continue
+            if children is None:
+                found.extend(i for i in self.order[items[0]:items[1]]
+                        if _boxes_overlap(self.boxes[i], box))
+            else:
+                stack.extend(children)
+        return found
+
+    def nearest(self, x, y, distance, max_distance=None):
+        """
+        Best-first search for the item closest to (x, y). distance(i) must
+        return (d, result) with d the exact distance to item i, which may be no
+        less than the distance to its box.
+
+        Returns (d, i, result) for the closest item, or None if there are no
+        items (within max_distance, if given).
+        """
+        best = None
+        bound = float('inf') if max_distance is None else max_distance
+        if not self.nodes:
+            return None
+        heap = [(_box_distance(self.nodes[0][0], x, y), 0)]
+        while heap:
+            node_distance, node = heapq.heappop(heap)
+            if node_distance > bound:
+                break
+            node_box, children, items = self.nodes[node]
+            if children is None:
+                for i in self.order[items[0]:items[1]]:
+                    if _box_distance(self.boxes[i], x, y) > bound:
+                        continue
+                    d, result = distance(i)
+                    if d <= bound:
+                        bound = d
+                        best = (d, i, result)
+            else:
+                for child in children:
+                    heapq.heappush(heap,
+                            (_box_distance(self.nodes[child][0], x, y), child))
+        return best
+
+    def _build(self, boxes):
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+        order = numpy.arange(len(boxes))
+        self.nodes.append(None)
+        stack = [(0, 0, len(boxes))]
+        while stack:
+            node, start, end = stack.pop()
+            items = order[start:end]
+            low = boxes[items, :2].min(axis=0)
+            high = boxes[items, 2:].max(axis=0)
+            node_box = (low[0], low[1], high[0], high[1])
+            if end - start <= LEAF_SIZE:
+                self.nodes[node] = (node_box, None, (start, end))
+                continue
+
+            spread = centers[items].max(axis=0) - centers[items].min(axis=0)
+            axis = 0 if spread[0] >= spread[1] else 1
+            middle = (end - start) // 2
+            split = numpy.argpartition(centers[items, axis], middle)
+            order[start:end] = items[split]
+
+            left, right = len(self.nodes), len(self.nodes) + 1
+            self.nodes.extend([None, None])
+            self.nodes[node] = (node_box, (left, right), None)
+            stack.append((left, start, start + middle))
+            stack.append((right, start + middle, end))
+        self.order = order.tolist()
+
+class CurveIndex(object):
+    """
+    Spatial index over the knot spans of one BSpline, for nearest point
+    queries and hit testing.
+
+    Each span is boxed by its Bezier control points, which contain the span
+    by the convex hull property. The index is a snapshot: build a new one
+    after editing the spline.
+    """
+    def __init__(self, bspline):
+        starts, segments, arrays = bspline._build_segments()
+        self.segments = [(t0, t1, coefficients) for t0, t1, points,
+                coefficients in segments]
+        self.tree = BoundingBoxTree([_points_box(points) for t0, t1, points,
+            coefficients in segments])
+
+    def closest_point(self, x, y, max_distance=None):
+        """
+        Returns (distance, t, (px, py)), the point of the curve closest to
+        (x, y) and its parameter, or None if no point of the curve is within
+        max_distance.
+        """
+        found = self.tree.nearest(x, y, lambda i: self._closest_on_segment(i,
+            x, y), max_distance)
+        if found is None:
+            return None
+        d, i, (t, point) = found
+        return d, t, point
+
+    def query(self, box):
+        """
+        Returns the (t0, t1) parameter ranges of the spans whose boxes
+        overlap box (xmin, ymin, xmax, ymax), sorted.
+        """
+        return sorted(self.segments[i][:2] for i in self.tree.query(box))
+
+    def _closest_on_segment(self, i, x, y):
+        """
+        Returns (distance, (t, (px, py))) for the point of segment i closest
+        to (x, y): the best of a few samples, refined by Newton's method on
+        the derivative of the squared distance.
+        """
+        t0, t1, (cx, cy) = self.segments[i]
+        samples = 2 * len(cx)
+        best = None
+        for j in range(samples + 1):
+            s = j / float(samples)
+            px, py = _horner(cx, s)[0], _horner(cy, s)[0]
+            d = (px - x) ** 2 + (py - y) ** 2
+            if best is None or d < best[0]:
+                best = (d, s)
+
+        s = best[1]
+        for step in range(NEWTON_STEPS):
+            px, dx, ddx = _horner(cx, s)
+            py, dy, ddy = _horner(cy, s)
+            ex, ey = px - x, py - y
+            slope = ex*dx + ey*dy
+            curve = dx*dx + dy*dy + ex*ddx + ey*ddy
+            if curve <= 0:
+                break
+            s_new = min(max(s - slope / curve, 0.0), 1.0)
+            if abs(s_new - s) < 1e-12:
+                s = s_new
+                break
+            s = s_new
+
+        px, py = _horner(cx, s)[0], _horner(cy, s)[0]
+        d = (px - x) ** 2 + (py - y) ** 2
+        if d > best[0]:
+            s = best[1]
+            px, py = _horner(cx, s)[0], _horner(cy, s)[0]
+            d = best[0]
+        return math.sqrt(d), (t0 + s * (t1 - t0), (px, py))
+
+class CollectionIndex(object):
+    """
+    Spatial index over many curves, for finding the curve closest to a point
+    in sublinear time.
+
+    Curves (BSplines or CompactBSplines) are boxed by their control points.
+    Invalid curves are left out. The CurveIndex of a curve is only built
+    when a query reaches it.
+    """
+    def __init__(self, curves):
+        self.curves = []
+        boxes = []
+        for i, curve in enumerate(curves):
+            if not curve.is_valid():
+                continue
+            if isinstance(curve, CompactBSpline):
+                points = curve.points
+            else:
+                points = curve._points_array()
+            self.curves.append((i, curve))
+            boxes.append(_points_box(points))
+        self.tree = BoundingBoxTree(boxes)
+        self._indexes = {}
+
+    def curve_index(self, i):
+        """
+        Returns the CurveIndex of the i-th indexed curve.
+        """
+        index = self._indexes.get(i)
+        if index is None:
+            curve = self.curves[i][1]
+            if isinstance(curve, CompactBSpline):
+                curve = curve.to_bspline()
+            index = self._indexes[i] = CurveIndex(curve)
+        return index
+
+    def closest_point(self, x, y, max_distance=None):
+        """
+        Returns (curve, distance, t, (px, py)) for the point closest to (x, y)
+        over all curves, where curve is the position of the curve in the list
+        the index was built from. Returns None if no curve is within
+        max_distance.
+        """
+        def distance(i):
+            found = self.curve_index(i).closest_point(x, y, max_distance)
+            if found is None:
+                return float('inf'), None
+            return found[0], found[1:]
+
+        found = self.tree.nearest(x, y, distance, max_distance)
+        if found is None or found[2] is None:
+            return None
+        d, i, (t, point) = found
+        return self.curves[i][0], d, t, point
+
+    def query(self, box):
+        """
+        Returns the positions of the curves whose control point boxes overlap
+        box (xmin, ymin, xmax, ymax), sorted.
+        """
+        return sorted(self.curves[i][0] for i in self.tree.query(box))
+
+class PointGrid(object):
+    """
+    Uniform grid over points that move, for picking: finding the point under
+    the mouse in time that depends on how crowded the neighbourhood is, not
+    on how many points there are. Points are identified by any hashable key.
+    """
+    def __init__(self, cell=1.0):
+        self.cell = float(cell)
+        self._cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def get(self, key):
+        """
+        Returns the (x, y) of key.
+        """
+        return self._points[key]
+
+    def insert(self, key, x, y):
+        """
+        Adds key at (x, y), or moves it there if it is already in the grid.
+        """
+        if key in self._points:
+            self.remove(key)
+        self._points[key] = (x, y)
+        self._cells.setdefault(self._cell(x, y), set()).add(key)
+
+    move = insert
+
+    def remove(self, key):
+        """
+        Removes key. Throws KeyError if it is not in the grid.
+        """
+        x, y = self._points.pop(key)
+        cell = self._cell(x, y)
+        keys = self._cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+
+    def within(self, x, y, radius):
+        """
+        Returns (distance, key) for every point within radius of (x, y),
+        nearest first.
+        """
+        found = []
+        i0, j0 = self._cell(x - radius, y - radius)
+        i1, j1 = self._cell(x + radius, y + radius)
+        for i in range(i0, i1+1):
+            for j in range(j0, j1+1):
+                for key in self._cells.get((i, j), ()):
+                    px, py = self._points[key]
+                    d = math.sqrt((px - x) ** 2 + (py - y) ** 2)
+                    if d <= radius:
+                        found.append((d, key))
+        found.sort()
+        return found
+
+    def nearest(self, x, y, radius):
+        """
+        Returns the key of the point nearest to (x, y) within radius, or None.
+        """
+        found = self.within(x, y, radius)
+        return found[0][1] if found else None
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+
+def _points_box(points):
+    """
+    Returns the bounding box (xmin, ymin, xmax, ymax) of a sequence of
+    (x, y) points.
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    return (low[0], low[1], high[0], high[1])
+
+def _boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _box_distance(box, x, y):
+    """
+    Returns the distance from (x, y) to the nearest point of box.
+    """
+    dx = max(box[0] - x, 0.0, x - box[2])
+    dy = max(box[1] - y, 0.0, y - box[3])
+    return math.sqrt(dx*dx + dy*dy)
+
+def _horner(coefficients, s):
+    """
+    Evaluates the polynomial with coefficients (highest power first) and its
+    first two derivatives at s. Returns (value, first, second).
+    """
+    value = coefficients[0]
+    first = second = 0.0
+    for c in coefficients[1:]:
+        second = second*s + 2*first
+        first = first*s + value
+        value = value*s + c
+    return value, first, second
@@ -0,0 +1,35 @@
+from bench import *
+import unittest
+
+class TestBench(unittest.TestCase):
+    def test_make_spline(self):
+        for degree in range(1, 8):
+            bs = make_spline(degree, 20, 0.5)
+            self.assertTrue(bs.is_valid())
+
+    def test_cases(self):
+        keys = [key for key, factory, args in cases([1, 3], [10, 2000], [0.5])]
+        self.assertTrue('render[degree=3,n=10,dt=0.5]' in keys)
+        self.assertTrue('knot_difference[degree=1]' in keys)
+        self.assertTrue('parse_data[n=2000]' in keys)
+        # Knot insertion is capped at 1000 control points.
+        self.assertFalse('insert_knot[degree=3,n=2000,dt=0.5]' in keys)
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_run(self):
+        results = run([2], [10], [0.5], repeat=1, name_filter='de_boor')
+        self.assertEqual(results['results'].keys(),
+                ['de_boor[degree=2,n=10,dt=0.5]'])
+        self.assertTrue(results['results'].values()[0]['seconds'] > 0)
+
+    def test_compare(self):
+        old = {'results': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0},
+            'c': {'seconds': 1.0}}}
+        new = {'results': {'a': {'seconds': 1.05}, 'b': {'seconds': 1.5}}}
+        rows = compare(old, new, threshold=0.1)
+        self.assertEqual([(r[0], r[4]) for r in rows],
+                [('a', False), ('b', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
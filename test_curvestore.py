@@ -0,0 +1,84 @@
+from curvestore import *
+import os
+import shutil
+import tempfile
+import unittest
+
+DATA = """degree=3
+dt=0.5
+(1, 3)
+(2, 4)
+(6, 5)
+(5, 1)
+(2, 1)
+(0, 2)
+[0,0,0,1,3,4,4,4]
+degree=2
+(0, 0)
+(2, -5)
+(4, 0)
+[0,0,1,1]
+"""
+
+class TestCurveStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.dir, 'curves.data')
+        self.store = os.path.join(self.dir, 'curves.cstore')
+        f = open(self.data, 'w')
+        f.write(DATA)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_convert(self):
+        self.assertEqual(convert(self.data, self.store), 2)
+        store = CurveStore(self.store)
+        try:
+            self.assertEqual(len(store), 2)
+            self.assertEqual(store.points(0).tolist(),
+                    [[1, 3], [2, 4], [6, 5], [5, 1], [2, 1], [0, 2]])
+            self.assertEqual(store.knots(0).tolist(), [0,0,0,1,3,4,4,4])
+            self.assertEqual(store.knots(1).tolist(), [0,0,1,1])
+            self.assertEqual(store.index[1]['degree'], 2)
+            self.assertEqual(store.index[0]['dt'], 0.5)
+        finally:
+            store.close()
+
+    def test_round_trip(self):
+        curves = list(read_curves(DATA.split('\n')))
+        write_store(self.store, curves)
+        with CurveStore(self.store) as store:
+            for curve, stored in zip(curves, store):
+                self.assertEqual(stored.render(), curve.render())
+                self.assertEqual(stored.dt, curve.dt)
+            self.assertRaises(IndexError, store.__getitem__, 2)
+
+    def test_zero_copy(self):
+        convert(self.data, self.store)
+        with CurveStore(self.store) as store:
+            compact = store.compact(0)
+            self.assertFalse(compact.points.flags.owndata)
+            self.assertFalse(compact.points.flags.writeable)
+            self.assertTrue(compact.knots.base is not None)
+            self.assertEqual(compact.evaluate([2]).shape, (1, 2))
+
+    def test_not_a_store(self):
+        self.assertRaises(CurveStoreException, CurveStore, self.data)
+
+    def test_short_file(self):
+        # Empty, shorter than the header, and cut off in the index.
+        convert(self.data, self.store)
+        f = open(self.store, 'rb')
+        data = f.read()
+        f.close()
+        for size in (0, HEADER.size - 1, len(data) - 1):
+            f = open(self.store, 'wb')
+            f.write(data[:size])
+            f.close()
+            self.assertRaises(CurveStoreException, CurveStore, self.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 from libcurvey import *
+from libcurvey import _knot_span_range, _chord_distance, _sample_parameters
 from util import *
 import unittest
+import numpy
 
 class TestBSpline(unittest.TestCase):
     def setUp(self):
@@ -75,6 +77,241 @@ class TestBSpline(unittest.TestCase):
         self.assertFalse(epsilon_equals(points[2].y(), 0))
         # TODO test
 
+    def test_de_boor_point(self):
+        # P(2,2,2) from the knot insertion example in test_insert_knot.
+        knots = [float(k) for k in self.bs1.user_knotvec]
+        xs = [cp.x() for cp in self.bs1.user_points]
+        ys = [cp.y() for cp in self.bs1.user_points]
+        first, last = _knot_span_range(knots, 3)
+        self.assertEqual((first, last), (2, 4))
+
+        x, y = self.bs1._de_boor_point(2, knots, xs, ys, first, last)
+        self.assertTrue(epsilon_equals(x, 46.0/9))
+        self.assertTrue(epsilon_equals(y, 53.0/18))
+
+        # End points of the clamped curve are the end control points.
+        x, y = self.bs1._de_boor_point(0, knots, xs, ys, first, last)
+        self.assertTrue(epsilon_equals(x, 1) and epsilon_equals(y, 3))
+        x, y = self.bs1._de_boor_point(4, knots, xs, ys, first, last)
+        self.assertTrue(epsilon_equals(x, 0) and epsilon_equals(y, 2))
+
+    def test_de_boor_matches_knot_insertion(self):
+        self.bs1._de_boor(dt=.5)
+        points = self.bs1._internal_points
+        self.assertEqual(len(points), 9)
+        self.assertTrue(epsilon_equals(points[4].x(), 46.0/9))
+        self.assertTrue(epsilon_equals(points[4].y(), 53.0/18))
+
+    def test_evaluate(self):
+        control_points, polars, points = self.bs1.render(dt=.1)
+        ts = [i * .1 for i in range(len(points))]
+        evaluated = self.bs1.evaluate(ts)
+        self.assertEqual(evaluated.shape, (len(points), 2))
+        for p, e in zip(points, evaluated):
+            self.assertTrue(epsilon_equals(p[0], e[0]))
+            self.assertTrue(epsilon_equals(p[1], e[1]))
+
+        x, y = self.bs1.evaluate(2)[0]
+        self.assertTrue(epsilon_equals(x, 46.0/9))
+        self.assertTrue(epsilon_equals(y, 53.0/18))
+
+        bs = BSpline(degree=3)
+        self.assertRaises(InvalidBSplineException, bs.evaluate, [0])
+
+    def test_render_as_array(self):
+        control_points, polars, points = self.bs1.render(dt=.1)
+        cps, array_polars, array_points = self.bs1.render(dt=.1, as_array=True)
+        self.assertEqual(cps, control_points)
+        self.assertEqual(array_polars, polars)
+        self.assertEqual(array_points.shape, (len(points), 2))
+        for p, e in zip(points, array_points):
+            self.assertTrue(epsilon_equals(p[0], e[0]))
+            self.assertTrue(epsilon_equals(p[1], e[1]))
+
+    def test_span_cache(self):
+        points = [ControlPoint(Point(i, i % 3)) for i in range(12)]
+        bs = BSpline(points=points, knotvec=range(14), degree=3, dt=.25)
+        bs.render()
+        cached = dict(bs._span_cache)
+        self.assertEqual(sorted(cached.keys()), range(2, 11))
+
+        bs.replace_control_point(points[6], ControlPoint(Point(6, 10)))
+        self.assertEqual(sorted(bs._span_cache.keys()), [2, 3, 4, 9, 10])
+        for k in bs._span_cache:
+            self.assertTrue(bs._span_cache[k] is cached[k])
+
+        fresh = BSpline(points=bs.user_points[:], knotvec=range(14), degree=3,
+                dt=.25)
+        self.assertEqual(bs.render(), fresh.render())
+
+        bs.remove_control_point(bs.user_points[8])
+        self.assertEqual(sorted(bs._span_cache.keys()), [2, 3, 4, 5, 6])
+        bs.replace_knot_vector(range(13))
+        self.assertEqual(bs._span_cache, {})
+
+    def test_basis_matrix(self):
+        ts = numpy.arange(0, 4, .1)
+        basis = BasisMatrix(self.bs1.user_knotvec.vec, 3, ts)
+        self.assertEqual(basis.shape, (len(ts), 6))
+        dense = basis.todense()
+        # Partition of unity.
+        self.assertTrue(numpy.allclose(dense.sum(axis=1), 1))
+        self.assertTrue(numpy.allclose(basis.dot(self.bs1._points_array()),
+            self.bs1.evaluate(ts)))
+
+    def test_basis_cache(self):
+        cache = BasisCache(maxsize=2)
+        kv = [0,0,0,1,3,4,4,4]
+        b1 = cache.get(kv, 3, .1)
+        self.assertTrue(cache.get(kv, 3, .1) is b1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.get(kv, 3, .2)
+        cache.get(kv, 3, .1)
+        cache.get(range(8), 3, .1)
+        self.assertEqual(len(cache), 2)
+        # The least recently used (dt=.2) was evicted.
+        cache.get(kv, 3, .1)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        cache.get(kv, 3, .2)
+        self.assertEqual(cache.misses, 4)
+
+        cache.discard(kv, 3, .2)
+        self.assertEqual(len(cache), 1)
+
+    def test_basis_cache_nonzeros(self):
+        kv = [0,0,0,1,3,4,4,4]
+        size = BasisMatrix(kv, 3, _sample_parameters(kv, 3, .1)).weights.size
+        cache = BasisCache(maxnonzeros=2*size)
+        cache.get(kv, 3, .1)
+        cache.get([k + 1 for k in kv], 3, .1)
+        self.assertEqual((len(cache), cache.nonzeros), (2, 2*size))
+        # The dt=.05 grid is twice as big: both others make room for it.
+        cache.get(kv, 3, .05)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.nonzeros <= 2*size)
+        # A matrix over the bound on its own is not cached at all.
+        cache.get(kv, 3, .01)
+        self.assertEqual(len(cache), 1)
+        cache.discard(kv, 3, .05)
+        self.assertEqual((len(cache), cache.nonzeros), (0, 0))
+
+    def test_replace_knot_vector_keeps_shared_basis(self):
+        BSpline.basis_cache.clear()
+        other = BSpline(points=self.bs1.user_points[:],
+                knotvec=self.bs1.user_knotvec.vec[:], degree=3)
+        self.bs1.render(as_array=True)
+        self.assertEqual(len(BSpline.basis_cache), 1)
+        self.bs1.replace_knot_vector([0,0,0,1,2,4,4,4])
+        # other still uses the old knot vector's matrix.
+        other.render(as_array=True)
+        self.assertEqual(BSpline.basis_cache.hits, 1)
+
+    def test_empty_parameter_range(self):
+        bspline = BSpline(points=[ControlPoint(Point(i, i)) for i in
+            range(4)], knotvec=[1,1,1,1,1,1], degree=3)
+        self.assertTrue(bspline.is_valid())
+        self.assertEqual(bspline.render()[2], [])
+        points = bspline.render(as_array=True)[2]
+        self.assertEqual((points.shape, points.dtype), ((0, 2), numpy.float64))
+        self.assertEqual(bspline.evaluate([1, 2]).shape, (0, 2))
+        self.assertEqual(bspline.render_uniform_length(5)[2], [])
+        self.assertEqual(bspline.render_uniform_length(5,
+            as_array=True)[2].shape, (0, 2))
+        compact = CompactBSpline.from_bspline(bspline)
+        self.assertEqual(compact.render()[2].shape, (0, 2))
+
+    def test_tessellate(self):
+        points = self.bs1.tessellate(0.01)
+        self.assertTrue(epsilon_equals(points[0][0], 1))
+        self.assertTrue(epsilon_equals(points[0][1], 3))
+        self.assertTrue(epsilon_equals(points[-1][0], 0))
+        self.assertTrue(epsilon_equals(points[-1][1], 2))
+
+        # Every point of the curve is within tolerance of the polyline.
+        for x, y in self.bs1.evaluate(numpy.linspace(0, 4, 400)):
+            distance = min(_chord_distance((x, y), a, b)
+                    for a, b in zip(points, points[1:]))
+            self.assertTrue(distance <= 0.01)
+
+        coarse = self.bs1.tessellate(0.1)
+        self.assertTrue(len(coarse) < len(points))
+
+    def test_tessellate_view(self):
+        points = self.bs1.tessellate_view(0.01)
+        self.assertTrue(numpy.allclose(points, self.bs1.tessellate(0.01)))
+
+        # Spans culled by the box are cut to their chord, but the curve
+        # inside the box is still within tolerance of the polyline.
+        box = (0, 0, 1.5, 2.5)
+        culled = self.bs1.tessellate_view(0.01, box)
+        self.assertTrue(len(culled) < len(points))
+        self.assertTrue(numpy.allclose(culled[[0, -1]], points[[0, -1]]))
+        for x, y in self.bs1.evaluate(numpy.linspace(0, 4, 400)):
+            if not (box[0] <= x <= box[2] and box[1] <= y <= box[3]):
+                continue
+            distance = min(_chord_distance((x, y), a, b)
+                    for a, b in zip(culled, culled[1:]))
+            self.assertTrue(distance <= 0.01)
+
+        # Zoomed far into one span, only the part of it near the box is
+        # tessellated, but the curve inside the box is still within
+        # tolerance.
+        x, y = self.bs1.evaluate(2)[0]
+        box = (x - 0.01, y - 0.01, x + 0.01, y + 0.01)
+        zoomed = self.bs1.tessellate_view(1e-5, box)
+        self.assertTrue(len(zoomed) < len(self.bs1.tessellate(1e-5)) / 10)
+        self.assertTrue(numpy.allclose(zoomed[[0, -1]], points[[0, -1]]))
+        for x, y in self.bs1.evaluate(numpy.linspace(1.9, 2.1, 400)):
+            if not (box[0] <= x <= box[2] and box[1] <= y <= box[3]):
+                continue
+            distance = min(_chord_distance((x, y), a, b)
+                    for a, b in zip(zoomed, zoomed[1:]))
+            self.assertTrue(distance <= 1e-5)
+
+        # Spans are cached per tolerance, and dropped when a control point
+        # they depend on moves.
+        self.assertTrue(self.bs1.tessellate_view(0.01, box) is not culled)
+        self.assertEqual(sorted(self.bs1._lod_cache.keys()), [1e-5, 0.01])
+        cp = self.bs1.user_points[0]
+        self.bs1.replace_control_point(cp, ControlPoint(Point(1, 2)))
+        self.assertTrue(numpy.allclose(self.bs1.tessellate_view(0.01)[0],
+            (1, 2)))
+        self.assertEqual(self.bs1.render(tolerance=0.01, box=box)[2],
+                [tuple(p) for p in self.bs1.tessellate_view(0.01,
+                    box).tolist()])
+
+    def test_render_tolerance(self):
+        control_points, polars, points = self.bs1.render(tolerance=0.01)
+        self.assertEqual(points, self.bs1.tessellate(0.01))
+        control_points, polars, points = self.bs1.render(tolerance=0.01,
+                as_array=True)
+        self.assertEqual(points.shape[1], 2)
+
+    def test_read_curves(self):
+        lines = """degree=2
+(0, 0)
+(2, -5)
+(4, 0)
+[0,0,1,1]
+degree=1
+(0, 0)
+(1, 1)
+[0, 1]
+""".split('\n')
+        curves = list(read_curves(lines))
+        self.assertEqual(len(curves), 2)
+        self.assertEqual(curves[0].degree, 2)
+        self.assertEqual(len(curves[1].user_points), 2)
+
+        curves = read_curves(lines[:5] + ["degree=2", "(0, 0)", "[0, 1]"])
+        self.assertEqual(next(curves).degree, 2)
+        try:
+            next(curves)
+            self.fail()
+        except DataParseException as e:
+            self.assertEqual(e.lineno, 6)
+
     def test_is_invalid_if_not_enough_points(self):
         bs = BSpline(degree=4)
         self.assertFalse(bs.is_valid())
@@ -118,6 +355,204 @@ class TestBSpline(unittest.TestCase):
         self.assertRaises(Exception,
                 self.bs1._polar_to_control_point, KnotVector([100,4,4]))
 
+    def test_refine(self):
+        refined = self.bs1.refine([2])
+        self.assertEqual(refined.user_knotvec, KnotVector([0,0,0,1,2,3,4,4,4]))
+        # Same points as test_insert_knot.
+        points = refined.user_points
+        self.assertTrue(epsilon_equals(points[2].x(), 14.0/3))
+        self.assertTrue(epsilon_equals(points[2].y(), 14.0/3))
+        self.assertTrue(epsilon_equals(points[3].x(), 11.0/2))
+        self.assertTrue(epsilon_equals(points[3].y(), 3))
+        self.assertTrue(epsilon_equals(points[4].x(), 4))
+        self.assertTrue(epsilon_equals(points[4].y(), 1))
+
+        refined = self.bs1.refine([2, 2, 0.5, 3.5, 2, 4, 1])
+        self.assertEqual(len(refined.user_points), 13)
+        self.assertEqual(refined.user_knotvec, KnotVector(
+            [0,0,0,0.5,1,1,2,2,2,3,3.5,4,4,4,4]))
+        ts = numpy.linspace(0, 4, 50)
+        self.assertTrue(numpy.allclose(refined.evaluate(ts),
+            self.bs1.evaluate(ts)))
+        # P(2,2,2) is now a control point.
+        self.assertTrue(epsilon_equals(refined.user_points[6].x(), 46.0/9))
+        self.assertTrue(epsilon_equals(refined.user_points[6].y(), 53.0/18))
+
+        self.assertEqual(len(self.bs1.refine([]).user_points), 6)
+        self.assertRaises(IllegalKnotVectorException, self.bs1.refine, [5])
+
+    def test_refine_unclamped(self):
+        points = [ControlPoint(Point(i, (-1) ** i)) for i in range(7)]
+        bs = BSpline(points=points, knotvec=range(9), degree=3)
+        refined = bs.refine([2, 2.5, 3, 4.25, 6])
+        ts = numpy.linspace(2, 6, 50)
+        self.assertTrue(numpy.allclose(refined.evaluate(ts), bs.evaluate(ts)))
+
+    def test_bezier_segments(self):
+        segments = self.bs1.bezier_segments()
+        self.assertEqual([(t0, t1) for t0, t1, points in segments],
+                [(0, 1), (1, 3), (3, 4)])
+        for t0, t1, points in segments:
+            self.assertEqual(len(points), 4)
+            start, end = self.bs1.evaluate([t0, t1])
+            self.assertTrue(numpy.allclose(points[0], start))
+            self.assertTrue(numpy.allclose(points[-1], end))
+        self.assertTrue(numpy.allclose(segments[0][2][0], (1, 3)))
+
+    def test_point_at(self):
+        ts = numpy.linspace(0, 4, 41)
+        expected = self.bs1.evaluate(ts)
+        for t, p in zip(ts, expected):
+            self.assertTrue(numpy.allclose(self.bs1.point_at(t), p))
+        self.assertTrue(numpy.allclose(self.bs1.points_at(ts), expected))
+
+        self.bs1.replace_control_point(self.cp3, ControlPoint(Point(0, 0)))
+        self.assertTrue(numpy.allclose(self.bs1.points_at(ts),
+            self.bs1.evaluate(ts)))
+
+        points = [ControlPoint(Point(i, (-1) ** i)) for i in range(7)]
+        bs = BSpline(points=points, knotvec=range(9), degree=3)
+        ts = numpy.linspace(2, 6, 41)
+        self.assertTrue(numpy.allclose(bs.points_at(ts), bs.evaluate(ts)))
+
+    def test_derivative(self):
+        d1 = self.bs1.derivative()
+        self.assertEqual(d1.degree, 2)
+        self.assertEqual(len(d1.user_points), 5)
+        self.assertEqual(d1.user_knotvec, KnotVector([0,0,1,3,4,4]))
+        # The first control point is 3 * (P1 - P0) / (1 - 0).
+        self.assertEqual((d1.user_points[0].x(), d1.user_points[0].y()), (3, 3))
+
+        ts = numpy.linspace(0.05, 3.95, 40)
+        h = 1e-6
+        numeric = (self.bs1.evaluate(ts + h) - self.bs1.evaluate(ts - h)) / (2*h)
+        self.assertTrue(numpy.allclose(d1.evaluate(ts), numeric, atol=1e-5))
+
+        ders = self.bs1.derivatives(ts, 3)
+        self.assertEqual(ders.shape, (4, 40, 2))
+        self.assertTrue(numpy.allclose(ders[0], self.bs1.evaluate(ts)))
+        self.assertTrue(numpy.allclose(ders[1], numeric, atol=1e-5))
+        self.assertTrue(numpy.allclose(ders[2],
+            self.bs1.derivative(2).evaluate(ts)))
+        self.assertTrue(numpy.allclose(ders[2], d1.derivative().evaluate(ts)))
+
+        # The third derivative is not a BSpline, but derivatives() gives it:
+        # the slope of the linear second derivative on each span, and zero
+        # beyond.
+        self.assertRaises(ValueError, self.bs1.derivative, 3)
+        d2 = self.bs1.derivative(2)
+        ders = self.bs1.derivatives(ts, 4)
+        for t0, t1 in [(0, 1), (1, 3), (3, 4)]:
+            inside = (ts > t0) & (ts < t1)
+            ends = d2.evaluate([t0 + 1e-9, t1 - 1e-9])
+            slope = (ends[1] - ends[0]) / (t1 - t0 - 2e-9)
+            self.assertTrue(numpy.allclose(ders[3][inside], slope))
+        self.assertTrue(numpy.all(ders[4] == 0))
+
+    def test_tangent_and_curvature(self):
+        # Quadratic Bezier y = x**2 for x in [-1, 1].
+        points = [ControlPoint(Point(x, y)) for x, y in [(-1, 1), (0, -1),
+            (1, 1)]]
+        bs = BSpline(points=points, knotvec=[0, 0, 1, 1], degree=2)
+        points, tangents, curvatures = bs.frames([0, 0.5, 1])
+        self.assertTrue(numpy.allclose(points, [(-1, 1), (0, 0), (1, 1)]))
+        self.assertTrue(numpy.allclose(tangents[1], (1, 0)))
+        root5 = 5 ** 0.5
+        self.assertTrue(numpy.allclose(tangents[0], (1/root5, -2/root5)))
+        # Curvature of y = x**2 is 2 / (1 + 4x**2) ** 1.5.
+        self.assertTrue(numpy.allclose(curvatures,
+            [2 / 5 ** 1.5, 2, 2 / 5 ** 1.5]))
+        self.assertTrue(numpy.allclose(bs.tangent([0.5]), [(1, 0)]))
+        self.assertTrue(numpy.allclose(bs.curvature([0.5]), [2]))
+
+        # Degree 1: straight lines have no curvature.
+        line = BSpline(points=[ControlPoint(Point(0, 0)),
+            ControlPoint(Point(2, 0))], knotvec=[0, 1], degree=1)
+        self.assertTrue(numpy.allclose(line.curvature([0.2, 0.7]), 0))
+
+    def test_arc_length(self):
+        # A polyline of length 5 + 5, at speed 5 on each unit span.
+        line = BSpline(points=[ControlPoint(Point(0, 0)),
+            ControlPoint(Point(3, 4)), ControlPoint(Point(3, 9))],
+            knotvec=[0, 1, 2], degree=1)
+        self.assertAlmostEqual(line.arc_length(), 10)
+        self.assertAlmostEqual(line.t_at_length(2.5), 0.5)
+        self.assertAlmostEqual(line.t_at_length(7), 1.4)
+        self.assertAlmostEqual(line.t_at_length(-1), 0)
+        self.assertAlmostEqual(line.t_at_length(11), 2)
+
+        ts = numpy.linspace(0, 4, 100001)
+        points = self.bs1.evaluate(ts)
+        steps = numpy.sqrt((numpy.diff(points, axis=0) ** 2).sum(axis=1))
+        lengths = numpy.concatenate([[0], numpy.cumsum(steps)])
+        self.assertAlmostEqual(self.bs1.arc_length(), lengths[-1], places=5)
+
+        s = numpy.array([0.5, 3, 7.25, 10])
+        t = self.bs1.t_at_length(s)
+        self.assertTrue(numpy.allclose(numpy.interp(t, ts, lengths), s,
+            atol=1e-5))
+
+        # Editing a control point drops the table.
+        self.bs1.replace_control_point(self.cp6,
+                ControlPoint(Point(0, 20)))
+        self.assertTrue(self.bs1.arc_length() > lengths[-1] + 10)
+
+    def test_arc_length_cusp(self):
+        # The first derivative vanishes at t=0.3, inside the first span, so
+        # the speed has a kink that fixed quadrature pieces do not resolve.
+        coords = [(0, 0), (1, 1), (-0.38095238095238093, 0.04761904761904778),
+                (0.6190476190476191, -0.9523809523809522), (3, 1), (2, 3),
+                (4, 2)]
+        bs = BSpline(points=[ControlPoint(Point(x, y)) for x, y in coords],
+                knotvec=[0, 0, 0, 1, 1, 1, 2, 2, 2], degree=3)
+        self.assertTrue(numpy.allclose(bs.derivatives([0.3], 1)[1], 0))
+
+        ts = numpy.linspace(0, 2, 400001)
+        points = bs.evaluate(ts)
+        steps = numpy.sqrt((numpy.diff(points, axis=0) ** 2).sum(axis=1))
+        lengths = numpy.concatenate([[0], numpy.cumsum(steps)])
+        self.assertTrue(abs(bs.arc_length() - lengths[-1]) <
+                1e-6 * lengths[-1])
+
+        s = numpy.array([0.1, 0.5, 1, 4])
+        t = bs.t_at_length(s)
+        self.assertTrue(numpy.allclose(numpy.interp(t, ts, lengths), s,
+            atol=1e-6))
+
+    def test_render_uniform_length(self):
+        control_points, polars, points = self.bs1.render_uniform_length(21,
+                as_array=True)
+        self.assertEqual(control_points, self.bs1.render()[0])
+        self.assertEqual(points.shape, (21, 2))
+        self.assertTrue(numpy.allclose(points[[0, -1]],
+            self.bs1.evaluate([0, 4])))
+        # Chords of equal arcs on a gently bending curve are nearly equal.
+        chords = numpy.sqrt((numpy.diff(points, axis=0) ** 2).sum(axis=1))
+        self.assertTrue(chords.max() - chords.min() < 0.02 * chords.mean())
+
+        points = self.bs1.render_uniform_length(3)[2]
+        self.assertEqual(len(points), 3)
+        self.assertEqual(type(points[0]), tuple)
+
+        bs = BSpline(points=[self.cp1], knotvec=[0,0,1], degree=3)
+        self.assertEqual(bs.render_uniform_length(10), ([], [], []))
+
+    def test_polar_index(self):
+        self.assertTrue(self.bs1._polar_to_control_point(
+            KnotVector([1,3,4.00004])) is self.cp4)
+        # Within epsilon, but quantized to a different key.
+        self.assertTrue(self.bs1._polar_to_control_point(
+            KnotVector([0.99996,3,4])) is self.cp4)
+
+        self.bs1._insert_knot(knot=2)
+        cp = self.bs1._polar_to_control_point(KnotVector([1,2,3]))
+        self.assertTrue(cp is self.bs1._internal_points[3])
+        self.assertEqual(len(self.bs1._polar_index), 7)
+
+        self.bs1._internal_points = [self.cp1]
+        self.assertRaises(Exception, self.bs1._polar_to_control_point,
+                KnotVector([1,2,3]))
+
     def test_insert_knot(self):
         # This follows the example on Figure 12 and 13 of
         # "An Introduction to B-Spline Curves". This tests essentially the de
@@ -160,6 +595,61 @@ class TestBSpline(unittest.TestCase):
         self.assertTrue(epsilon_equals(self.bs1._internal_points[6].y(), 1))
 
 
+class TestCompactBSpline(unittest.TestCase):
+    def setUp(self):
+        points = [ControlPoint(Point(x, y)) for x, y in
+                [(1, 3), (2, 4), (6, 5), (5, 1), (2, 1), (0, 2)]]
+        self.bs1 = BSpline(points=points, knotvec=[0,0,0,1,3,4,4,4], degree=3)
+        self.cbs1 = CompactBSpline.from_bspline(self.bs1)
+
+    def test_from_bspline(self):
+        self.assertEqual(self.cbs1.points.shape, (6, 2))
+        self.assertEqual(self.cbs1.points.dtype, numpy.float64)
+        self.assertEqual(self.cbs1.knots.tolist(), [0,0,0,1,3,4,4,4])
+        self.assertEqual(self.cbs1.degree, 3)
+        self.assertTrue(self.cbs1.is_valid())
+
+    def test_is_valid(self):
+        # The same rules as BSpline.is_valid(), negative knots included.
+        for knots in ([0,0,0,1,3,4,4,4], [-0.5,0,0,1,3,4,4,4],
+                [0,0,1,0,3,4,4,4], [0,0,1,3,4,4,4]):
+            bs = BSpline(points=self.bs1.user_points, knotvec=knots, degree=3)
+            compact = CompactBSpline.from_bspline(bs)
+            self.assertEqual(compact.is_valid(), bs.is_valid())
+        self.assertFalse(CompactBSpline(self.cbs1.points,
+            [-0.5,0,0,1,3,4,4,4], 3).is_valid())
+
+    def test_to_bspline(self):
+        bs = self.cbs1.to_bspline()
+        self.assertTrue(bs.is_valid())
+        self.assertEqual(bs.user_knotvec, self.bs1.user_knotvec)
+        self.assertEqual(bs.render(), self.bs1.render())
+
+    def test_render(self):
+        control_points, polars, points = self.bs1.render(dt=.1)
+        cps, compact_polars, compact_points = self.cbs1.render(dt=.1)
+        self.assertEqual(cps.tolist(), [list(cp) for cp in control_points])
+        self.assertEqual(compact_polars, polars)
+        self.assertTrue(numpy.allclose(compact_points, points))
+
+    def test_views(self):
+        cp = self.cbs1[2]
+        self.assertEqual((cp.x(), cp.y()), (6, 5))
+        self.assertEqual(cp.polar(), KnotVector([0,1,3]))
+        self.assertEqual(self.cbs1[-1].polar(), KnotVector([4,4,4]))
+        self.assertRaises(IndexError, self.cbs1.__getitem__, 6)
+
+        cp.x(0)
+        self.assertEqual(self.cbs1.points[2, 0], 0)
+        self.assertEqual([p.y() for p in self.cbs1], [3, 4, 5, 1, 1, 2])
+
+    def test_no_copy(self):
+        buf = numpy.zeros((10, 2))
+        cbs = CompactBSpline(buf[2:8], numpy.arange(8.0), 3)
+        cbs[0].x(7)
+        self.assertEqual(buf[2, 0], 7)
+
+
 class TestControlPoint(unittest.TestCase):
     def setUp(self):
         self.cp1 = ControlPoint()
@@ -262,6 +752,9 @@ class TestKnotVector(unittest.TestCase):
         kv = KnotVector([4,3,2,1])
         self.assertFalse(kv.is_valid())
 
+        kv = KnotVector([-0.5,0,1])
+        self.assertFalse(kv.is_valid())
+
     def test_insert(self):
         self.kv1.insert(1)
         self.assertEqual(self.kv1.vec, [1])
@@ -281,6 +774,31 @@ class TestKnotVector(unittest.TestCase):
         self.kv1.insert(1)
         self.assertEqual(self.kv1.vec, [0,1,1,1,5,10])
 
+    def test_insert_unsorted(self):
+        kv = KnotVector([3,1,2])
+        kv.insert(2)
+        self.assertEqual(kv.vec, [2,3,1,2])
+
+    def test_multiplicity(self):
+        self.assertEqual(self.kv3.multiplicity(3), 3)
+        self.assertEqual(self.kv3.multiplicity(4), 1)
+        self.assertEqual(self.kv3.multiplicity(4.5), 0)
+        self.assertEqual(self.kv1.multiplicity(0), 0)
+        self.assertEqual(KnotVector([1,0,1]).multiplicity(1), 2)
+
+    def test_find_span(self):
+        self.assertEqual(self.kv3.find_span(2), -1)
+        self.assertEqual(self.kv3.find_span(3), 2)
+        self.assertEqual(self.kv3.find_span(4.5), 3)
+        self.assertEqual(self.kv3.find_span(5), 4)
+        self.assertEqual(self.kv3.find_span(6), 7)
+
+    def test_cmp_does_not_sort(self):
+        kv1 = KnotVector([2,1,0])
+        kv2 = KnotVector([0,1,3])
+        self.assertTrue(kv1 < kv2)
+        self.assertEqual(kv1.vec, [2,1,0])
+
     def test_equal(self):
         kv1 = KnotVector()
         kv2 = KnotVector(range(5))
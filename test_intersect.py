@@ -0,0 +1,106 @@
+from intersect import *
+import unittest
+import numpy
+
+def make_spline(points, knotvec, degree):
+    return BSpline(points=[ControlPoint(Point(x, y)) for x, y in points],
+            knotvec=knotvec, degree=degree)
+
+class TestIntersect(unittest.TestCase):
+    def setUp(self):
+        # A cubic wave around y = 0.
+        self.wave = make_spline([(0, 0), (1, 3), (2, -3), (3, 3), (4, -3),
+            (5, 0)], [0,0,0,1,2,3,3,3], 3)
+        self.bump = make_spline([(0, 2), (2, -4), (3, 5), (5, -1)],
+                [0,0,0,1,1,1], 3)
+
+    def assertOnCurves(self, hits, a, b, tolerance=1e-8):
+        for ta, tb, point in hits:
+            self.assertTrue(numpy.allclose(a.evaluate([ta])[0], point,
+                atol=tolerance))
+            self.assertTrue(numpy.allclose(b.evaluate([tb])[0], point,
+                atol=tolerance))
+
+    def test_intersect_line(self):
+        hits = intersect_line(self.wave, (-1, 0.5), (6, 0.2))
+        self.assertEqual(len(hits), 4)
+        line = make_spline([(-1, 0.5), (6, 0.2)], [0, 1], 1)
+        self.assertOnCurves(hits, self.wave, line)
+        self.assertEqual([round(t, 6) for t, u, p in hits],
+                [0.056153, 0.700819, 1.661432, 2.086249])
+
+        self.assertEqual(intersect_line(self.wave, (0, 10), (5, 10)), [])
+        # The segment ends before reaching the curve.
+        self.assertEqual(intersect_line(self.wave, (-3, 0.5), (-1, 0.5)), [])
+
+    def test_intersect_curves(self):
+        hits = intersect_curves(self.wave, self.bump)
+        self.assertEqual(len(hits), 3)
+        self.assertOnCurves(hits, self.wave, self.bump)
+        self.assertEqual([t for t, u, p in hits],
+                sorted(t for t, u, p in hits))
+
+        swapped = intersect_curves(self.bump, self.wave)
+        self.assertEqual(sorted((round(u, 9), round(t, 9)) for t, u, p in
+            swapped), sorted((round(t, 9), round(u, 9)) for t, u, p in hits))
+
+    def test_brute_force(self):
+        # Every crossing of the dense polylines is found.
+        ts = numpy.linspace(0, 3, 3001)
+        us = numpy.linspace(0, 1, 1001)
+        a = self.wave.evaluate(ts)
+        b = self.bump.evaluate(us)
+        crossings = 0
+        for i in range(len(a) - 1):
+            p, r = a[i], a[i+1] - a[i]
+            q, s = b[:-1], b[1:] - b[:-1]
+            denom = r[0]*s[:, 1] - r[1]*s[:, 0]
+            w = q - p
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t = (w[:, 0]*s[:, 1] - w[:, 1]*s[:, 0]) / denom
+                u = (w[:, 0]*r[1] - w[:, 1]*r[0]) / denom
+            crossings += numpy.sum((t >= 0) & (t < 1) & (u >= 0) & (u < 1))
+        self.assertEqual(len(intersect_curves(self.wave, self.bump)),
+                crossings)
+
+    def test_tolerance(self):
+        hits = intersect_curves(self.wave, self.bump, tolerance=1e-3)
+        self.assertEqual(len(hits), 3)
+        self.assertOnCurves(hits, self.wave, self.bump, 1e-3)
+
+    def test_lines(self):
+        a = make_spline([(0, 0), (4, 4)], [0, 1], 1)
+        b = make_spline([(0, 4), (4, 0)], [0, 1], 1)
+        self.assertEqual(intersect_curves(a, b), [(0.5, 0.5, (2.0, 2.0))])
+        # A collinear overlap is reported by its ends.
+        self.assertEqual(intersect_line(a, (1, 1), (3, 3)),
+                [(0.25, 0.0, (1.0, 1.0)), (0.75, 1.0, (3.0, 3.0))])
+
+    def test_overlap(self):
+        hits = intersect_curves(self.wave, self.wave)
+        self.assertEqual([(t, u) for t, u, p in hits], [(0, 0), (3, 3)])
+        self.assertOnCurves(hits, self.wave, self.wave)
+
+    def test_parallel_chords(self):
+        # The chord of the arc is parallel to the line, which crosses it
+        # twice.
+        arc = make_spline([(0, 0), (5, 0.1), (10, 0)], [0, 0, 1, 1], 2)
+        hits = intersect_line(arc, (-1, 0.02), (11, 0.02))
+        line = make_spline([(-1, 0.02), (11, 0.02)], [0, 1], 1)
+        self.assertOnCurves(hits, arc, line)
+        self.assertEqual([round(t, 6) for t, u, p in hits],
+                [0.112702, 0.887298])
+
+        # The line through the ends of the arc meets it only there.
+        hits = intersect_line(arc, (-1, 0), (11, 0))
+        self.assertEqual([(round(t, 9), p) for t, u, p in hits],
+                [(0, (0, 0)), (1, (10, 0))])
+
+    def test_tangent(self):
+        bump = make_spline([(0, 0), (1, 2), (2, 0)], [0, 0, 1, 1], 2)
+        hits = intersect_line(bump, (-1, 1), (3, 1), tolerance=1e-6)
+        self.assertEqual(len(hits), 1)
+        self.assertAlmostEqual(hits[0][0], 0.5, places=3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+from spatial import *
+import random
+import unittest
+import numpy
+
+def make_curve(rand, x, y):
+    points = [ControlPoint(Point(x + rand.uniform(0, 5), y + rand.uniform(0, 5)))
+            for i in range(6)]
+    return BSpline(points=points, knotvec=[0,0,0,1,2,3,3,3], degree=3)
+
+def brute_closest(bspline, x, y):
+    ts = numpy.linspace(0, 3, 30001)
+    points = bspline.evaluate(ts)
+    distances = numpy.sqrt(((points - (x, y)) ** 2).sum(axis=1))
+    i = distances.argmin()
+    return distances[i], ts[i]
+
+class TestBoundingBoxTree(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(1)
+        self.boxes = []
+        for i in range(200):
+            x, y = rand.uniform(0, 100), rand.uniform(0, 100)
+            self.boxes.append((x, y, x + rand.uniform(0, 3),
+                y + rand.uniform(0, 3)))
+        self.tree = BoundingBoxTree(self.boxes)
+
+    def test_query(self):
+        box = (20, 30, 50, 45)
+        expected = [i for i, b in enumerate(self.boxes) if b[0] <= box[2]
+                and box[0] <= b[2] and b[1] <= box[3] and box[1] <= b[3]]
+        self.assertEqual(sorted(self.tree.query(box)), expected)
+        self.assertEqual(len(self.tree), 200)
+
+    def test_nearest(self):
+        centers = [((b[0] + b[2]) / 2, (b[1] + b[3]) / 2) for b in self.boxes]
+        def distance(i):
+            d = ((centers[i][0] - 40) ** 2 + (centers[i][1] - 60) ** 2) ** 0.5
+            return d, centers[i]
+
+        d, i, center = self.tree.nearest(40, 60, distance)
+        expected = min(range(200), key=lambda j: distance(j)[0])
+        self.assertEqual(i, expected)
+        self.assertEqual(center, centers[i])
+        self.assertEqual(self.tree.nearest(40, 60, distance, d / 2), None)
+
+    def test_empty(self):
+        tree = BoundingBoxTree([])
+        self.assertEqual(tree.query((0, 0, 1, 1)), [])
+        self.assertEqual(tree.nearest(0, 0, None), None)
+
+class TestCurveIndex(unittest.TestCase):
+    def setUp(self):
+        self.bspline = make_curve(random.Random(2), 0, 0)
+        self.index = CurveIndex(self.bspline)
+
+    def test_closest_point(self):
+        rand = random.Random(3)
+        for i in range(20):
+            x, y = rand.uniform(-2, 7), rand.uniform(-2, 7)
+            d, t, point = self.index.closest_point(x, y)
+            expected_d, expected_t = brute_closest(self.bspline, x, y)
+            self.assertAlmostEqual(d, expected_d, places=6)
+            self.assertTrue(numpy.allclose(self.bspline.evaluate([t])[0],
+                point))
+
+    def test_hit_test(self):
+        x, y = self.bspline.evaluate([1.3])[0]
+        d, t, point = self.index.closest_point(x + 0.01, y, 0.5)
+        self.assertTrue(d <= 0.01 + 1e-9)
+        self.assertEqual(self.index.closest_point(100, 100, 0.5), None)
+
+    def test_query(self):
+        self.assertEqual(self.index.query((-100, -100, 100, 100)),
+                [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(self.index.query((50, 50, 60, 60)), [])
+
+class TestCollectionIndex(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(4)
+        self.curves = [make_curve(rand, rand.uniform(0, 200),
+            rand.uniform(0, 200)) for i in range(100)]
+        # Invalid curves are skipped but keep their positions.
+        self.curves.insert(10, BSpline(points=[], degree=3))
+        self.index = CollectionIndex(self.curves)
+
+    def test_closest_point(self):
+        rand = random.Random(5)
+        for i in range(10):
+            x, y = rand.uniform(0, 200), rand.uniform(0, 200)
+            curve, d, t, point = self.index.closest_point(x, y)
+            # Every curve scanned, without the tree.
+            expected = min((CurveIndex(c).closest_point(x, y)[0], j) for j, c
+                    in enumerate(self.curves) if c.is_valid())
+            self.assertEqual(curve, expected[1])
+            self.assertEqual(d, expected[0])
+        self.assertEqual(self.index.closest_point(-500, -500, 1), None)
+
+    def test_compact_curves(self):
+        index = CollectionIndex([CompactBSpline.from_bspline(c) for c in
+            self.curves if c.is_valid()])
+        curve, d, t, point = self.index.closest_point(50, 50)
+        self.assertEqual(index.closest_point(50, 50)[1:], (d, t, point))
+
+    def test_query(self):
+        found = self.index.query((0, 0, 50, 50))
+        self.assertTrue(10 not in found)
+        for i, curve in enumerate(self.curves):
+            if not curve.is_valid():
+                continue
+            points = curve._points_array()
+            overlaps = (points[:, 0].min() <= 50 and points[:, 1].min() <= 50)
+            self.assertEqual(i in found, overlaps)
+
+class TestPointGrid(unittest.TestCase):
+    def setUp(self):
+        self.grid = PointGrid(cell=0.5)
+        self.grid.insert('a', 0, 0)
+        self.grid.insert('b', 1, 1)
+        self.grid.insert('c', -0.2, 0.1)
+
+    def test_nearest(self):
+        self.assertEqual(self.grid.nearest(0.9, 0.9, 0.25), 'b')
+        self.assertEqual(self.grid.nearest(-0.15, 0.05, 1), 'c')
+        self.assertEqual(self.grid.nearest(3, 3, 1), None)
+
+    def test_within(self):
+        self.assertEqual([k for d, k in self.grid.within(0, 0, 2)],
+                ['a', 'c', 'b'])
+        self.assertEqual([k for d, k in self.grid.within(0, 0, 0.1)], ['a'])
+
+    def test_move_and_remove(self):
+        self.grid.move('a', 5, 5)
+        self.assertEqual(self.grid.get('a'), (5, 5))
+        self.assertEqual(self.grid.nearest(0, 0, 0.1), None)
+        self.assertEqual(self.grid.nearest(5.1, 5, 0.2), 'a')
+        self.grid.remove('a')
+        self.assertFalse('a' in self.grid)
+        self.assertEqual(len(self.grid), 2)
+        self.assertRaises(KeyError, self.grid.remove, 'a')
+        self.grid.clear()
+        self.assertEqual(self.grid.within(0, 0, 10), [])
+
+    def test_matches_scan(self):
+        rand = random.Random(6)
+        points = dict((i, (rand.uniform(-5, 5), rand.uniform(-5, 5))) for i in
+                range(500))
+        grid = PointGrid(cell=0.3)
+        for key, (x, y) in points.items():
+            grid.insert(key, x, y)
+        for n in range(20):
+            x, y = rand.uniform(-5, 5), rand.uniform(-5, 5)
+            expected = sorted(((px - x) ** 2 + (py - y) ** 2) ** 0.5 for
+                    px, py in points.values())
+            found = [d for d, key in grid.within(x, y, 0.7)]
+            expected = [d for d in expected if d <= 0.7]
+            self.assertEqual(len(found), len(expected))
+            self.assertTrue(numpy.allclose(found, expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from uibatch import *
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+CURVE = """degree=3
+dt=0.5
+(1, 3)
+(2, 4)
+(6, 5)
+(5, 1)
+(2, 1)
+(0, 2)
+[0,0,0,1,3,4,4,4]
+"""
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for i in range(5):
+            f = open(os.path.join(self.dir, 'curve%d.data' % i), 'w')
+            f.write(CURVE)
+            f.close()
+        f = open(os.path.join(self.dir, 'bad.data'), 'w')
+        f.write("degree=3\n(0, 0)\n[0,1]\n")
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find_curve_files(self):
+        filenames = find_curve_files(self.dir)
+        self.assertEqual([os.path.basename(f) for f in filenames],
+                ['bad.data'] + ['curve%d.data' % i for i in range(5)])
+
+        manifest = os.path.join(self.dir, 'manifest')
+        f = open(manifest, 'w')
+        f.write("# curves\ncurve1.data\n\ncurve3.data\n")
+        f.close()
+        self.assertEqual(find_curve_files(manifest),
+                [os.path.join(self.dir, 'curve1.data'),
+                    os.path.join(self.dir, 'curve3.data')])
+
+    def test_render_file(self):
+        filename, points, error = render_file(
+                os.path.join(self.dir, 'curve0.data'))
+        self.assertEqual(error, None)
+        self.assertEqual(points.shape, (9, 2))
+
+        filename, points, error = render_file(
+                os.path.join(self.dir, 'bad.data'))
+        self.assertEqual(points, None)
+        self.assertEqual(error, "invalid curve")
+
+    def test_render_files(self):
+        out = StringIO.StringIO()
+        curves, points, failures = render_files(find_curve_files(self.dir),
+                out, processes=2, chunksize=2)
+        self.assertEqual((curves, points, failures), (5, 45, 1))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len([l for l in lines if l.startswith('#')]), 6)
+        self.assertEqual(len([l for l in lines if l.startswith('(')]), 45)
+
+
+if __name__ == '__main__':
+    unittest.main()
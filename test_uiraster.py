@@ -0,0 +1,146 @@
+from uiraster import *
+import os
+import zlib
+import struct
+import shutil
+import tempfile
+import unittest
+import numpy
+from StringIO import StringIO
+
+def read_png(data):
+    """
+    Decodes the 8-bit RGBA, unfiltered PNGs written by Raster.write_png.
+    """
+    assert data[:8] == '\x89PNG\r\n\x1a\n'
+    pos = 8
+    chunks = {}
+    while pos < len(data):
+        length, tag = struct.unpack('>I4s', data[pos:pos+8])
+        body = data[pos+8:pos+8+length]
+        crc, = struct.unpack('>I', data[pos+8+length:pos+12+length])
+        assert crc == zlib.crc32(tag + body) & 0xffffffff
+        chunks[tag] = body
+        pos += 12 + length
+    width, height = struct.unpack('>II', chunks['IHDR'][:8])
+    raw = numpy.frombuffer(zlib.decompress(chunks['IDAT']), dtype=numpy.uint8)
+    return raw.reshape((height, -1))[:, 1:].reshape((height, width, 4))
+
+class TestRaster(unittest.TestCase):
+    def setUp(self):
+        self.raster = Raster(20, 10, background="#ffffff")
+
+    def test_parse_color(self):
+        self.assertEqual(parse_color("#0000ff"), (0, 0, 255, 255))
+        self.assertEqual(parse_color("#ff000080"), (255, 0, 0, 128))
+        self.assertEqual(parse_color((1, 2, 3)), (1, 2, 3, 255))
+
+    def test_draw_polyline(self):
+        self.raster.draw_polyline([(2, 5.5), (18, 5.5)], color="#000000")
+        pixels = self.raster.pixels
+        self.assertTrue((pixels[5, 3:17, :3] == 0).all())
+        self.assertTrue((pixels[:5, :, :3] == 255).all())
+        self.assertTrue((pixels[6:, :, :3] == 255).all())
+        # Anti-aliased ends.
+        self.assertTrue(0 < pixels[5, 18, 0] < 255)
+
+        # Between two rows of pixel centers, both are half covered.
+        raster = Raster(20, 10, background="#ffffff")
+        raster.draw_polyline([(2, 5), (18, 5)], color="#000000")
+        self.assertTrue((raster.pixels[4:6, 3:17, 0] == 128).all())
+
+    def test_polyline_joints(self):
+        # Overlapping segments do not darken the shared pixels twice.
+        self.raster.draw_polyline([(2, 5.3), (10, 5.3), (18, 5.3)],
+                color="#000000")
+        once = Raster(20, 10, background="#ffffff")
+        once.draw_polyline([(2, 5.3), (18, 5.3)], color="#000000")
+        self.assertTrue((self.raster.pixels == once.pixels).all())
+
+    def test_draw_points(self):
+        self.raster.draw_points([(10.5, 5.5)], fill="#ff0000",
+                outline="#000000", radius=3)
+        pixels = self.raster.pixels
+        self.assertEqual(tuple(pixels[5, 10]), (255, 0, 0, 255))
+        self.assertEqual(tuple(pixels[5, 7, :3]), (0, 0, 0))
+        self.assertEqual(tuple(pixels[2, 10, :3]), (0, 0, 0))
+        self.assertEqual(tuple(pixels[0, 0]), (255, 255, 255, 255))
+
+    def test_clipping(self):
+        self.raster.draw_polyline([(-100, -100), (100, 100)])
+        self.raster.draw_points([(-50, 5), (25, 5)])
+        self.assertEqual(self.raster.pixels.shape, (10, 20, 4))
+
+    def test_chunks(self):
+        import uiraster
+        points = [(i % 20, (i * 7) % 10) for i in range(50)]
+        self.raster.draw_polyline(points)
+        saved = uiraster.RASTER_CHUNK
+        uiraster.RASTER_CHUNK = 16
+        try:
+            chunked = Raster(20, 10, background="#ffffff")
+            chunked.draw_polyline(points)
+        finally:
+            uiraster.RASTER_CHUNK = saved
+        self.assertTrue((self.raster.pixels == chunked.pixels).all())
+
+    def test_write_png(self):
+        self.raster.draw_points([(10, 5)])
+        f = StringIO()
+        self.raster.write_png(f)
+        self.assertTrue((read_png(f.getvalue()) == self.raster.pixels).all())
+
+    def test_write_ppm(self):
+        f = StringIO()
+        self.raster.write_ppm(f)
+        data = f.getvalue()
+        self.assertTrue(data.startswith('P6\n20 10\n255\n'))
+        self.assertEqual(len(data), len('P6\n20 10\n255\n') + 20*10*3)
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        points = [ControlPoint(Point(x, y)) for x, y in [(1, 3), (2, 4),
+            (6, 3), (5, 1), (2, 1), (0, 2)]]
+        self.bspline = BSpline(points=points, knotvec=[0,0,0,1,3,4,4,4],
+                degree=3, dt=0.05)
+
+    def test_render_bspline(self):
+        raster = render_bspline(self.bspline)
+        self.assertEqual(raster.pixels.shape, (320, 640, 4))
+        # Control point (1, 3) is drawn at canvas (352, 64).
+        self.assertEqual(tuple(raster.pixels[64, 352]), (255, 0, 0, 255))
+        blue = (raster.pixels[:, :, 2] > 200) & (raster.pixels[:, :, 0] < 100)
+        self.assertTrue(blue.sum() > 100)
+
+        raster = render_bspline(BSpline(degree=3))
+        self.assertTrue((raster.pixels == parse_color(COLOR_BG)).all())
+
+    def test_render_thumbnail(self):
+        raster = render_thumbnail(self.bspline, 64, 48, margin=6)
+        drawn = (raster.pixels != parse_color(COLOR_BG)).any(axis=2)
+        rows = numpy.nonzero(drawn.any(axis=1))[0]
+        columns = numpy.nonzero(drawn.any(axis=0))[0]
+        # The control points are 5 wide and 3 high: x fills the width up to
+        # the margin (which the circles reach into), y is centered.
+        self.assertTrue(columns[0] < 6 and columns[-1] > 64 - 7)
+        self.assertTrue(abs((rows[0] + rows[-1]) - 47) <= 1)
+
+    def test_main(self):
+        dir = tempfile.mkdtemp()
+        try:
+            data = os.path.join(dir, 'curves.data')
+            f = open(data, 'w')
+            f.write("degree=3\n(1, 3)\n(2, 4)\n(6, 3)\n(5, 1)\n"
+                    "[0,0,0,1,1,1]\ndegree=1\n(0, 0)\n(1, 1)\n[0,1]\n")
+            f.close()
+            out = os.path.join(dir, 'out')
+            self.assertEqual(main(['uiraster.py', '-s', '32x24', data, out]),
+                    0)
+            self.assertEqual(sorted(os.listdir(out)), ['0.png', '1.png'])
+            image = read_png(open(os.path.join(out, '1.png'), 'rb').read())
+            self.assertEqual(image.shape, (24, 32, 4))
+        finally:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    unittest.main()
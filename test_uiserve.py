@@ -0,0 +1,142 @@
+from uiserve import *
+import uiserve
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+CURVE = """degree=3
+dt=0.5
+(1, 3)
+(2, 4)
+(6, 5)
+(5, 1)
+(2, 1)
+(0, 2)
+[0,0,0,1,3,4,4,4]
+"""
+
+class TestProtocol(unittest.TestCase):
+    def test_binary_round_trip(self):
+        bspline = list(read_curves(CURVE.splitlines()))[0]
+        curve = decode_curve(BINARY, encode_curve(bspline))
+        expected = CompactBSpline.from_bspline(bspline)
+        self.assertTrue(numpy.array_equal(curve.points, expected.points))
+        self.assertTrue(numpy.array_equal(curve.knots, expected.knots))
+        self.assertEqual((curve.degree, curve.dt), (3, 0.5))
+
+    def test_handle_request(self):
+        reply = handle_request(TEXT, CURVE)
+        kind, length = FRAME.unpack_from(reply)
+        self.assertEqual((kind, length), (OK, 9 * 2 * 8))
+        points = numpy.frombuffer(reply[FRAME.size:], dtype='<f8')
+        bspline = list(read_curves(CURVE.splitlines()))[0]
+        expected = bspline.render(as_array=True)[2]
+        self.assertTrue(numpy.allclose(points.reshape((-1, 2)), expected))
+
+        for kind, body, message in [
+                (TEXT, "degree=3\n(0, 0)\n[0,1]\n", "invalid curve"),
+                (TEXT, "(0, 0)\n", "no degree= in curve"),
+                (BINARY, "\0" * 4, "truncated binary curve"),
+                (TEXT, "degree=1\ndt=-0.5\n(0, 0)\n(1, 1)\n[0, 1]\n",
+                    "bad dt -0.5"),
+                (BINARY, uiserve.CURVE.pack(1, 0, 0, float('nan')), "bad dt nan"),
+                (BINARY, uiserve.CURVE.pack(1, 0, 0, float('inf')), "bad dt inf"),
+                (TEXT, CURVE.replace("dt=0.5", "dt=0.00000002"),
+                    "too many samples (200000001) at dt 2e-08"),
+                (TEXT, "degree=2\n(0, 0)\n(1, 1)\n(2, 0)\n[0,0,1e9,1e9]\n",
+                    "too many samples (5000000001) at dt 0.2"),
+                (7, "", "unknown request kind 7")]:
+            reply = handle_request(kind, body)
+            self.assertEqual(reply, error_frame(message))
+
+class TestCurveServer(unittest.TestCase):
+    processes = 0
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'curvey.sock')
+        self.server = CurveServer(self.path, self.processes)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.expected = list(read_curves(CURVE.splitlines()))[0].render(
+                as_array=True)[2]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def test_render(self):
+        client = CurveClient(self.path)
+        with client:
+            self.assertTrue(numpy.allclose(client.render(CURVE),
+                self.expected))
+            self.assertTrue(numpy.allclose(client.render(CURVE.splitlines()),
+                self.expected))
+            bspline = list(read_curves(CURVE.splitlines()))[0]
+            self.assertTrue(numpy.allclose(client.render(bspline),
+                self.expected))
+            self.assertTrue(numpy.allclose(client.render(
+                CompactBSpline.from_bspline(bspline)), self.expected))
+
+            # An error reply leaves the connection usable.
+            self.assertRaises(ServeException, client.render, "degree=3\n")
+            self.assertTrue(numpy.allclose(client.render(CURVE),
+                self.expected))
+
+    def test_concurrent_clients(self):
+        failures = []
+        def run():
+            with CurveClient(self.path) as client:
+                for i in range(20):
+                    if not numpy.allclose(client.render(CURVE), self.expected):
+                        failures.append(i)
+
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+class TestCurveServerPool(TestCurveServer):
+    processes = 2
+
+class TestStaleSocket(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_stale_socket(self):
+        # A socket file nobody listens on is replaced; a live one is kept.
+        path = os.path.join(self.dir, 'curvey.sock')
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(path)
+        s.close()
+        server = CurveServer(path, 0)
+        self.assertRaises(socket.error, CurveServer, path, 0)
+        self.assertTrue(os.path.exists(path))
+        server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+class TestCurveyImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        # Modes other than --ui do not load Tkinter.
+        code = ("import sys, runpy; sys.argv = ['curvey.py']; "
+                "runpy.run_path('curvey.py', run_name='__main__'); "
+                "sys.stderr.write(repr('Tkinter' in sys.modules))")
+        process = subprocess.Popen([sys.executable, '-c', code],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        self.assertEqual(err, 'False')
+
+if __name__ == '__main__':
+    unittest.main()
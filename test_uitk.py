@@ -0,0 +1,100 @@
+from uitk import *
+import time
+import numpy
+import threading
+import unittest
+
+class TestPreviewWorker(unittest.TestCase):
+    def setUp(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+        self.worker = PreviewWorker(self.evaluate)
+
+    def tearDown(self):
+        self.release.set()
+        self.worker.stop()
+
+    def evaluate(self, request):
+        self.calls.append(request)
+        self.started.set()
+        self.release.wait()
+        if request == 'fail':
+            raise ValueError(request)
+        return request * 2
+
+    def wait_for_result(self):
+        for i in range(500):
+            result = self.worker.result()
+            if result is not None:
+                return result
+            time.sleep(0.01)
+        self.fail("no result")
+
+    def test_coalesces(self):
+        self.worker.submit(1)
+        self.started.wait(5)
+        # While 1 is being evaluated, 2 and 3 come in: only 3 is evaluated.
+        self.worker.submit(2)
+        self.worker.submit(3)
+        self.release.set()
+        results = [self.wait_for_result()]
+        if results[0] == 2:
+            results.append(self.wait_for_result())
+        self.assertEqual(results[-1], 6)
+        self.assertEqual(self.calls, [1, 3])
+        self.assertEqual(self.worker.result(), None)
+
+    def test_cancel(self):
+        self.worker.submit(1)
+        self.started.wait(5)
+        self.worker.submit(2)
+        self.worker.cancel()
+        self.release.set()
+        self.worker.submit(4)
+        self.assertEqual(self.wait_for_result(), 8)
+        self.assertEqual(self.calls, [1, 4])
+
+    def test_errors(self):
+        self.release.set()
+        self.worker.submit('fail')
+        self.worker.submit(5)
+        self.assertEqual(self.wait_for_result(), 10)
+
+class TestUpdateBSpline(unittest.TestCase):
+    def test_update_bspline(self):
+        cps = [(1, 3), (2, 4), (6, 3), (5, 1)]
+        bspline = update_bspline(None, None, cps, [0,0,0,1,1,1], 3, 0.1)
+        self.assertTrue(bspline.is_valid())
+        first = bspline.user_points[0]
+
+        cps[2] = (7, 3)
+        same = update_bspline(bspline, 0.1, cps, [0,0,0,1,1,1], 3, 0.1)
+        self.assertTrue(same is bspline)
+        self.assertTrue(same.user_points[0] is first)
+        self.assertEqual(same.user_points[2].x(), 7)
+
+        other = update_bspline(bspline, 0.1, cps, [0,0,0,1,1,1], 3, 0.2)
+        self.assertTrue(other is not bspline)
+
+class TestViewDetail(unittest.TestCase):
+    def test_view_detail(self):
+        view = ViewTransform.canvas(640, 320, 32)
+        tolerance, box = view_detail(view, 640, 320)
+        self.assertTrue(LOD_PIXEL_TOLERANCE / 64.0 < tolerance <=
+                LOD_PIXEL_TOLERANCE / 32.0)
+        self.assertTrue(numpy.allclose(box, (-10, -5, 10, 5)))
+
+        # Zooms within a factor of two share a tolerance.
+        self.assertEqual(view_detail(view.zoom(0.6), 640, 320)[0], tolerance)
+
+        # Zoomed in about the middle, the tolerance and box shrink together.
+        zoomed = view.zoom(4, 320, 160)
+        tolerance, box = view_detail(zoomed, 640, 320, margin=4)
+        self.assertTrue(LOD_PIXEL_TOLERANCE / 256.0 < tolerance <=
+                LOD_PIXEL_TOLERANCE / 128.0)
+        self.assertTrue(numpy.allclose(box, (-2.53125, -1.28125, 2.53125,
+            1.28125)))
+
+if __name__ == '__main__':
+    unittest.main()
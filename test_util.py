@@ -1,5 +1,7 @@
 from util import *
+import math
 import unittest
+import numpy
 
 class TestUtil(unittest.TestCase):
     def setUp(self):
@@ -27,6 +29,109 @@ class TestUtil(unittest.TestCase):
         transformed = canvas2world(points, 640, 320, 32, 32)
         self.assertEqual(transformed, expected)
 
+    def test_world2canvas_array(self):
+        points = numpy.array([(-10, 5), (10, -5), (0, 0), (1.5, 2.25)])
+        expected = world2canvas(points.tolist(), 640, 320, 32)
+        self.assertTrue(numpy.allclose(world2canvas_array(points, 640, 320,
+            32), expected))
+        self.assertTrue(numpy.allclose(world2canvas_array(points, 640, 320,
+            32, 16), world2canvas(points.tolist(), 640, 320, 32, 16)))
+
+        out = numpy.empty_like(points)
+        result = world2canvas_array(points, 640, 320, 32, out=out)
+        self.assertTrue(result is out)
+        self.assertTrue(numpy.allclose(out, expected))
+
+        # In place.
+        canvas2world_array(out, 640, 320, 32, out=out)
+        self.assertTrue(numpy.allclose(out, points))
+
+    def test_view_transform(self):
+        points = numpy.array([(0, 0), (1, 0), (0, 2), (-3, 4)], dtype=float)
+        view = ViewTransform.canvas(640, 320, 32)
+        self.assertTrue(numpy.allclose(view.apply(points),
+            world2canvas(points.tolist(), 640, 320, 32)))
+
+        # World (1, 0) is canvas (352, 160); rotating a quarter turn about
+        # the middle of the canvas moves it to (320, 192).
+        rotated = view.rotate(math.pi / 2, 320, 160)
+        self.assertTrue(numpy.allclose(rotated.apply([(1, 0)]), [(320, 192)]))
+        zoomed = view.zoom(2, 320, 160).pan(10, -5)
+        self.assertTrue(numpy.allclose(zoomed.apply([(1, 0)]), [(394, 155)]))
+
+        # A general affine transform, and inverses of all of them.
+        skew = ViewTransform([[1, 2], [3, 4]], (5, 6))
+        self.assertTrue(numpy.allclose(skew.apply([(1, 1)]), [(8, 13)]))
+        for t in (view, rotated, zoomed, skew):
+            self.assertTrue(numpy.allclose(t.invert().apply(t.apply(points)),
+                points))
+            inplace = points.copy()
+            t.apply(inplace, out=inplace)
+            self.assertTrue(numpy.allclose(inplace, t.apply(points)))
+
+            # Float32 and non-contiguous out take the matrix path.
+            single = numpy.empty(points.shape, dtype=numpy.float32)
+            self.assertTrue(t.apply(points, out=single) is single)
+            self.assertTrue(numpy.allclose(single, t.apply(points), atol=1e-4))
+            strided = numpy.zeros((len(points), 4))[:, ::2]
+            t.apply(points, out=strided)
+            self.assertTrue(numpy.allclose(strided, t.apply(points)))
+
+    def test_world_box(self):
+        view = ViewTransform.canvas(640, 320, 32)
+        self.assertTrue(numpy.allclose(view.world_box(640, 320),
+            (-10, -5, 10, 5)))
+        self.assertTrue(numpy.allclose(view.world_box(640, 320, margin=32),
+            (-11, -6, 11, 6)))
+        zoomed = view.zoom(2, 320, 160)
+        self.assertEqual(zoomed.scale(), 64)
+        self.assertTrue(numpy.allclose(zoomed.world_box(640, 320),
+            (-5, -2.5, 5, 2.5)))
+        self.assertTrue(numpy.allclose(view.rotate(0.3).scale(), 32))
+
+    def test_iter_data(self):
+        lines = """degree=3
+dt=0.1
+(1, 3)
+(2, 4)
+[0,0,1]
+
+# Second curve.
+degree=2
+(0, 0)
+[0, 1]
+""".split('\n')
+        records = list(iter_data(lines))
+        self.assertEqual(records, [
+            ([[1, 3], [2, 4]], [0, 0, 1], 3, 0.1, 1),
+            ([[0, 0]], [0, 1], 2, None, 8)])
+
+    def test_iter_data_errors(self):
+        lines = ["degree=2", "(0, 0)", "(1, x)"]
+        try:
+            list(iter_data(lines))
+            self.fail()
+        except DataParseException as e:
+            self.assertEqual(e.lineno, 3)
+
+        lines = ["degree=2", "[0, 1]", "(1, 1)", "[0, 2]"]
+        try:
+            list(iter_data(lines))
+            self.fail()
+        except DataParseException as e:
+            self.assertEqual(e.lineno, 4)
+
+        self.assertRaises(DataParseException, list, iter_data(["(1, 1)"]))
+
+    def test_iter_data_streams(self):
+        def lines():
+            yield "degree=1"
+            yield "(0, 0)"
+            yield "degree=1"
+            raise RuntimeError("read too far")
+        records = iter_data(lines())
+        self.assertEqual(next(records)[0], [[0, 0]])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import getopt
+import multiprocessing
+from libcurvey import *
+from util import *
+
+USAGE = """Usage: python curvey.py --batch [options] input output
+
+input is a directory of .data files or a manifest listing one .data file
+per line. The rendered points of every curve are written to output.
+
+Options:
+    -p N, --processes=N     Number of worker processes (default: one per CPU).
+    -c N, --chunksize=N     Files handed to a worker at a time (default: 16)."""
+
+def find_curve_files(path):
+    """
+    Returns the curve files named by path: every .data file in it if it is a
+    directory, or else every line of it as a manifest. Relative manifest
+    entries are relative to the manifest's directory.
+    """
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if n.endswith('.data'))
+        return [os.path.join(path, n) for n in names]
+
+    base = os.path.dirname(path)
+    filenames = []
+    for line in open(path, 'r'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        filenames.append(os.path.join(base, line))
+    return filenames
+
+def render_file(filename):
+    """
+    Parses and renders one curve file. Returns (filename, points, error),
+    where points is an (N, 2) array, or None if the curve could not be
+    rendered and error says why.
+    """
+    try:
+        control_points, knotvec, degree, dt = parse_data(filename=filename)
+        bspline = BSpline(degree=degree, dt=dt)
+        for cp in control_points:
+            bspline.insert_control_point(ControlPoint(Point(cp[0], cp[1])))
+        bspline.replace_knot_vector(knotvec)
+        if not bspline.is_valid():
+            return filename, None, "invalid curve"
+        control_points, polars, points = bspline.render(as_array=True)
+        return filename, points, None
+    except Exception as e:
+        return filename, None, str(e)
+
+def render_files(filenames, out, processes=None, chunksize=16):
+    """
+    Renders filenames on a pool of worker processes, writing each curve to
+    the file object out as soon as it is done (in completion order). Returns
+    (curves, points, failures) counts.
+    """
+    curves = points = failures = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        for filename, rendered, error in pool.imap_unordered(render_file,
+                filenames, chunksize):
+            if rendered is None:
+                out.write("# %s: %s\n" % (filename, error))
+                failures += 1
+                continue
+            out.write("# %s\n" % filename)
+            out.write(''.join("(%r, %r)\n" % (x, y) for x, y in
+                rendered.tolist()))
+            curves += 1
+            points += len(rendered)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return curves, points, failures
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv[1:], 'p:c:', ['processes=',
+            'chunksize='])
+    except getopt.GetoptError as e:
+        print >> sys.stderr, e
+        print >> sys.stderr, USAGE
+        return 2
+    if len(args) != 2:
+        print >> sys.stderr, USAGE
+        return 2
+
+    processes = None
+    chunksize = 16
+    for opt, value in opts:
+        if opt in ('-p', '--processes'):
+            processes = int(value)
+        elif opt in ('-c', '--chunksize'):
+            chunksize = int(value)
+
+    filenames = find_curve_files(args[0])
+    start = time.time()
+    out = open(args[1], 'w')
+    try:
+        curves, points, failures = render_files(filenames, out, processes,
+                chunksize)
+    finally:
+        out.close()
+    elapsed = max(time.time() - start, 1e-9)
+
+    print >> sys.stderr, ("Rendered %d curves (%d points, %d failed) in "
+            "%.2fs: %.1f curves/s, %.0f points/s" % (curves, points, failures,
+                elapsed, curves / elapsed, points / elapsed))
+    return 0 if not failures else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,6 +1,5 @@
 from libcurvey import *
 from util import *
-import uitk
 
 def main(argv):
     control_points, knotvec, degree, dt = parse_data(filename=argv[1])
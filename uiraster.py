@@ -0,0 +1,272 @@
+import os
+import sys
+import zlib
+import struct
+import getopt
+import numpy
+from libcurvey import *
+from util import *
+
+# Same palette as uitk.
+COLOR_BG = "#cccccc"
+COLOR_LINE = "#0000ff"
+COLOR_CP_FILL = "#ff0000"
+COLOR_CP_OUTLINE = "#000000"
+
+# Most (item, pixel) pairs rasterized at once. Bounds the temporary arrays.
+RASTER_CHUNK = 1 << 20
+
+USAGE = """Usage: python uiraster.py [options] infile.data outdir
+
+Renders a thumbnail of every curve in infile.data to outdir/N.png, without
+a display.
+
+Options:
+    -s WxH, --size=WxH      Thumbnail size in pixels (default: 128x128).
+    -f FMT, --format=FMT    png or ppm (default: png).
+    --no-control-points     Draw only the curve."""
+
+class Raster(object):
+    """
+    An RGBA image in a numpy array, with anti-aliased drawing of polylines
+    and control points. Coordinates are canvas coordinates: (0,0) is the
+    top-left corner of the top-left pixel, +x is right and +y is down.
+    """
+    def __init__(self, width, height, background=COLOR_BG):
+        self.width = width
+        self.height = height
+        self.pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+        self.pixels[...] = parse_color(background)
+
+    def draw_polyline(self, points, color=COLOR_LINE, width=1.0):
+        """
+        Draws the polyline through points, an (N, 2) array-like, with lines
+        width pixels wide. Where segments meet, the pixel takes the largest
+        coverage instead of being drawn twice.
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+        if len(points) == 1:
+            points = numpy.vstack([points, points])
+        a, b = points[:-1], points[1:]
+        radius = width / 2.0
+
+        def distance(items, x, y):
+            ax, ay = a[items, 0], a[items, 1]
+            dx, dy = b[items, 0] - ax, b[items, 1] - ay
+            length2 = dx*dx + dy*dy
+            u = numpy.zeros_like(x)
+            nonzero = length2 > 0
+            u[nonzero] = (((x - ax)*dx + (y - ay)*dy)[nonzero] /
+                    length2[nonzero])
+            numpy.clip(u, 0.0, 1.0, out=u)
+            ex, ey = x - (ax + u*dx), y - (ay + u*dy)
+            return numpy.clip(radius + 0.5 - numpy.sqrt(ex*ex + ey*ey), 0, 1)
+
+        low = numpy.minimum(a, b) - radius - 1
+        high = numpy.maximum(a, b) + radius + 1
+        self._blend(self._coverage(low, high, distance), color)
+
+    def draw_points(self, points, fill=COLOR_CP_FILL, outline=COLOR_CP_OUTLINE,
+            radius=4.0, width=1.0):
+        """
+        Draws a circle of the given radius around each of points, an (N, 2)
+        array-like, filled with fill and outlined width pixels wide. Either
+        color may be None to leave it out.
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+        if not len(points):
+            return
+
+        def center_distance(items, x, y):
+            ex, ey = x - points[items, 0], y - points[items, 1]
+            return numpy.sqrt(ex*ex + ey*ey)
+
+        low = points - radius - width - 1
+        high = points + radius + width + 1
+        if fill is not None:
+            self._blend(self._coverage(low, high, lambda items, x, y:
+                numpy.clip(radius + 0.5 - center_distance(items, x, y), 0, 1)),
+                fill)
+        if outline is not None:
+            self._blend(self._coverage(low, high, lambda items, x, y:
+                numpy.clip(width / 2.0 + 0.5 -
+                    numpy.abs(center_distance(items, x, y) - radius), 0, 1)),
+                outline)
+
+    def write_png(self, f):
+        """
+        Writes the image to the file object f as an 8-bit RGBA PNG.
+        """
+        raw = numpy.zeros((self.height, self.width * 4 + 1), dtype=numpy.uint8)
+        raw[:, 1:] = self.pixels.reshape((self.height, -1))
+        f.write('\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk('IHDR', struct.pack('>IIBBBBB', self.width,
+            self.height, 8, 6, 0, 0, 0)))
+        f.write(_png_chunk('IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(_png_chunk('IEND', ''))
+
+    def write_ppm(self, f):
+        """
+        Writes the image to the file object f as a binary PPM. PPM has no
+        alpha channel, so alpha is dropped.
+        """
+        f.write('P6\n%d %d\n255\n' % (self.width, self.height))
+        f.write(numpy.ascontiguousarray(self.pixels[:, :, :3]).tobytes())
+
+    def save(self, filename):
+        """
+        Writes the image to filename, as a PPM if it ends in .ppm and as a
+        PNG otherwise.
+        """
+        f = open(filename, 'wb')
+        try:
+            if filename.lower().endswith('.ppm'):
+                self.write_ppm(f)
+            else:
+                self.write_png(f)
+        finally:
+            f.close()
+
+    def _coverage(self, low, high, coverage):
+        """
+        Returns a (height, width) array of the coverage of every pixel by a
+        set of items, each bounded by the box from low to high (arrays of
+        (x, y) corners). coverage(items, x, y) returns the coverage, from 0
+        to 1, of the pixel centered at (x, y) by each item in items. Pixels
+        take the largest coverage of any item.
+        """
+        x0 = numpy.clip(numpy.floor(low[:, 0]), 0, self.width).astype(int)
+        y0 = numpy.clip(numpy.floor(low[:, 1]), 0, self.height).astype(int)
+        x1 = numpy.clip(numpy.ceil(high[:, 0]), 0, self.width).astype(int)
+        y1 = numpy.clip(numpy.ceil(high[:, 1]), 0, self.height).astype(int)
+        nx = x1 - x0
+        ny = y1 - y0
+        counts = nx * ny
+        ends = numpy.cumsum(counts)
+
+        result = numpy.zeros(self.width * self.height, dtype=numpy.float64)
+        start = 0
+        while start < len(counts):
+            # Take items until RASTER_CHUNK pixels, but at least one item.
+            base = ends[start] - counts[start]
+            stop = max(numpy.searchsorted(ends, base + RASTER_CHUNK,
+                side='right'), start + 1)
+            items = numpy.repeat(numpy.arange(start, stop), counts[start:stop])
+            offsets = (numpy.arange(len(items)) -
+                    numpy.repeat(ends[start:stop] - counts[start:stop] - base,
+                        counts[start:stop]))
+            px = x0[items] + offsets % nx[items]
+            py = y0[items] + offsets // nx[items]
+            values = coverage(items, px + 0.5, py + 0.5)
+            numpy.maximum.at(result, py * self.width + px, values)
+            start = stop
+        return result.reshape((self.height, self.width))
+
+    def _blend(self, coverage, color):
+        """
+        Blends color over the image, weighted by coverage.
+        """
+        color = numpy.array(parse_color(color), dtype=numpy.float64)
+        mask = coverage > 0
+        if not mask.any():
+            return
+        alpha = (coverage[mask] * color[3] / 255.0)[:, None]
+        old = self.pixels[mask].astype(numpy.float64)
+        new = numpy.empty_like(old)
+        new[:, :3] = old[:, :3] * (1 - alpha) + color[:3] * alpha
+        new[:, 3:] = old[:, 3:] * (1 - alpha) + 255.0 * alpha
+        self.pixels[mask] = numpy.round(new).astype(numpy.uint8)
+
+def parse_color(color):
+    """
+    Returns an (r, g, b, a) tuple for a color given as "#rrggbb",
+    "#rrggbbaa" or an (r, g, b) or (r, g, b, a) tuple.
+    """
+    if isinstance(color, basestring):
+        color = color.lstrip('#')
+        color = tuple(int(color[i:i+2], 16) for i in range(0, len(color), 2))
+    if len(color) == 3:
+        color = tuple(color) + (255,)
+    return tuple(color)
+
+def render_bspline(bspline, width=640, height=320, perpixel=32, view=None,
+        control_points=True, dt=None):
+    """
+    Renders bspline to a Raster the way uitk draws it: world (0,0) in the
+    middle of the image, perpixel pixels per unit. view, a
+    util.ViewTransform, overrides width, height and perpixel for placing the
+    curve.
+
+    Returns a Raster, blank if the spline is not valid.
+    """
+    if view is None:
+        view = ViewTransform.canvas(width, height, perpixel)
+    raster = Raster(width, height)
+    if not bspline.is_valid():
+        return raster
+
+    cps, polars, points = bspline.render(dt, as_array=True)
+    raster.draw_polyline(view.apply(points))
+    if control_points:
+        raster.draw_points(view.apply(cps))
+    return raster
+
+def render_thumbnail(bspline, width=128, height=128, margin=8,
+        control_points=True, dt=None):
+    """
+    Renders bspline to a width x height Raster, zoomed to fit its control
+    points (and so the whole curve) inside margin pixels of the border.
+    """
+    if not bspline.is_valid():
+        return Raster(width, height)
+    cps = bspline._points_array()
+    low, high = cps.min(axis=0), cps.max(axis=0)
+    size = numpy.maximum(high - low, 1e-9)
+    scale = min((width - 2.0*margin) / size[0], (height - 2.0*margin) / size[1])
+    middle = (low + high) / 2.0
+    view = ViewTransform([[scale, 0], [0, -scale]],
+            (width / 2.0 - scale * middle[0], height / 2.0 + scale * middle[1]))
+    return render_bspline(bspline, width, height, view=view,
+            control_points=control_points, dt=dt)
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv[1:], 's:f:', ['size=', 'format=',
+            'no-control-points'])
+    except getopt.GetoptError as e:
+        print >> sys.stderr, e
+        print >> sys.stderr, USAGE
+        return 2
+    if len(args) != 2:
+        print >> sys.stderr, USAGE
+        return 2
+
+    width = height = 128
+    extension = 'png'
+    control_points = True
+    for opt, value in opts:
+        if opt in ('-s', '--size'):
+            width, height = [int(v) for v in value.lower().split('x')]
+        elif opt in ('-f', '--format'):
+            extension = value
+        elif opt == '--no-control-points':
+            control_points = False
+
+    infile, outdir = args
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    count = 0
+    for i, bspline in enumerate(read_curves(filename=infile)):
+        raster = render_thumbnail(bspline, width, height,
+                control_points=control_points)
+        raster.save(os.path.join(outdir, "%d.%s" % (i, extension)))
+        count += 1
+    print >> sys.stderr, "Rendered %d thumbnails" % count
+    return 0
+
+def _png_chunk(tag, body):
+    return (struct.pack('>I', len(body)) + tag + body +
+            struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff))
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
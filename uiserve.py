@@ -0,0 +1,305 @@
+import os
+import sys
+import errno
+import signal
+import socket
+import struct
+import getopt
+import SocketServer
+import multiprocessing
+import numpy
+from libcurvey import *
+from util import *
+
+# Wire protocol (little-endian). Every message is a frame:
+#
+#   frame       kind (uint8), 3 pad bytes, body length (uint32), body
+#
+# Requests are TEXT, a curve in the parse_data syntax, or BINARY:
+#
+#   binary      degree, n_points, n_knots (uint32 each), dt (float64, 0 for
+#               the default), then n_points*2 float64 control point
+#               coordinates and n_knots float64 knots, as in a curve store
+#
+# The reply to each request is an OK frame whose body is the rendered points
+# as N*2 float64, or an ERROR frame whose body is the message. A connection
+# takes any number of requests and replies to them in order.
+
+TEXT = 1
+BINARY = 2
+OK = 0
+ERROR = 1
+
+FRAME = struct.Struct('<B3xI')
+CURVE = struct.Struct('<IIId')
+
+# Largest request body accepted, in bytes.
+MAX_REQUEST = 64 << 20
+
+# Most points a request may render, so that a small request cannot ask for
+# an unbounded reply. 1 << 22 points are a 64MB reply, as large as
+# MAX_REQUEST.
+MAX_SAMPLES = 1 << 22
+
+USAGE = """Usage: python curvey.py serve [options] socket
+
+Listens on the Unix socket path socket for curves to render. See uiserve.py
+for the protocol.
+
+Options:
+    -p N, --processes=N     Number of worker processes (default: one per CPU).
+                            0 renders on the connection threads."""
+
+class ServeException(Exception):
+    pass
+
+class CurveServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Curve rendering server on a Unix socket.
+
+    Each connection is served by its own thread, which hands requests to a
+    pool of worker processes, so that requests from different connections
+    are rendered in parallel. With processes=0, requests are rendered on
+    the connection threads instead.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, processes=None):
+        # Only a server that bound path removes it on close.
+        self.path = None
+        self.pool = None
+        _remove_stale_socket(path)
+        SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        if processes != 0:
+            try:
+                self.pool = multiprocessing.Pool(processes,
+                        _ignore_interrupts)
+            except:
+                self.server_close()
+                raise
+
+    def render(self, kind, body):
+        """
+        Returns the reply frame to a request.
+        """
+        if self.pool is None:
+            return handle_request(kind, body)
+        return self.pool.apply(handle_request, (kind, body))
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.path = self.server_address
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+            self.path = None
+
+class _Handler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        while True:
+            header = _recv_exactly(self.request, FRAME.size)
+            if header is None:
+                return
+            kind, length = FRAME.unpack(header)
+            if length > MAX_REQUEST:
+                self.request.sendall(error_frame("request too large"))
+                return
+            body = _recv_exactly(self.request, length) if length else ''
+            if body is None:
+                return
+            self.request.sendall(self.server.render(kind, body))
+
+class CurveClient(object):
+    """
+    Connection to a CurveServer. Not safe to share between threads: open
+    one per thread.
+    """
+    def __init__(self, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(path)
+        except:
+            self._socket.close()
+            raise
+
+    def render(self, curve):
+        """
+        Returns the rendered points of curve as an (N, 2) array. curve is
+        text in the parse_data syntax (a string or list of lines), or a
+        BSpline or CompactBSpline, which is sent in binary.
+
+        Throws ServeException with the server's message if the curve could
+        not be rendered.
+        """
+        if isinstance(curve, basestring):
+            request = frame(TEXT, curve)
+        elif isinstance(curve, (BSpline, CompactBSpline)):
+            request = frame(BINARY, encode_curve(curve))
+        else:
+            request = frame(TEXT, '\n'.join(curve))
+        self._socket.sendall(request)
+
+        header = _recv_exactly(self._socket, FRAME.size)
+        if header is None:
+            raise ServeException("server closed the connection")
+        kind, length = FRAME.unpack(header)
+        body = _recv_exactly(self._socket, length) if length else ''
+        if body is None:
+            raise ServeException("server closed the connection")
+        if kind != OK:
+            raise ServeException(body)
+        return numpy.frombuffer(body, dtype='<f8').reshape((-1, 2))
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def handle_request(kind, body):
+    """
+    Renders the curve in a request body. Returns the reply frame: OK with the
+    points, or ERROR saying why the curve could not be rendered.
+    """
+    try:
+        curve = decode_curve(kind, body)
+        if not curve.is_valid():
+            return error_frame("invalid curve")
+        points = curve.render()[2]
+        return frame(OK, numpy.ascontiguousarray(points,
+            dtype='<f8').tobytes())
+    except MemoryError:
+        return error_frame("out of memory")
+    except Exception as e:
+        return error_frame(str(e))
+
+def decode_curve(kind, body):
+    """
+    Returns the CompactBSpline in a TEXT or BINARY request body.
+    """
+    curve = _decode_curve(kind, body)
+    if len(curve.knots):
+        span = curve.knots[-1] - curve.knots[0]
+        samples = numpy.floor(span / curve.dt) + 1
+        # Also catches NaN and infinite knots.
+        if not samples <= MAX_SAMPLES:
+            raise ServeException("too many samples (%.0f) at dt %r" %
+                    (samples, curve.dt))
+    return curve
+
+def _decode_curve(kind, body):
+    if kind == TEXT:
+        control_points, knotvec, degree, dt = parse_data(body.splitlines())
+        if degree is None:
+            raise ServeException("no degree= in curve")
+        _check_dt(dt)
+        return CompactBSpline(numpy.array(control_points,
+            dtype=numpy.float64).reshape((-1, 2)), knotvec, degree, dt)
+    if kind == BINARY:
+        if len(body) < CURVE.size:
+            raise ServeException("truncated binary curve")
+        degree, n_points, n_knots, dt = CURVE.unpack_from(body)
+        if len(body) != CURVE.size + 8 * (2*n_points + n_knots):
+            raise ServeException("binary curve of %d points and %d knots is "
+                    "%d bytes" % (n_points, n_knots, len(body)))
+        _check_dt(dt)
+        values = numpy.frombuffer(body, dtype='<f8', offset=CURVE.size)
+        return CompactBSpline(values[:2*n_points], values[2*n_points:], degree,
+                dt)
+    raise ServeException("unknown request kind %d" % kind)
+
+def _check_dt(dt):
+    # A NaN, infinite or negative step would fail, or never end, in render().
+    if dt is not None and not (numpy.isfinite(dt) and dt >= 0):
+        raise ServeException("bad dt %r" % dt)
+
+def encode_curve(curve):
+    """
+    Returns the BINARY request body for a BSpline or CompactBSpline.
+    """
+    if isinstance(curve, BSpline):
+        curve = CompactBSpline.from_bspline(curve)
+    return (CURVE.pack(curve.degree, len(curve.points), len(curve.knots),
+        curve.dt) + curve.points.astype('<f8').tobytes() +
+        curve.knots.astype('<f8').tobytes())
+
+def frame(kind, body):
+    return FRAME.pack(kind, len(body)) + body
+
+def error_frame(message):
+    return frame(ERROR, message)
+
+def _recv_exactly(sock, n):
+    """
+    Reads n bytes from sock. Returns None if the connection is closed before
+    the first byte, and throws ServeException if it is closed part way.
+    """
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == n:
+                return None
+            raise ServeException("connection closed mid-message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return ''.join(chunks)
+
+def _ignore_interrupts():
+    # Ctrl-C reaches the workers too; the server shuts them down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _remove_stale_socket(path):
+    """
+    Removes the socket file at path if no server is listening on it, as is
+    left behind by a server that did not exit cleanly.
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.errno == errno.ECONNREFUSED:
+            os.unlink(path)
+    finally:
+        probe.close()
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv[1:], 'p:', ['processes='])
+    except getopt.GetoptError as e:
+        print >> sys.stderr, e
+        print >> sys.stderr, USAGE
+        return 2
+    if len(args) != 1:
+        print >> sys.stderr, USAGE
+        return 2
+
+    processes = None
+    for opt, value in opts:
+        if opt in ('-p', '--processes'):
+            processes = int(value)
+
+    server = CurveServer(args[0], processes)
+    print >> sys.stderr, "Serving on %s" % args[0]
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,7 +1,23 @@
 from Tkinter import *
 import ScrolledText
+import math
+import threading
 from libcurvey import *
 from util import *
+from spatial import *
+
+# Milliseconds between checks for a finished live preview while dragging.
+PREVIEW_POLL_MS = 16
+
+# Largest distance, in pixels, between the curve and the polyline drawn for
+# it, at any zoom.
+LOD_PIXEL_TOLERANCE = 0.5
+
+# Zoom factor of one mouse wheel step, and the range of pixels per world unit
+# the view can be zoomed to.
+ZOOM_STEP = 1.25
+MIN_PERPIXEL = 1
+MAX_PERPIXEL = 65536
 
 class UI:
     _COLOR_BG = "#cccccc"
@@ -23,8 +39,43 @@ class UI:
         self._perpixel = 32
         self._radius = 4
 
+        # World to canvas transform, changed by zooming and panning, and its
+        # inverse. _perpixel follows its scale.
+        self._view = ViewTransform.canvas(canvas_w, canvas_h, self._perpixel)
+        self._view_inverse = self._view.invert()
+        self._pan_from = None
+
         # Data structures
 
+        # Spline drawn last, kept so edits only re-evaluate what changed.
+        self._bspline = None
+        self._bspline_dt = None
+
+        # Canvas items kept between renders and updated in place: the curve
+        # line, and the label items with the (x, y, text) they show.
+        self._line = None
+        self._labels = []
+
+        # Live preview while dragging a control point. The worker thread has
+        # its own spline, so it never shares one with the Tk thread.
+        # _preview_state holds what the drag started with: the control
+        # points in world coordinates, the index of the one being moved, and
+        # the knot vector, degree and dt. Requests add the view they are
+        # drawn for.
+        self._live_preview = True
+        self._preview = PreviewWorker(self._evaluate_preview)
+        self._preview_bspline = None
+        self._preview_bspline_dt = None
+        self._preview_state = None
+        self._preview_after = None
+
+        # Control points, in world coordinates. The canvas only shows them:
+        # _cp_items lists their oval items in curve order, and _cp_grid maps
+        # each item to its world position, for picking.
+        self._cp_items = []
+        self._cp_grid = PointGrid(cell=2.0*self._radius/self._perpixel)
+        self._hover_cp = None
+
         # Moving control points
         self._moving_cp = -1 # cp being moved
         self._moving_cp_tracer = -1 # cp tracer id
@@ -44,18 +95,21 @@ class UI:
 
         self._drawing_labels = False
         self._draw_labels_checkbox = Checkbutton(self._frame, text="Control point labels")
+        self._live_preview_checkbox = Checkbutton(self._frame, text="Live preview")
+        self._live_preview_checkbox.select()
 
         self._clear_button = Button(self._frame, text="Clear")
 
         self._canvas = Canvas(self._frame, width=canvas_w, height=canvas_h,
                 bd=4, background=UI._COLOR_BG)
         self._axis_image = PhotoImage(file='resources/axis.gif')
-        self._canvas.create_image(self._canvas_w/2, self._canvas_h/2,
-                image=self._axis_image)
+        self._axis_item = self._canvas.create_image(self._canvas_w/2,
+                self._canvas_h/2, image=self._axis_image)
 
         # Bindings.
 
         self._draw_labels_checkbox.bind('<Button-1>', self._draw_labels_cb)
+        self._live_preview_checkbox.bind('<Button-1>', self._live_preview_cb)
         self._render_button.bind('<Button-1>', self._render_cb)
         self._clear_button.bind('<Button-1>', self._clear_cb)
 
@@ -63,6 +117,11 @@ class UI:
         self._canvas.bind('<Double-Button-1>', self._canvas_2lclick_cb)
         self._canvas.bind('<Button-2>', self._canvas_rclick_cb)
         self._canvas.bind('<Motion>', self._canvas_motion_cb)
+        self._canvas.bind('<Button-4>', self._canvas_wheel_cb)
+        self._canvas.bind('<Button-5>', self._canvas_wheel_cb)
+        self._canvas.bind('<MouseWheel>', self._canvas_wheel_cb)
+        self._canvas.bind('<Shift-Button-1>', self._canvas_pan_start_cb)
+        self._canvas.bind('<Shift-B1-Motion>', self._canvas_pan_cb)
 
         # Grid placements.
 
@@ -72,6 +131,7 @@ class UI:
         self._canvas.grid(row=2, column=3, columnspan=2)
 
         self._draw_labels_checkbox.grid(row=0, column=0, columnspan=2)
+        self._live_preview_checkbox.grid(row=0, column=3)
         self._render_button.grid(row=1, column=0)
         self._clear_button.grid(row=1, column=1)
 
@@ -80,6 +140,11 @@ class UI:
         Mouse moved on canvas.
         """
         if not self._is_moving_control_point(): 
+            # Show that the control point under the mouse can be picked.
+            hover = self._pick_cp(event.x, event.y)
+            if hover != self._hover_cp:
+                self._canvas.configure(cursor='hand2' if hover else '')
+                self._hover_cp = hover
             return
 
         # We're moving a control point, draw a tracer.
@@ -87,13 +152,49 @@ class UI:
                 event.y-self._radius,
                 event.x+self._radius, event.y+self._radius)
 
+        if self._preview_state is not None:
+            # Ask for the curve through the tracer. Requests the worker has
+            # not started on yet are replaced, not queued.
+            control_points, i, knotvec, degree, dt = self._preview_state
+            control_points = control_points[:]
+            control_points[i] = self._canvas2world(event.x, event.y)
+            self._preview.submit((control_points, knotvec, degree, dt,
+                self._view))
+
+    def _canvas_wheel_cb(self, event):
+        """
+        Mouse wheel on canvas. Zoom in or out about the mouse.
+        """
+        if self._is_moving_control_point():
+            return
+        factor = ZOOM_STEP if event.num == 4 or event.delta > 0 else 1/ZOOM_STEP
+        if MIN_PERPIXEL <= self._perpixel * factor <= MAX_PERPIXEL:
+            self._set_view(self._view.zoom(factor, event.x, event.y))
+
+    def _canvas_pan_start_cb(self, event):
+        """
+        Shift and left click on canvas. Start panning.
+        """
+        self._pan_from = (event.x, event.y)
+
+    def _canvas_pan_cb(self, event):
+        """
+        Mouse moved with shift and left button down. Pan the view along.
+        """
+        if self._pan_from is None or self._is_moving_control_point():
+            return
+        x0, y0 = self._pan_from
+        self._pan_from = (event.x, event.y)
+        self._set_view(self._view.pan(event.x - x0, event.y - y0))
+
     def _canvas_2lclick_cb(self, event):
         """
         Double left click on mouse. Delete a control point.
         """
 
-        closest = self._canvas.find_closest(event.x, event.y)[0]
-        self._delete_cp(closest)
+        picked = self._pick_cp(event.x, event.y)
+        if picked is not None:
+            self._delete_cp(picked)
         self._render_cb(show_error=False)
 
     def _canvas_rclick_cb(self, event):
@@ -112,15 +213,9 @@ class UI:
             self._move_cp(event)
         else:
             # Add a control point.
-            overlapping = self._canvas.find_overlapping(event.x-self._radius,
-                    event.y-self._radius,
-                    event.x+self._radius, event.y+self._radius)
-            cps = self._canvas.find_withtag('realcp')
-            overlapping_cps = set(overlapping).intersection(set(cps))
-
-            if not len(overlapping_cps):
+            if self._pick_cp(event.x, event.y) is None:
                 # No overlapping control points.
-                self._create_cp(event.x, event.y)
+                self._add_cp(event.x, event.y)
                 self._render_cb(show_error=False)
 
     def _clear_cb(self, event=None):
@@ -131,13 +226,16 @@ class UI:
     def _draw_labels_cb(self, event=None):
         self._drawing_labels = not self._drawing_labels
 
+    def _live_preview_cb(self, event=None):
+        self._live_preview = not self._live_preview
+
     def _render_cb(self, event=None, show_error=True):
         # Grab data.
         s = self._editbox_text.get("0.0", "end")
         lines = s.split('\n')
         text_control_points, knotvec, self._degree, self._dt = parse_data(lines)
 
-        if len(self._canvas.find_withtag('realcp')):
+        if self._cp_items:
             control_points = self._cp_coords()
             use_text_cps = False
         else:
@@ -145,28 +243,30 @@ class UI:
             use_text_cps = True
 
         # Build BSpline (all in world coordinates).
-        bspline = BSpline(degree=self._degree,dt=self._dt)
-        for cp in control_points:
-            p = ControlPoint(Point(cp[0], cp[1]))
-            bspline.insert_control_point(p)
-        bspline.replace_knot_vector(knotvec)
+        bspline = self._bspline = update_bspline(self._bspline,
+                self._bspline_dt, control_points, knotvec, self._degree,
+                self._dt)
+        self._bspline_dt = self._dt
 
         if bspline.is_valid():
-            self._clear_lines()
-            self._clear_labels()
+            self._canvas.delete('error')
 
-            # Run de Boor to find spline.
-            control_points, control_point_polars, points = bspline.render()
+            # Tessellate the visible part of the spline, finely enough for
+            # the zoom.
+            tolerance, box = view_detail(self._view, self._canvas_w,
+                    self._canvas_h, self._radius)
+            control_points, control_point_polars, points = bspline.render(
+                    as_array=True, tolerance=tolerance, box=box)
 
             # Scale and translate points for drawing.
-            drawing_control_points = world2canvas(control_points,
-                    self._canvas_w, self._canvas_h, self._perpixel)
-            drawing_points = world2canvas(points, self._canvas_w,
-                    self._canvas_h, self._perpixel)
+            drawing_control_points = self._view.apply(control_points).tolist()
+            drawing_points = self._view.apply(points, out=points)
 
             # Draw.
             if self._drawing_labels:
                 self._draw_labels(drawing_control_points, control_point_polars)
+            else:
+                self._clear_labels()
             self._draw_lines(drawing_points)
             if use_text_cps:
                 self._draw_control_points(drawing_control_points)
@@ -176,23 +276,128 @@ class UI:
                 self._canvas.create_text(self._canvas_w/2, self._canvas_h/2-100,
                         text=UI._ERROR_MSG, tags=('text','error'))
 
+    def _start_preview(self, cp):
+        """
+        Starts live preview of dragging the control point item cp.
+        """
+        if not self._live_preview:
+            return
+        lines = self._editbox_text.get("0.0", "end").split('\n')
+        text_control_points, knotvec, degree, dt = parse_data(lines)
+        self._preview_state = (self._cp_coords(), self._cp_items.index(cp),
+                knotvec, degree, dt)
+        self._poll_preview()
+
+    def _stop_preview(self):
+        """
+        Stops live preview, dropping any preview still being computed.
+        """
+        self._preview_state = None
+        self._preview.cancel()
+        if self._preview_after is not None:
+            self._master.after_cancel(self._preview_after)
+            self._preview_after = None
+
+    def _poll_preview(self):
+        """
+        Draws the newest finished preview, if any, and checks again after
+        PREVIEW_POLL_MS until the drag ends. Runs on the Tk thread.
+        """
+        self._preview_after = None
+        if self._preview_state is None:
+            return
+        points = self._preview.result()
+        if points is not None:
+            self._draw_lines(points)
+        self._preview_after = self._master.after(PREVIEW_POLL_MS,
+                self._poll_preview)
+
+    def _evaluate_preview(self, request):
+        """
+        Returns the canvas points of the curve for a preview request, or
+        None if it is not valid. Runs on the preview worker thread.
+        """
+        control_points, knotvec, degree, dt, view = request
+        bspline = self._preview_bspline = update_bspline(
+                self._preview_bspline, self._preview_bspline_dt,
+                control_points, knotvec, degree, dt)
+        self._preview_bspline_dt = dt
+        if not bspline.is_valid():
+            return None
+        tolerance, box = view_detail(view, self._canvas_w, self._canvas_h,
+                self._radius)
+        points = bspline.render(as_array=True, tolerance=tolerance,
+                box=box)[2]
+        return view.apply(points, out=points)
+
     def _is_control_point(self, obj):
-        tags = self._canvas.gettags(obj)
-        return 'realcp' in tags
+        return obj in self._cp_grid
+
+    def _canvas2world(self, x, y):
+        """
+        Returns canvas point (x, y) in world coordinates.
+        """
+        wx, wy = self._view_inverse.apply([(x, y)])[0]
+        return wx, wy
+
+    def _set_view(self, view):
+        """
+        Shows the world through view: moves the control points and axes to
+        match and redraws the curve at the new level of detail.
+        """
+        self._view = view
+        self._view_inverse = view.invert()
+        self._perpixel = view.scale()
+
+        # The grid cell follows the pick radius in world units.
+        points = self._cp_coords()
+        grid = PointGrid(cell=2.0*self._radius/self._perpixel)
+        r = self._radius
+        for item, (wx, wy), (x, y) in zip(self._cp_items, points,
+                view.apply(points).tolist()):
+            grid.insert(item, wx, wy)
+            self._canvas.coords(item, x-r, y-r, x+r, y+r)
+        self._cp_grid = grid
+
+        ox, oy = view.offset
+        self._canvas.coords(self._axis_item, ox, oy)
+        self._render_cb(show_error=False)
+
+    def _pick_cp(self, x, y):
+        """
+        Returns the control point item under canvas point (x, y), or None.
+        """
+        wx, wy = self._canvas2world(x, y)
+        return self._cp_grid.nearest(wx, wy, float(self._radius) /
+                self._perpixel)
 
     def _is_moving_control_point(self):
         return self._moving_cp != -1
 
-    def _create_cp(self, x, y, tags=('cp','realcp'), color=None, outline=None):
+    def _create_cp(self, x, y, tags=('cp',), color=None, outline=None):
         color = color if color else UI._COLOR_CP_FILL
         outline = outline if outline else UI._COLOR_CP_OUTLINE
         oval = self._canvas.create_oval(x-self._radius, y-self._radius,
                 x+self._radius, y+self._radius, fill=color, outline=outline, tags=tags)
         return oval
 
+    def _add_cp(self, x, y):
+        """
+        Adds a control point at canvas point (x, y) to the end of the curve.
+        """
+        oval = self._create_cp(x, y)
+        wx, wy = self._canvas2world(x, y)
+        self._cp_items.append(oval)
+        self._cp_grid.insert(oval, wx, wy)
+        return oval
+
     def _delete_cp(self, obj):
         if self._is_control_point(obj):
             self._canvas.delete(obj)
+            self._cp_items.remove(obj)
+            self._cp_grid.remove(obj)
+            if self._hover_cp == obj:
+                self._hover_cp = None
 
     def _move_cp(self, event):
         if self._is_moving_control_point():
@@ -202,52 +407,58 @@ class UI:
                     event.x+self._radius, event.y+self._radius)
             self._canvas.itemconfigure(self._moving_cp, fill=UI._COLOR_CP_FILL,
                     outline=UI._COLOR_CP_OUTLINE)
-            self._canvas.dtag(self._moving_cp, 'fakecp')
-            self._canvas.addtag_withtag('realcp', self._moving_cp)
+            wx, wy = self._canvas2world(event.x, event.y)
+            self._cp_grid.move(self._moving_cp, wx, wy)
             self._moving_cp = -1
 
             # Delete tracer.
             self._canvas.delete(self._moving_cp_tracer)
             self._moving_cp_tracer = -1
 
+            self._stop_preview()
             self._render_cb(show_error=False)
         else:
             # Start moving control point.
-            closest = self._canvas.find_closest(event.x, event.y)[0]
-            if not self._is_control_point(closest):
+            closest = self._pick_cp(event.x, event.y)
+            if closest is None:
                 return
             self._moving_cp = closest
             coords = self._canvas.coords(closest)
+            self._start_preview(closest)
 
             # Show point as a 'temporary' point
             self._canvas.itemconfigure(closest, fill=UI._COLOR_CP_TEMP_FILL,
                     outline=UI._COLOR_CP_TEMP_OUTLINE)
-            self._canvas.dtag(closest, 'realcp')
-            self._canvas.addtag_withtag(closest, 'fakecp')
 
             # Create tracer.
-            self._moving_cp_tracer = self._create_cp(event.x, event.y,
-                    tags=('cp', 'fakecp'))
+            self._moving_cp_tracer = self._create_cp(event.x, event.y)
 
     def _cp_coords(self):
         """
         Return the control points draw on screen in world coordinates.
         """
-        cps = self._canvas.find_withtag('realcp')
-        cps_canvas = map(lambda obj : find_center(*(self._canvas.coords(obj))), cps)
-        return canvas2world(cps_canvas, self._canvas_w, self._canvas_h,
-                self._perpixel)
+        return [self._cp_grid.get(obj) for obj in self._cp_items]
 
     def _clear_cps(self):
         self._canvas.delete('cp')
+        self._cp_items = []
+        self._cp_grid.clear()
+        self._hover_cp = None
 
     def _clear_lines(self):
         self._canvas.delete('line')
+        self._line = None
 
     def _clear_labels(self):
         self._canvas.delete('text')
+        self._labels = []
 
     def _draw_labels(self, cps, polars):
+        """
+        Shows a label above each control point. Label items are kept between
+        calls: only the ones whose position or text changed are updated, and
+        items are created or deleted only when the number of points changes.
+        """
         magic = -10
 
         for i, cp in enumerate(cps):
@@ -255,19 +466,44 @@ class UI:
             
             polar = str(polars[i])
             label = "%d %s" % (i, polar)
-            self._canvas.create_text(x, y+magic, text=label,
-                    tags=('text', 'label'))
+            if i == len(self._labels):
+                item = self._canvas.create_text(x, y+magic, text=label,
+                        tags=('text', 'label'))
+                self._labels.append((item, x, y, label))
+                continue
+
+            item, old_x, old_y, old_label = self._labels[i]
+            if (old_x, old_y) != (x, y):
+                self._canvas.coords(item, x, y+magic)
+            if old_label != label:
+                self._canvas.itemconfigure(item, text=label)
+            self._labels[i] = (item, x, y, label)
+
+        for item, x, y, label in self._labels[len(cps):]:
+            self._canvas.delete(item)
+        del self._labels[len(cps):]
 
     def _draw_control_points(self, cps):
         for i, cp in enumerate(cps):
             x, y = tuple(cp)
-            self._create_cp(x, y)
+            self._add_cp(x, y)
 
     def _draw_lines(self, drawing_points):
-        for i in range(len(drawing_points)-1):
-            x1, y1 = tuple(drawing_points[i])
-            x2, y2 = tuple(drawing_points[i+1])
-            self._canvas.create_line(x1, y1, x2, y2, fill="blue", tags=('line',))
+        """
+        Draws the curve through drawing_points (an (N, 2) array) as a single
+        line item, which is moved with coords() on later calls instead of
+        being recreated.
+        """
+        if len(drawing_points) < 2:
+            self._clear_lines()
+            return
+
+        coords = drawing_points.ravel().tolist()
+        if self._line is None:
+            self._line = self._canvas.create_line(*coords, fill="blue",
+                    tags=('line',))
+        else:
+            self._canvas.coords(self._line, *coords)
 
     def show(self):
         mainloop()
@@ -284,6 +520,120 @@ dt=0.1
 
 
 
+class PreviewWorker(object):
+    """
+    Runs func(request) on a background thread, for the newest request only.
+
+    submit() replaces any request the thread has not started on, so however
+    fast requests come in, the thread is never more than one evaluation
+    behind the latest. result() hands back finished results; it never
+    blocks, so the Tk thread can poll it with after().
+    """
+    def __init__(self, func):
+        self._func = func
+        self._condition = threading.Condition()
+        self._request = None
+        self._result = None
+        self._generation = 0
+        self._cancelled = 0
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, request):
+        """
+        Asks for func(request), dropping the pending request if there is one.
+        """
+        with self._condition:
+            self._generation += 1
+            self._request = (self._generation, request)
+            self._condition.notify()
+
+    def result(self):
+        """
+        Returns the newest result not returned before, or None.
+        """
+        with self._condition:
+            result, self._result = self._result, None
+        return result
+
+    def cancel(self):
+        """
+        Drops the pending request, and the result of every request submitted
+        so far, including one being evaluated now.
+        """
+        with self._condition:
+            self._request = None
+            self._result = None
+            self._cancelled = self._generation
+
+    def stop(self):
+        """
+        Stops the thread once it finishes the current evaluation.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                generation, request = self._request
+                self._request = None
+
+            try:
+                result = self._func(request)
+            except Exception:
+                # A preview that cannot be computed is not shown. The drop
+                # renders synchronously and reports the error.
+                result = None
+
+            with self._condition:
+                if generation > self._cancelled and result is not None:
+                    self._result = result
+
+def view_detail(view, width, height, margin=0):
+    """
+    Returns (tolerance, box) for drawing a curve through view, a
+    util.ViewTransform, on a width x height canvas: the tolerance in world
+    units that keeps the polyline within LOD_PIXEL_TOLERANCE pixels of the
+    curve, and the world box the canvas shows, grown by margin pixels.
+
+    The tolerance is rounded down to a power of two, so that nearby zooms
+    share one level of detail and its cached tessellation.
+    """
+    tolerance = 2.0 ** math.floor(math.log(LOD_PIXEL_TOLERANCE /
+        view.scale(), 2))
+    return tolerance, view.world_box(width, height, margin)
+
+def update_bspline(bspline, bspline_dt, control_points, knotvec, degree, dt):
+    """
+    Returns a spline for control_points (world coordinates), knotvec, degree
+    and dt. bspline, built for dt bspline_dt, is reused when only control
+    points moved: just those are replaced, so that it only re-evaluates the
+    knot spans they affect.
+    """
+    if (bspline is None or bspline.degree != degree or bspline_dt != dt
+            or len(bspline.user_points) != len(control_points)):
+        bspline = BSpline(degree=degree,dt=dt)
+        for cp in control_points:
+            p = ControlPoint(Point(cp[0], cp[1]))
+            bspline.insert_control_point(p)
+    else:
+        for old, cp in zip(bspline.user_points[:], control_points):
+            if old.x() != cp[0] or old.y() != cp[1]:
+                p = ControlPoint(Point(cp[0], cp[1]))
+                bspline.replace_control_point(old, p)
+    bspline.replace_knot_vector(knotvec)
+    return bspline
+
 def main(argv):
     drawui = UI()
     drawui.show()
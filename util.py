@@ -1,4 +1,6 @@
 import sys
+import math
+import numpy
 
 def epsilon_equals(f1, f2, epsilon=0.0001):
     return abs(f1-f2) < epsilon
@@ -52,39 +54,249 @@ def parse_data(lines=None, filename=None):
 
     return points, knotvec, degree, dt
 
-def world2canvas(points, width, height, perpixel):
+class DataParseException(Exception):
+    def __init__(self, message, lineno):
+        Exception.__init__(self, "line %d: %s" % (lineno, message))
+        self.lineno = lineno
+
+def iter_data(lines=None, filename=None):
+    """
+    Streams the curve records of a data file, one at a time. Yields tuples of
+    points, knotvec, degree, dt and lineno (the line the record starts on),
+    where points, knotvec, degree and dt are as returned by parse_data.
+
+    A file holds any number of records in the parse_data syntax. Each record
+    starts with its degree= line:
+
+        degree=3
+        dt=0.1
+        (1, 3)
+        ...
+        [0,0,0,1,3,4,4,4]
+        degree=2
+        ...
+
+    Blank lines and lines starting with # are skipped. Throws
+    DataParseException, which carries the line number, on malformed lines and
+    on a record with more than one knot vector.
+    """
+    if filename:
+        lines = open(filename, 'r')
+    try:
+        record = None
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+
+            if line.startswith("degree"):
+                if record is not None:
+                    yield tuple(record)
+                record = [[], [], None, None, lineno]
+            elif record is None:
+                raise DataParseException("expected degree= before %r" % line,
+                        lineno)
+
+            try:
+                if line[0] == '(':
+                    point = map(float, line.strip('()').split(','))
+                    if len(point) != 2:
+                        raise ValueError()
+                    record[0].append(point)
+                elif line[0] == '[':
+                    if record[1]:
+                        raise DataParseException("second knot vector in curve",
+                                lineno)
+                    record[1] = map(float, line.strip('[]').split(','))
+                elif line.startswith("degree"):
+                    record[2] = int(line.split('=')[1])
+                elif line.startswith("dt"):
+                    record[3] = float(line.split('=')[1])
+                else:
+                    raise ValueError()
+            except (ValueError, IndexError):
+                raise DataParseException("could not parse %r" % line, lineno)
+
+        if record is not None:
+            yield tuple(record)
+    finally:
+        if filename:
+            lines.close()
+
+def world2canvas(points, width, height, perpixel, perpixel_y=None):
     """
     Converts from world coordinates to canvas coordinates.
 
     In canvas coordiantes, (0,0) is at the top-left corner where +x is right and
     +y is down.  In world coordinates, (0,0) is in the middle where +x is right and
     +y is up.
+
+    perpixel_y scales y separately from x, if given.
     """
     halfwidth = width/2
     halfheight = height/2
+    if perpixel_y is None:
+        perpixel_y = perpixel
 
     transformed = []
     for p in points:
         x = p[0] * perpixel + halfwidth
-        y = halfheight - p[1] * perpixel 
+        y = halfheight - p[1] * perpixel_y
         transformed.append((x,y))
 
     return transformed
 
-def canvas2world(points, width, height, perpixel):
+def canvas2world(points, width, height, perpixel, perpixel_y=None):
     """
     Converts from canvas coordinates to world coordinates.
     """
     halfwidth = width/2
     halfheight = height/2
+    if perpixel_y is None:
+        perpixel_y = perpixel
 
     transformed = []
     for p in points:
         x = (p[0] - halfwidth) / perpixel
-        y = (halfheight - p[1]) / perpixel
+        y = (halfheight - p[1]) / perpixel_y
         transformed.append((x,y))
 
     return transformed
 
+def world2canvas_array(points, width, height, perpixel, perpixel_y=None,
+        out=None):
+    """
+    Array version of world2canvas. Transforms an (N, 2) array of points and
+    returns an (N, 2) float64 array, written to out if given (which may be
+    points itself).
+    """
+    return ViewTransform.canvas(width, height, perpixel,
+            perpixel_y).apply(points, out)
+
+def canvas2world_array(points, width, height, perpixel, perpixel_y=None,
+        out=None):
+    """
+    Array version of canvas2world. See world2canvas_array.
+    """
+    return ViewTransform.canvas(width, height, perpixel,
+            perpixel_y).invert().apply(points, out)
+
+class ViewTransform(object):
+    """
+    Affine transform from world to canvas coordinates:
+
+        canvas = matrix . world + offset
+
+    where matrix is 2x2. Transforms are immutable: pan(), zoom(), rotate()
+    and invert() return new ones. apply() transforms whole (N, 2) arrays of
+    points at once.
+    """
+    def __init__(self, matrix=None, offset=None):
+        self.matrix = numpy.array(matrix if matrix is not None else
+                numpy.identity(2), dtype=numpy.float64)
+        self.offset = numpy.array(offset if offset is not None else (0, 0),
+                dtype=numpy.float64)
+
+    @classmethod
+    def canvas(cls, width, height, perpixel, perpixel_y=None):
+        """
+        Returns the transform of world2canvas: world (0,0) at the middle of a
+        width x height canvas, scaled by perpixel, with +y flipped to point up.
+        """
+        if perpixel_y is None:
+            perpixel_y = perpixel
+        return cls([[perpixel, 0], [0, -perpixel_y]],
+                (width/2, height/2))
+
+    def pan(self, dx, dy):
+        """
+        Returns this transform followed by a move of (dx, dy) canvas units.
+        """
+        return ViewTransform(self.matrix, self.offset + (dx, dy))
+
+    def zoom(self, factor, cx=0, cy=0):
+        """
+        Returns this transform followed by scaling by factor about the canvas
+        point (cx, cy).
+        """
+        return self._then([[factor, 0], [0, factor]], cx, cy)
+
+    def rotate(self, angle, cx=0, cy=0):
+        """
+        Returns this transform followed by a rotation by angle radians about
+        the canvas point (cx, cy). Positive angles turn clockwise on the
+        canvas, since canvas +y is down.
+        """
+        c, s = math.cos(angle), math.sin(angle)
+        return self._then([[c, -s], [s, c]], cx, cy)
+
+    def invert(self):
+        """
+        Returns the inverse transform, from canvas to world coordinates.
+        """
+        matrix = numpy.linalg.inv(self.matrix)
+        return ViewTransform(matrix, -matrix.dot(self.offset))
+
+    def apply(self, points, out=None):
+        """
+        Transforms an (N, 2) array-like of points. Returns an (N, 2) float64
+        array, or out if given. out may be points itself, and may be of any
+        float dtype and layout; the fast paths are taken only for contiguous
+        float64.
+        """
+        points = numpy.ascontiguousarray(points,
+                dtype=numpy.float64).reshape((-1, 2))
+        if out is None:
+            out = numpy.empty_like(points)
+        direct = out.dtype == numpy.float64 and out.flags.c_contiguous
+        (a, b), (c, d) = self.matrix
+        if direct and ((a == d and b == -c) or (a == -d and b == c)):
+            # Pan, uniform zoom and rotate, mirrored or not, is a complex
+            # multiply and add on (x + iy), which runs over contiguous memory
+            # much faster than broadcasting a 2x2 matrix.
+            z = points.view(numpy.complex128).ravel()
+            w = out.view(numpy.complex128).ravel()
+            if a == d:
+                numpy.multiply(z, complex(a, c), out=w)
+            else:
+                numpy.conjugate(z, out=w)
+                numpy.multiply(w, complex(a, c), out=w)
+            numpy.add(w, complex(*self.offset), out=w)
+            return out
+
+        if not direct or numpy.may_share_memory(out, points):
+            out[...] = points.dot(self.matrix.T)
+        else:
+            numpy.dot(points, self.matrix.T, out=out)
+        out += self.offset
+        return out
+
+    def scale(self):
+        """
+        Returns the most canvas units a world unit is stretched to, in any
+        direction.
+        """
+        return numpy.linalg.norm(self.matrix, 2)
+
+    def world_box(self, width, height, margin=0):
+        """
+        Returns the world box (xmin, ymin, xmax, ymax) that covers a width x
+        height canvas, grown by margin canvas units on every side.
+        """
+        corners = self.invert().apply([(-margin, -margin),
+            (width + margin, -margin), (-margin, height + margin),
+            (width + margin, height + margin)])
+        low, high = corners.min(axis=0), corners.max(axis=0)
+        return (low[0], low[1], high[0], high[1])
+
+    def _then(self, matrix, cx, cy):
+        """
+        Returns this transform followed by matrix applied about (cx, cy).
+        """
+        matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        center = numpy.array((cx, cy), dtype=numpy.float64)
+        return ViewTransform(matrix.dot(self.matrix),
+                matrix.dot(self.offset - center) + center)
+
 def find_center(x1, y1, x2, y2):
     return (x1 + (x2 - x1) / 2, y1 + (y2 - y1) / 2)